@@ -0,0 +1,159 @@
+import alert_engine
+import coingecko_cog
+import collections
+import discord
+import logging
+
+from discord.ext import commands, tasks
+from discord.commands import Option, SlashCommandGroup
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# Discord message length limit.
+MAX_MESSAGE_LENGTH = 2000
+
+
+async def check_prices(cg, engine):
+    """Prices every watched coin and returns the alerts that fired, as engine.evaluate()."""
+    ids = engine.watched_ids()
+    if not ids:
+        return []
+
+    # One simple/price call covers every watched coin.
+    return await engine.evaluate(await coingecko_cog.fetch_prices(cg, ids))
+
+
+class AlertCog(commands.Cog):
+    alert = SlashCommandGroup('alert', 'Price alerts')
+
+    def __init__(self, client, cg, engine, interval=None, check=True):
+        self.client = client
+        self.cg = cg
+        self.engine = engine
+        self.interval = interval or {'minutes': 1}
+        # Without check the alerts are checked by whoever owns the engine, see shared_state.
+        if check:
+            self.check_alerts.start()
+
+    def cog_unload(self):
+        self.check_alerts.cancel()
+
+    @alert.command(name='add')
+    async def add_alert(
+        self,
+        ctx,
+        id: Option(str, 'Coingecko id or Symbol', autocomplete=coingecko_cog.symbol_id_searcher),
+        direction: Option(str, 'Alert when the price goes', choices=[alert_engine.ABOVE, alert_engine.BELOW]),
+        price: Option(float, 'Price in USD', min_value=0),
+        is_id: Option(bool, 'True if Coingecko id', required=False, default=False),
+    ):
+        """Alerts you when a cryptocurrency's price crosses a threshold."""
+        crypto, warning = coingecko_cog.resolve_coin(self.cg, id, is_id)
+        if not crypto:
+            await ctx.respond(f'Hi {ctx.author.mention}\n'
+                           f'Unfortunately Coin/Token {id} doesn\'t appear to exist.', ephemeral=True)
+            return
+
+        try:
+            alert = await self.engine.add(ctx.author.id, ctx.channel_id, crypto, direction, price, ctx.guild_id)
+        except alert_engine.AlertLimitReached:
+            await ctx.respond(f'You already have {self.engine.max_per_user} alerts, remove one first.', ephemeral=True)
+            return
+
+        message = f'Alert #{alert.id} set for {crypto} going {direction} {coingecko_cog.price_str(alert.threshold)}'
+        if warning:
+            message += f'\n{warning}'
+        await ctx.respond(message, ephemeral=True)
+
+    @alert.command(name='list')
+    async def list_alerts(self, ctx):
+        """Lists your price alerts."""
+        alerts = await self.engine.for_user(ctx.author.id)
+        if not alerts:
+            await ctx.respond('You have no alerts.', ephemeral=True)
+            return
+
+        lines = [f'#{a.id}: {a.coin_id} {a.direction} {coingecko_cog.price_str(a.threshold)}' for a in alerts]
+        await ctx.respond('\n'.join(lines), ephemeral=True)
+
+    @alert.command(name='remove')
+    async def remove_alert(
+        self,
+        ctx,
+        alert_id: Option(int, 'Alert number from /alert list'),
+    ):
+        """Removes one of your price alerts."""
+        if await self.engine.remove(ctx.author.id, alert_id):
+            await ctx.respond(f'Removed alert #{alert_id}.', ephemeral=True)
+        else:
+            await ctx.respond(f'You have no alert #{alert_id}.', ephemeral=True)
+
+    @tasks.loop(minutes=1)
+    async def check_alerts(self):
+        try:
+            with METRICS.timer('update_loop_seconds', loop='alerts'):
+                await self.do_check_alerts()
+        except Exception as e:
+            logger.exception(e)
+
+    @check_alerts.before_loop
+    async def before_check_alerts(self):
+        await self.client.wait_until_ready()
+        self.check_alerts.change_interval(**self.interval)
+
+    async def do_check_alerts(self):
+        fired = await check_prices(self.cg, self.engine)
+        if fired:
+            await self.notify(fired)
+
+    def owns(self, alert):
+        """Whether this client sends alert when the shards are split between worker processes.
+
+        That is the worker whose shards have the alert's server. Alerts from
+        direct messages go to the one with shard 0, like Discord sends them.
+        """
+        shard_ids = getattr(self.client, 'shard_ids', None)
+        if shard_ids is None:
+            return True
+        shard = (alert.guild_id >> 22) % self.client.shard_count if alert.guild_id else 0
+        return shard in shard_ids
+
+    async def notify_own(self, fired):
+        """Sends the fired alerts this shard worker owns, the other workers send the rest."""
+        fired = [(alert, price) for alert, price in fired if self.owns(alert)]
+        if fired:
+            await self.notify(fired)
+
+    async def notify(self, fired):
+        """Sends fired alerts, one message per channel however many fired there."""
+        by_channel = collections.defaultdict(list)
+        for alert, price in fired:
+            by_channel[alert.channel_id].append(
+                f'<@{alert.user_id}> {alert.coin_id} is {alert.direction} '
+                f'{coingecko_cog.price_str(alert.threshold)} (now {coingecko_cog.price_str(price)})')
+
+        for channel_id, lines in by_channel.items():
+            channel = self.client.get_channel(channel_id)
+            if channel is None:
+                # Direct messages often aren't cached, nor are channels on other shards.
+                try:
+                    channel = await self.client.fetch_channel(channel_id)
+                except discord.HTTPException as e:
+                    logger.warning('Dropping %d alerts for unavailable channel %s: %s', len(lines), channel_id, e)
+                    continue
+
+            message = ''
+            for line in lines:
+                if len(message) + len(line) + 1 > MAX_MESSAGE_LENGTH:
+                    await self.__send(channel, message)
+                    message = ''
+                message = f'{message}\n{line}' if message else line
+            await self.__send(channel, message)
+
+    async def __send(self, channel, message):
+        try:
+            with METRICS.timer('discord_send_seconds', kind='alert'):
+                await channel.send(message, allowed_mentions=discord.AllowedMentions(users=True))
+        except discord.HTTPException:
+            logger.exception('Could not send alerts to %s', channel.id)
@@ -0,0 +1,140 @@
+import asyncio
+import bisect
+import collections
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+ABOVE = 'above'
+BELOW = 'below'
+
+# guild_id is None for alerts set in direct messages, and in files saved before it was kept.
+Alert = collections.namedtuple('Alert', 'id user_id channel_id coin_id direction threshold guild_id', defaults=(None,))
+
+
+class AlertLimitReached(Exception):
+    """Raised when a user already has the maximum number of alerts."""
+
+
+class AlertEngine:
+    """Price alerts indexed by coin and direction for fast evaluation.
+
+    Each coin keeps its thresholds sorted, one list per direction. Alerts that
+    fire for a price are always a prefix (above) or suffix (below) of these
+    lists, so evaluating a tick is a bisection per watched coin plus the
+    alerts that fire. Fired alerts are removed.
+    """
+
+    def __init__(self, path=None, max_per_user=10):
+        self.path = path
+        self.max_per_user = max_per_user
+        # int (alert id) -> Alert
+        self.alerts = dict()
+        # str (coin id) -> {direction: sorted list of (threshold, alert id)}
+        self.thresholds = dict()
+        # int (user id) -> set[alert id]
+        self.by_user = collections.defaultdict(set)
+        self.next_id = 1
+        # Saves are written one at a time, the latest state last.
+        self.save_lock = asyncio.Lock()
+        self.load()
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            state = json.load(f)
+        for fields in state.get('alerts', []):
+            self.__index(Alert(*fields))
+        self.next_id = state.get('next_id', max(self.alerts, default=0) + 1)
+
+    async def save(self):
+        """Writes the alerts in a thread, so the disk doesn't hold up the event loop."""
+        if not self.path:
+            return
+        data = json.dumps({'next_id': self.next_id, 'alerts': list(self.alerts.values())})
+        async with self.save_lock:
+            await asyncio.to_thread(self.__write, data)
+
+    def __write(self, data):
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+    def __index(self, alert):
+        self.alerts[alert.id] = alert
+        self.by_user[alert.user_id].add(alert.id)
+        lists = self.thresholds.setdefault(alert.coin_id, {ABOVE: [], BELOW: []})
+        bisect.insort(lists[alert.direction], (alert.threshold, alert.id))
+
+    def __unindex(self, alert):
+        del self.alerts[alert.id]
+        self.by_user[alert.user_id].discard(alert.id)
+        if not self.by_user[alert.user_id]:
+            del self.by_user[alert.user_id]
+
+    async def add(self, user_id, channel_id, coin_id, direction, threshold, guild_id=None):
+        if direction not in (ABOVE, BELOW):
+            raise ValueError(f'direction must be {ABOVE} or {BELOW}')
+        if len(self.by_user.get(user_id, ())) >= self.max_per_user:
+            raise AlertLimitReached()
+
+        alert = Alert(self.next_id, user_id, channel_id, coin_id, direction, float(threshold), guild_id)
+        self.next_id += 1
+        self.__index(alert)
+        await self.save()
+        return alert
+
+    async def remove(self, user_id, alert_id):
+        """Removes one of user_id's alerts, returns False if they have no such alert."""
+        alert = self.alerts.get(alert_id)
+        if alert is None or alert.user_id != user_id:
+            return False
+
+        self.__unindex(alert)
+        lists = self.thresholds[alert.coin_id]
+        entries = lists[alert.direction]
+        del entries[bisect.bisect_left(entries, (alert.threshold, alert.id))]
+        if not lists[ABOVE] and not lists[BELOW]:
+            del self.thresholds[alert.coin_id]
+        await self.save()
+        return True
+
+    async def for_user(self, user_id):
+        return sorted((self.alerts[id] for id in self.by_user.get(user_id, ())), key=lambda a: a.id)
+
+    def watched_ids(self):
+        return list(self.thresholds)
+
+    async def evaluate(self, prices):
+        """Fires and removes alerts crossed by prices, a dict of coin id -> price.
+
+        Returns a list of (alert, price).
+        """
+        fired = []
+        for coin_id, price in prices.items():
+            lists = self.thresholds.get(coin_id)
+            if lists is None or price is None:
+                continue
+
+            above = lists[ABOVE]
+            k = bisect.bisect_right(above, (price, float('inf')))
+            fired.extend((self.alerts[id], price) for _, id in above[:k])
+            del above[:k]
+
+            below = lists[BELOW]
+            k = bisect.bisect_left(below, (price, float('-inf')))
+            fired.extend((self.alerts[id], price) for _, id in below[k:])
+            del below[k:]
+
+            if not above and not below:
+                del self.thresholds[coin_id]
+
+        for alert, _ in fired:
+            self.__unindex(alert)
+        if fired:
+            await self.save()
+        return fired
@@ -0,0 +1,200 @@
+import aiohttp
+import asyncio
+import coingecko_helper
+import json
+import logging
+import os
+
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# Discord allows this many embeds per message.
+MAX_BATCH = 10
+
+# Discord rejects messages whose embeds have more characters than this in total.
+MAX_MESSAGE_LENGTH = 6000
+
+# Number of announced ids remembered to avoid duplicates.
+MAX_ANNOUNCED = 10000
+
+# Seconds before a coin whose info couldn't be fetched or sent is tried again.
+RETRY_DELAY = 60
+
+# Times a coin is sent on its own before its announcement is given up.
+MAX_SEND_ATTEMPTS = 3
+
+
+def message_length(message):
+    """Characters Discord counts against MAX_MESSAGE_LENGTH in channel.send kwargs."""
+    embeds = message.get('embeds') or ([message['embed']] if message.get('embed') else [])
+    return sum(len(embed) for embed in embeds)
+
+
+class NewCoinAnnouncer:
+    """Posts new coins to a channel.
+
+    Coin info is fetched by a few concurrent workers and handed to a single
+    sender. When the sender falls behind, ready coins are grouped into one
+    message with several embeds, as many as fit in MAX_MESSAGE_LENGTH.
+    Coins of a message that failed are retried on their own, so one bad coin
+    doesn't hold back the rest. Sends are rate limited to stay under
+    Discord's per-channel limit.
+
+    Ids waiting to be announced and the ids already announced are saved to
+    state_path, so a restart neither drops nor repeats announcements.
+    """
+
+    def __init__(self, client, cg, channel_id, build_message, state_path=None,
+                 fetch_concurrency=4, batch_size=MAX_BATCH, sends_per_period=5, send_period=5):
+        self.client = client
+        self.cg = cg
+        self.channel_id = channel_id
+        # list of coin info -> channel.send kwargs
+        self.build_message = build_message
+        self.state_path = state_path
+        self.fetch_concurrency = fetch_concurrency
+        self.batch_size = min(batch_size, MAX_BATCH)
+        self.send_limiter = coingecko_helper.TokenBucket(sends_per_period / send_period, sends_per_period)
+        # Insertion ordered sets of coin ids.
+        self.pending = dict()
+        self.announced = dict()
+        # str (coin id) -> failed sends, for coins sent on their own after one
+        self.failed_sends = dict()
+        self.queue = None
+        self.ready = None
+        self.tasks = []
+        self.load()
+
+    def load(self):
+        if not self.state_path or not os.path.exists(self.state_path):
+            return
+        with open(self.state_path) as f:
+            state = json.load(f)
+        self.announced = dict.fromkeys(state.get('announced', []))
+        self.pending = dict.fromkeys(id for id in state.get('pending', []) if id not in self.announced)
+
+    def save(self):
+        if not self.state_path:
+            return
+        state = {'announced': list(self.announced), 'pending': list(self.pending)}
+        tmp_path = f'{self.state_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def start(self):
+        """Starts the fetch and send workers and resumes pending announcements."""
+        if self.tasks:
+            return
+        self.queue = asyncio.Queue()
+        self.ready = asyncio.Queue()
+        for id in self.pending:
+            self.queue.put_nowait(id)
+        self.tasks = [asyncio.ensure_future(self.__fetch_worker()) for _ in range(self.fetch_concurrency)]
+        self.tasks.append(asyncio.ensure_future(self.__send_worker()))
+
+    def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+
+    def enqueue(self, ids):
+        """Queues coin ids for announcement, ignoring ones already seen."""
+        self.start()
+        added = [id for id in ids if id not in self.pending and id not in self.announced]
+        for id in added:
+            self.pending[id] = None
+            self.queue.put_nowait(id)
+        if added:
+            self.save()
+            logger.info('Queued %d new coins for announcement', len(added))
+
+    async def __fetch_worker(self):
+        while True:
+            id = await self.queue.get()
+            try:
+                info = await self.cg.coin_by_id(id, priority=coingecko_helper.PRIORITY_BACKGROUND)
+            except aiohttp.ClientResponseError as e:
+                if e.status == 404:
+                    logger.info('New coin %s disappeared before it was announced', id)
+                    self.__mark_announced([id])
+                    continue
+                logger.warning('Could not fetch new coin %s: %s', id, e)
+                info = None
+            except Exception:
+                logger.exception('Could not fetch new coin %s', id)
+                info = None
+
+            if info:
+                await self.ready.put(info)
+            else:
+                asyncio.get_running_loop().call_later(RETRY_DELAY, self.queue.put_nowait, id)
+
+    def __next_batch(self, first):
+        """Returns (infos, send kwargs, left over info) for first and the ready coins fitting in one message."""
+        batch = [first]
+        message = self.build_message(batch)
+        if first['id'] in self.failed_sends:
+            return batch, message, None
+        # Anything that became ready while waiting goes out together.
+        while len(batch) < self.batch_size and not self.ready.empty():
+            info = self.ready.get_nowait()
+            if info['id'] in self.failed_sends:
+                return batch, message, info
+            grown = self.build_message(batch + [info])
+            if message_length(grown) > MAX_MESSAGE_LENGTH:
+                return batch, message, info
+            batch.append(info)
+            message = grown
+        return batch, message, None
+
+    async def __send_worker(self):
+        left_over = None
+        while True:
+            first = left_over or await self.ready.get()
+            left_over = None
+            await self.send_limiter.acquire()
+
+            channel = self.client.get_channel(self.channel_id)
+            if channel is None:
+                logger.warning('New crypto channel %s is unavailable', self.channel_id)
+                self.queue.put_nowait(first['id'])
+                while not self.ready.empty():
+                    self.queue.put_nowait(self.ready.get_nowait()['id'])
+                await asyncio.sleep(RETRY_DELAY)
+                continue
+
+            batch, message, left_over = self.__next_batch(first)
+            ids = [info['id'] for info in batch]
+            try:
+                with METRICS.timer('discord_send_seconds', kind='announcement'):
+                    await channel.send(**message)
+            except Exception:
+                logger.exception('Could not announce %s', ', '.join(ids))
+                self.__send_failed(ids)
+                continue
+
+            self.__mark_announced(ids)
+
+    def __send_failed(self, ids):
+        for id in ids:
+            failures = self.failed_sends.get(id, 0)
+            if len(ids) == 1:
+                failures += 1
+            if failures >= MAX_SEND_ATTEMPTS:
+                logger.error('Giving up announcing %s after %d failed sends', id, failures)
+                self.__mark_announced([id])
+                continue
+            # Sent on its own from now on.
+            self.failed_sends[id] = failures
+            asyncio.get_running_loop().call_later(RETRY_DELAY, self.queue.put_nowait, id)
+
+    def __mark_announced(self, ids):
+        for id in ids:
+            self.pending.pop(id, None)
+            self.failed_sends.pop(id, None)
+            self.announced[id] = None
+        while len(self.announced) > MAX_ANNOUNCED:
+            del self.announced[next(iter(self.announced))]
+        self.save()
@@ -0,0 +1,240 @@
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import string
+import time
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+DAY = 24 * 60 * 60
+
+# Coins with their own sorted symbol, the rest share one of these.
+SHARED_SYMBOL_FRACTION = 0.1
+
+
+def coin_seed(id):
+    return int.from_bytes(hashlib.blake2b(id.encode(), digest_size=8).digest(), 'little')
+
+
+def synthetic_coins_list(count, seed=0):
+    """Returns count coins/list entries with CoinGecko-like ids, symbols and names."""
+    rng = random.Random(seed)
+    coins = []
+    ids = set()
+    shared = []
+    while len(coins) < count:
+        word = ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 10)))
+        id = word if rng.random() < 0.5 else f'{word}-{rng.choice(["token", "coin", "finance", "protocol", "inu"])}'
+        if id in ids:
+            continue
+        ids.add(id)
+        if shared and rng.random() < SHARED_SYMBOL_FRACTION:
+            symbol = rng.choice(shared)
+        else:
+            symbol = word[:rng.randint(3, 5)]
+            shared.append(symbol)
+        coins.append({'id': id, 'symbol': symbol, 'name': id.replace('-', ' ').title()})
+    return coins
+
+
+def price_at(id, t):
+    """Deterministic, smooth looking price of id at unix time t."""
+    seed = coin_seed(id)
+    base = 10 ** ((seed % 1000) / 1000 * 8 - 4)
+    phase = (seed >> 10) % 1000
+    days = t / DAY
+    wave = math.sin(days / 30 + phase) * 0.3 + math.sin(days / 3 + phase * 7) * 0.1 + math.sin(days * 6 + phase) * 0.02
+    return base * math.exp(wave)
+
+
+class FakeCoinGecko:
+    """Serves the CoinGecko endpoints the bot uses from fixtures, without the real API.
+
+    Every response is delayed by latency seconds, plus up to jitter seconds,
+    and answered with a 429 with probability error_rate. Recorded fixtures
+    from record_fixtures.py are used when fixtures_dir has them, otherwise
+    responses are synthesized from count coins.
+    """
+
+    def __init__(self, count=15000, latency=0.05, jitter=0.02, error_rate=0.0, retry_after=1, fixtures_dir=None, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.coin_template = {}
+        self.markets = None
+        self.coins = None
+        if fixtures_dir:
+            self.__load_fixtures(fixtures_dir)
+        if self.coins is None:
+            self.coins = synthetic_coins_list(count, seed)
+        self.by_id = {coin['id']: coin for coin in self.coins}
+        # endpoint -> requests served
+        self.requests = dict()
+        self.throttled = 0
+        self.runner = None
+        self.url = None
+
+    def __load_fixtures(self, fixtures_dir):
+        def load(name):
+            path = os.path.join(fixtures_dir, name)
+            if not os.path.exists(path):
+                return None
+            with open(path) as f:
+                return json.load(f)
+
+        self.coins = load('coins_list.json')
+        self.coin_template = load('coin.json') or {}
+        self.markets = load('coins_markets.json')
+
+    def churn(self, added=10, removed=2):
+        """Changes the coin list like a typical hourly update."""
+        for _ in range(min(removed, len(self.coins))):
+            coin = self.coins.pop(self.rng.randrange(len(self.coins)))
+            del self.by_id[coin['id']]
+        new_coins = synthetic_coins_list(added, seed=self.rng.random())
+        for coin in new_coins:
+            if coin['id'] not in self.by_id:
+                self.coins.append(coin)
+                self.by_id[coin['id']] = coin
+        # Replace the list so the client sees a new response.
+        self.coins = list(self.coins)
+
+    def rank(self, id):
+        return coin_seed(id) % len(self.coins) + 1
+
+    async def start(self, host='127.0.0.1', port=0):
+        app = web.Application(middlewares=[self.__middleware])
+        app.router.add_get('/api/v3/ping', self.ping)
+        app.router.add_get('/api/v3/coins/list', self.coins_list)
+        app.router.add_get('/api/v3/coins/markets', self.coins_markets)
+        app.router.add_get('/api/v3/simple/price', self.simple_price)
+        app.router.add_get('/api/v3/exchange_rates', self.exchange_rates)
+        app.router.add_get('/api/v3/coins/{id}/market_chart/range', self.market_chart_range)
+        app.router.add_get('/api/v3/coins/{id}/', self.coin)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f'http://{host}:{port}/api/v3/'
+        return self.url
+
+    async def close(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+    @web.middleware
+    async def __middleware(self, request, handler):
+        route = request.match_info.route.resource
+        endpoint = route.canonical if route else request.path
+        self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+        await asyncio.sleep(self.latency + self.rng.random() * self.jitter)
+        if self.rng.random() < self.error_rate:
+            self.throttled += 1
+            return web.json_response({'status': {'error_code': 429}}, status=429,
+                                     headers={'Retry-After': str(self.retry_after)})
+        return await handler(request)
+
+    async def ping(self, request):
+        return web.json_response({'gecko_says': '(V3) To the Moon!'})
+
+    async def coins_list(self, request):
+        return web.json_response(self.coins)
+
+    def __market_row(self, coin, now):
+        id = coin['id']
+        price = price_at(id, now)
+        def change(days):
+            return (price / price_at(id, now - days * DAY) - 1) * 100
+        return {
+            'id': id,
+            'symbol': coin['symbol'],
+            'name': coin['name'],
+            'image': f'https://example.invalid/{id}.png',
+            'current_price': price,
+            'market_cap': price * 1e6,
+            'market_cap_rank': self.rank(id),
+            'high_24h': price * 1.05,
+            'low_24h': price * 0.95,
+            'price_change_percentage_1h_in_currency': change(1 / 24),
+            'price_change_percentage_24h_in_currency': change(1),
+            'price_change_percentage_7d_in_currency': change(7),
+            'price_change_percentage_14d_in_currency': change(14),
+            'price_change_percentage_30d_in_currency': change(30),
+            'price_change_percentage_1y_in_currency': change(365),
+        }
+
+    async def coins_markets(self, request):
+        query = request.query
+        per_page = min(250, int(query.get('per_page', 100)))
+        page = int(query.get('page', 1))
+        if self.markets is not None and 'ids' not in query:
+            return web.json_response(self.markets[(page - 1) * per_page:page * per_page])
+
+        now = time.time()
+        if 'ids' in query:
+            coins = [self.by_id[id] for id in query['ids'].split(',') if id in self.by_id]
+        else:
+            coins = sorted(self.coins, key=lambda coin: self.rank(coin['id']))
+        coins = coins[(page - 1) * per_page:page * per_page]
+        return web.json_response([self.__market_row(coin, now) for coin in coins])
+
+    async def simple_price(self, request):
+        now = time.time()
+        ids = request.query.get('ids', '').split(',')
+        return web.json_response({id: {'usd': price_at(id, now)} for id in ids if id in self.by_id})
+
+    async def exchange_rates(self, request):
+        # BTC denominated like CoinGecko's.
+        btc = price_at('bitcoin', time.time())
+        rates = {'btc': ('Bitcoin', 1.0, 'crypto'), 'usd': ('US Dollar', btc, 'fiat'),
+                 'eur': ('Euro', btc * 0.92, 'fiat'), 'jpy': ('Japanese Yen', btc * 150.0, 'fiat')}
+        return web.json_response({'rates': {code: {'name': name, 'unit': code.upper(), 'value': value, 'type': kind}
+                                            for code, (name, value, kind) in rates.items()}})
+
+    async def coin(self, request):
+        id = request.match_info['id']
+        coin = self.by_id.get(id)
+        if coin is None:
+            return web.json_response({'error': 'coin not found'}, status=404)
+
+        info = dict(self.coin_template)
+        row = self.__market_row(coin, time.time())
+        info.update(id=id, symbol=coin['symbol'], name=coin['name'], market_cap_rank=row['market_cap_rank'])
+        info.setdefault('description', {'en': f'<p>{coin["name"]} is a <a href="https://example.invalid">token</a>.</p>' * 20})
+        info.setdefault('links', {'homepage': [f'https://example.invalid/{id}', '', '']})
+        info['image'] = {'small': row['image'], 'large': row['image']}
+        info['sentiment_votes_up_percentage'] = coin_seed(id) % 10000 / 100
+        info['market_data'] = {
+            'current_price': {'usd': row['current_price']},
+            'high_24h': {'usd': row['high_24h']},
+            'low_24h': {'usd': row['low_24h']},
+            'price_change_percentage_1h_in_currency': {'usd': row['price_change_percentage_1h_in_currency']},
+            'price_change_percentage_24h': row['price_change_percentage_24h_in_currency'],
+            'price_change_percentage_7d': row['price_change_percentage_7d_in_currency'],
+            'price_change_percentage_14d': row['price_change_percentage_14d_in_currency'],
+            'price_change_percentage_30d': row['price_change_percentage_30d_in_currency'],
+            'price_change_percentage_1y': row['price_change_percentage_1y_in_currency'],
+        }
+        return web.json_response(info)
+
+    async def market_chart_range(self, request):
+        id = request.match_info['id']
+        if id not in self.by_id:
+            return web.json_response({'error': 'coin not found'}, status=404)
+
+        start = int(float(request.query['from']))
+        end = int(float(request.query['to']))
+        # CoinGecko picks the granularity from the length of the range.
+        span = end - start
+        step = 5 * 60 if span <= DAY else 60 * 60 if span <= 90 * DAY else DAY
+        prices = [[t * 1000, price_at(id, t)] for t in range(start - start % step + step, end + 1, step)]
+        return web.json_response({'prices': prices, 'market_caps': [], 'total_volumes': []})
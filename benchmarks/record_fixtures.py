@@ -0,0 +1,39 @@
+"""Records CoinGecko responses for fake_coingecko.py to serve.
+
+Usage: python benchmarks/record_fixtures.py [directory]
+"""
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import coingecko_helper
+
+
+async def record(directory):
+    os.makedirs(directory, exist_ok=True)
+    cg = coingecko_helper.CoinGeckoAPI()
+    try:
+        fixtures = {
+            'coins_list.json': await cg.coins_list(),
+            'coins_markets.json': [
+                row
+                for page in (1, 2)
+                for row in await cg.coins_markets(vs_currency='usd', order='market_cap_desc', per_page=250, page=page,
+                                                  price_change_percentage='1h,24h,7d,14d,30d,1y')
+            ],
+            'coin.json': await cg.coin_by_id('bitcoin'),
+        }
+    finally:
+        await cg.close()
+
+    for name, data in fixtures.items():
+        with open(os.path.join(directory, name), 'w') as f:
+            json.dump(data, f)
+        print(f'Wrote {name}')
+
+
+if __name__ == '__main__':
+    asyncio.run(record(sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), 'fixtures')))
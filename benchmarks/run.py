@@ -0,0 +1,218 @@
+"""Benchmarks the bot against a local CoinGecko stand-in, no network or Discord needed.
+
+Usage: python benchmarks/run.py [--coins 15000] [--requests 200] [--latency 0.05] ...
+"""
+import argparse
+import asyncio
+import collections
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import chart_renderer
+import coingecko_cog
+import coingecko_helper
+import fake_coingecko
+
+Result = collections.namedtuple('Result', 'name latencies elapsed')
+
+
+class StubUser:
+    id = 1
+    mention = '<@1>'
+
+
+class StubContext:
+    """Stands in for a slash command ApplicationContext, keeping what was sent."""
+
+    def __init__(self):
+        self.author = StubUser()
+        self.channel_id = 1
+        self.guild_id = None
+        self.responses = []
+
+    async def defer(self):
+        pass
+
+    async def respond(self, content=None, **kwargs):
+        # Building the payload is part of the cost of a response.
+        embeds = kwargs.get('embeds') or ([kwargs['embed']] if kwargs.get('embed') else [])
+        payload = [embed.to_dict() for embed in embeds]
+        self.responses.append((content, payload))
+
+
+class StubAutocompleteContext:
+    def __init__(self, value):
+        self.value = value
+
+
+class StubClient:
+    """Never becomes ready, so the cog's background loops stay idle."""
+
+    latency = float('nan')
+
+    async def wait_until_ready(self):
+        await asyncio.Event().wait()
+
+    def get_channel(self, id):
+        return None
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def measure(name, calls, concurrency=1):
+    """Runs the coroutine functions in calls, at most concurrency at a time."""
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def timed(call):
+        async with semaphore:
+            start = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(timed(call) for call in calls))
+    return Result(name, latencies, time.perf_counter() - start)
+
+
+def report(results):
+    print(f'{"benchmark":<28} {"n":>6} {"ops/s":>9} {"p50 ms":>9} {"p99 ms":>9}')
+    for result in results:
+        n = len(result.latencies)
+        print(f'{result.name:<28} {n:>6} {n / result.elapsed:>9.1f} '
+              f'{percentile(result.latencies, 0.5) * 1000:>9.2f} {percentile(result.latencies, 0.99) * 1000:>9.2f}')
+
+
+def invoke(cog, command, **kwargs):
+    """Calls a slash command's handler directly, as the cog is never added to a bot."""
+    return command.callback(cog, StubContext(), **kwargs)
+
+
+def make_api(url, args):
+    return coingecko_helper.CoinGeckoAPI(url, calls_per_minute=args.calls_per_minute, burst=args.burst)
+
+
+async def bench_new_coins(url, server, args):
+    results = []
+
+    async def first_load():
+        cg = make_api(url, args)
+        try:
+            await cg.new_coins()
+        finally:
+            await cg.close()
+
+    results.append(await measure('new_coins (first load)', [first_load] * args.iterations))
+
+    cg = make_api(url, args)
+    await cg.new_coins()
+
+    async def incremental():
+        server.churn(added=args.churn, removed=max(1, args.churn // 5))
+        cg.cache.clear()
+        await cg.new_coins()
+
+    results.append(await measure('new_coins (incremental)', [incremental] * args.iterations))
+    await cg.close()
+    return results
+
+
+async def bench_commands(url, server, args):
+    rng = random.Random(args.seed)
+    cg = make_api(url, args)
+    await cg.new_coins()
+    renderer = chart_renderer.ChartRenderer(max_pending=max(8, args.concurrency))
+    cog = coingecko_cog.CoinGeckoCog(StubClient(), cg, renderer=renderer)
+    renderer.start()
+    # The cog does this once the bot is ready, keep first use imports out of the timings.
+    coingecko_cog.preload_modules()
+
+    ids = sorted(cg.coins)
+    symbols = sorted(cg.symbol_map)
+    results = []
+    try:
+        def prefixes(count):
+            keys = ids + symbols
+            return [rng.choice(keys)[:rng.randint(1, 4)] for _ in range(count)]
+
+        for name, searcher in (('autocomplete symbol+id', cog.symbol_id_searcher),
+                               ('autocomplete multi', cog.multi_symbol_id_searcher)):
+            calls = [lambda p=p: searcher(StubAutocompleteContext(p)) for p in prefixes(args.requests * 10)]
+            results.append(await measure(name, calls))
+
+        def price_call():
+            names = ' '.join(rng.choice(ids) for _ in range(rng.randint(1, 3)))
+            return lambda: invoke(cog, cog.price, id=names, is_id=False)
+        results.append(await measure('/price', [price_call() for _ in range(args.requests)], args.concurrency))
+
+        def info_call():
+            id = rng.choice(ids)
+            return lambda: invoke(cog, cog.info, id=id, is_id=True)
+        results.append(await measure('/info', [info_call() for _ in range(args.requests)], args.concurrency))
+
+        def history_call():
+            id = rng.choice(ids)
+            start = rng.choice(['1 day ago', '30 days ago', '1 year ago'])
+            return lambda: invoke(cog, cog.price_history, id=id, is_id=True, start=start, end=None, style='line')
+        # Warm the render workers up before timing them.
+        await history_call()()
+        results.append(await measure('/history', [history_call() for _ in range(max(1, args.requests // 4))], args.concurrency))
+
+        def compare_call():
+            names = ' '.join(rng.sample(ids, 3))
+            start = rng.choice(['1 day ago', '30 days ago', '1 year ago'])
+            return lambda: invoke(cog, cog.price_history, id=names, is_id=True, start=start, end=None, style='line')
+        results.append(await measure('/history compare', [compare_call() for _ in range(max(1, args.requests // 4))], args.concurrency))
+    finally:
+        cog.cog_unload()
+        await cg.close()
+
+    print(f'Cache: {cg.cache_stats()}')
+    return results
+
+
+async def main(args):
+    os.chdir(ROOT)
+    server = fake_coingecko.FakeCoinGecko(
+        count=args.coins, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        retry_after=args.retry_after, fixtures_dir=args.fixtures, seed=args.seed)
+    url = await server.start()
+    print(f'Serving {len(server.coins)} coins from {url}')
+    try:
+        results = []
+        if args.only in (None, 'new_coins'):
+            results += await bench_new_coins(url, server, args)
+        if args.only in (None, 'commands'):
+            results += await bench_commands(url, server, args)
+    finally:
+        await server.close()
+
+    print(f'Server requests: {dict(sorted(server.requests.items()))}, throttled: {server.throttled}')
+    report(results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline CryptoBot benchmarks')
+    parser.add_argument('--coins', type=int, default=15000, help='coins/list size when not using recorded fixtures')
+    parser.add_argument('--fixtures', help='directory of responses saved by record_fixtures.py')
+    parser.add_argument('--requests', type=int, default=200, help='commands timed per benchmark')
+    parser.add_argument('--concurrency', type=int, default=10, help='commands in flight at once')
+    parser.add_argument('--iterations', type=int, default=5, help='new_coins calls timed')
+    parser.add_argument('--churn', type=int, default=20, help='coins added per incremental new_coins')
+    parser.add_argument('--latency', type=float, default=0.05, help='server response delay in seconds')
+    parser.add_argument('--jitter', type=float, default=0.02, help='extra random delay up to this many seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with a 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with a 429')
+    parser.add_argument('--calls-per-minute', type=float, default=1e6, help='client rate limit, the real API allows 30')
+    parser.add_argument('--burst', type=int, default=1000, help='client rate limit burst')
+    parser.add_argument('--only', choices=['new_coins', 'commands'])
+    parser.add_argument('--seed', type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
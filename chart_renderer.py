@@ -0,0 +1,180 @@
+import asyncio
+import concurrent.futures
+import io
+import logging
+import multiprocessing
+import sys
+import types
+
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# Number of candles drawn for candlestick charts.
+CANDLES = 60
+
+
+class RendererBusy(Exception):
+    """Raised when the render queue is full."""
+
+
+def fig2buf(fig):
+    """Convert a Matplotlib figure to a buffer and return it"""
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png')
+    buf.seek(0)
+    return buf
+
+
+class WorkerProcess(multiprocessing.context.SpawnProcess):
+    """A spawned chart worker that doesn't import the bot.
+
+    Spawned processes run the parent's main script again, as __mp_main__,
+    before taking work. For the bot that is cryptobot.py and everything it
+    imports, when workers only need numpy and matplotlib. While a worker is
+    launched the main module is swapped for an empty one, so it has none.
+    """
+
+    def start(self):
+        main = sys.modules['__main__']
+        sys.modules['__main__'] = types.ModuleType('__main__')
+        try:
+            super().start()
+        finally:
+            sys.modules['__main__'] = main
+
+
+class WorkerContext(multiprocessing.context.SpawnContext):
+    Process = WorkerProcess
+
+
+def _init_worker():
+    # Pay for the matplotlib import once per worker rather than on the first chart.
+    import matplotlib.figure
+    import price_series
+
+
+def render_price_history(times, prices, label, style='line'):
+    """Draws a price history chart and returns the PNG bytes.
+
+    times are millisecond timestamps and prices a matching array. The series
+    is downsampled to the chart's pixel width first, so drawing costs the
+    same however long the range is. style is 'line' or 'candles'.
+
+    Runs in a worker process. Uses the Figure API directly so no pyplot
+    global state is involved.
+    """
+    # Only workers draw charts, so the bot itself never imports these.
+    import numpy as np
+    import price_series
+    from matplotlib.figure import Figure
+
+    fig = Figure()
+    ax = fig.subplots()
+    width = int(fig.get_size_inches()[0] * fig.dpi)
+
+    if style == 'candles':
+        times, opens, highs, lows, closes = price_series.ohlc(times, prices, CANDLES)
+        dates = times.astype('datetime64[ms]')
+        # Bars are sized in days on a date axis.
+        bar_width = (times[1] - times[0]) / 86400000 * 0.8 if len(times) > 1 else 0.8
+        colors = np.where(closes >= opens, 'green', 'red')
+        ax.vlines(dates, lows, highs, colors=colors, linewidth=0.8, label=label)
+        ax.bar(dates, closes - opens, bottom=opens, width=bar_width, color=colors)
+    else:
+        times, prices = price_series.lttb(times, prices, width)
+        ax.plot(times.astype('datetime64[ms]'), prices, label=label)
+
+    ax.legend(bbox_to_anchor=(1.04, 1), loc="upper left")
+    fig.tight_layout()
+    fig.autofmt_xdate()
+    return fig2buf(fig).getvalue()
+
+
+def render_comparison(series, labels):
+    """Draws several coins' price histories as percent change from the start.
+
+    series is a list of (times, prices) arrays as for render_price_history.
+    They are resampled onto one grid as wide as the chart, a coin without
+    data for part of the range is left blank there.
+    """
+    import price_series
+    from matplotlib.figure import Figure
+    from matplotlib.ticker import PercentFormatter
+
+    fig = Figure()
+    ax = fig.subplots()
+    width = int(fig.get_size_inches()[0] * fig.dpi)
+
+    times, rows = price_series.align(series, width)
+    dates = times.astype('datetime64[ms]')
+    for label, changes in zip(labels, price_series.percent_change(rows)):
+        ax.plot(dates, changes, label=label)
+    ax.axhline(0, color='grey', linewidth=0.5)
+    ax.yaxis.set_major_formatter(PercentFormatter())
+
+    ax.legend(bbox_to_anchor=(1.04, 1), loc="upper left")
+    fig.tight_layout()
+    fig.autofmt_xdate()
+    return fig2buf(fig).getvalue()
+
+
+class ChartRenderer:
+    """Runs chart rendering functions in a process pool, off the event loop.
+
+    At most max_pending renders are queued or running at once, further
+    requests raise RendererBusy. A render taking longer than timeout raises
+    asyncio.TimeoutError; its worker keeps going until the chart is done
+    and holds its place in max_pending until then.
+    """
+
+    def __init__(self, workers=2, max_pending=8, timeout=30):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.pending = 0
+        self.executor = None
+
+    def __executor(self):
+        if self.executor is None:
+            # spawn rather than fork, forking a process with a running loop and threads isn't safe.
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=WorkerContext(),
+                initializer=_init_worker)
+        return self.executor
+
+    def start(self):
+        """Starts the worker processes ahead of the first render."""
+        executor = self.__executor()
+        for _ in range(self.workers):
+            executor.submit(_init_worker)
+
+    async def render(self, func, *args):
+        """Returns func(*args) computed in a worker process."""
+        if self.pending >= self.max_pending:
+            raise RendererBusy()
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.__executor(), func, *args)
+        self.pending += 1
+        # Released when the worker is done, not when the caller stops waiting.
+        future.add_done_callback(self.__release)
+        try:
+            with METRICS.timer('chart_render_seconds', chart=func.__name__):
+                return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except concurrent.futures.process.BrokenProcessPool:
+            logger.exception('Chart worker died, restarting the pool')
+            self.close()
+            raise
+
+    def __release(self, future):
+        self.pending -= 1
+        if not future.cancelled():
+            # Retrieved so a render finishing after its timeout isn't logged as unhandled.
+            future.exception()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
@@ -0,0 +1,116 @@
+import bisect
+import difflib
+import heapq
+import itertools
+
+# Rank given to keys without a known market cap rank.
+UNRANKED = 1 << 30
+
+# Autocomplete can only show this many choices.
+MAX_RESULTS = 25
+
+
+class PrefixIndex:
+    """Sorted key index answering ranked prefix queries for autocomplete.
+
+    Matches for a prefix are a contiguous slice of the sorted keys, found by
+    bisection. Short prefixes cover a large part of the index so their ranked
+    results are memoized until a key under them is added or removed.
+    """
+
+    def __init__(self, keys=(), rank=None, memo_length=2, fuzzy_candidates=1000):
+        # key -> market cap rank, lower is better.
+        self.rank = rank or (lambda key: UNRANKED)
+        self.memo_length = memo_length
+        self.fuzzy_candidates = fuzzy_candidates
+        # prefix -> ranked list of at most MAX_RESULTS keys
+        self.memo = dict()
+        self.keys = []
+        self.rebuild(keys)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        i = bisect.bisect_left(self.keys, key)
+        return i < len(self.keys) and self.keys[i] == key
+
+    def rebuild(self, keys):
+        self.keys = sorted(set(keys))
+        self.memo.clear()
+
+    def add(self, key):
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return
+        self.keys.insert(i, key)
+        self.__invalidate(key)
+
+    def remove(self, key):
+        i = bisect.bisect_left(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            return
+        del self.keys[i]
+        self.__invalidate(key)
+
+    def invalidate(self):
+        """Drops memoized results, call when ranks change."""
+        self.memo.clear()
+
+    def __invalidate(self, key):
+        for n in range(min(len(key), self.memo_length) + 1):
+            self.memo.pop(key[:n], None)
+
+    def sort_key(self, key, prefix):
+        # Exact match first, then by rank, then shortest.
+        return (key != prefix, self.rank(key), len(key), key)
+
+    def prefix_range(self, prefix):
+        lo = bisect.bisect_left(self.keys, prefix)
+        if not prefix:
+            return lo, len(self.keys)
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return lo, bisect.bisect_left(self.keys, upper, lo)
+
+    def search(self, prefix, limit=MAX_RESULTS):
+        """Returns up to limit keys starting with prefix, best ranked first.
+
+        Falls back to close matches when nothing starts with prefix.
+        """
+        limit = min(limit, MAX_RESULTS)
+        if len(prefix) <= self.memo_length:
+            results = self.memo.get(prefix)
+            if results is None:
+                results = self.memo[prefix] = self.__ranked(prefix, MAX_RESULTS)
+            return results[:limit]
+
+        return self.__ranked(prefix, limit) or self.__fuzzy(prefix, limit)
+
+    def __ranked(self, prefix, limit):
+        lo, hi = self.prefix_range(prefix)
+        matches = itertools.islice(self.keys, lo, hi)
+        if hi - lo <= limit:
+            return sorted(matches, key=lambda k: self.sort_key(k, prefix))
+        return heapq.nsmallest(limit, matches, key=lambda k: self.sort_key(k, prefix))
+
+    def __fuzzy(self, prefix, limit):
+        # Back off to the longest prefix that still matches something, then
+        # score those candidates against what was typed.
+        for n in range(len(prefix) - 1, 0, -1):
+            lo, hi = self.prefix_range(prefix[:n])
+            if lo != hi:
+                break
+        else:
+            return []
+
+        scored = []
+        matcher = difflib.SequenceMatcher(b=prefix)
+        for key in itertools.islice(self.keys, lo, min(hi, lo + self.fuzzy_candidates)):
+            matcher.set_seq1(key[:len(prefix)])
+            if matcher.real_quick_ratio() < 0.6 or matcher.quick_ratio() < 0.6:
+                continue
+            score = matcher.ratio()
+            if score >= 0.6:
+                scored.append((-score, self.rank(key), len(key), key))
+
+        return [key for *_, key in heapq.nsmallest(limit, scored)]
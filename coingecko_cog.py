@@ -1,21 +1,27 @@
+import announcer
 import asyncio
+import chart_renderer
+import coingecko_helper
+import collections
+import concurrent.futures
 import discord
 import datetime
-import dateparser
+import fx_rates
+import guild_settings
+import hashlib
+import history_store
+import hot_cache
+import importlib
 import io
 import logging
+import market_snapshot
 import random
 import time
 import uuid
 
-import matplotlib.pyplot as plt
-
 from discord.ext import commands, tasks
 from discord.commands import Option, slash_command
-from markdownify import markdownify
-from PIL import ImageFont
-from PIL import Image
-from PIL import ImageDraw
+from metrics import METRICS
 
 
 GUILD_IDS = []
@@ -34,6 +40,28 @@ PRICE_CHANGE_DICT = {
 
 TIMES = ['1y', '30d', '14d', '7d', '24h', '1h']
 
+# Slow to import and only needed by some commands, so they are imported on
+# first use or by preload_modules() once the bot is up.
+DEFERRED_IMPORTS = ['dateparser', 'markdownify', 'PIL.Image', 'PIL.ImageDraw', 'PIL.ImageFont', 'price_series']
+
+# Discord allows this many embeds per message.
+MAX_EMBEDS = 10
+
+# Discord rejects autocomplete choices longer than this.
+MAX_CHOICE_LENGTH = 100
+
+# A cached /price embed, built from a market snapshot row at rate units per USD.
+PriceEmbed = collections.namedtuple('PriceEmbed', 'row rate embed')
+
+# Coins /history draws on one comparison chart.
+MAX_COMPARE = 5
+
+# Discord embed description length limit.
+MAX_DESCRIPTION = 4096
+
+# Coin ids per simple/price request.
+PRICES_BATCH = 250
+
 HTML_STRIP = [
 'a', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
 'p', 'br', 'ol', 'ul', 'hr', 'image', 'table', 'footer',
@@ -41,6 +69,16 @@ HTML_STRIP = [
 ]
 
 
+def preload_modules(names=DEFERRED_IMPORTS):
+    """Imports names ahead of the commands needing them, returns seconds taken per module."""
+    times = dict()
+    for name in names:
+        start = time.perf_counter()
+        importlib.import_module(name)
+        times[name] = time.perf_counter() - start
+    return times
+
+
 def price_str(price, max_decimals=18, target='USD'):
     format_str = f'%.{max_decimals}f'
     ret = str(price)
@@ -54,34 +92,159 @@ def price_str(price, max_decimals=18, target='USD'):
 
 
 # TODO allow disabling sentiment bar images.
-# TODO move into a class and optimize.
-def create_sentiment_bar(w, h, love):
-    text_size = 12
-    font = ImageFont.truetype('assets/Courier-Prime.ttf', text_size)
-
-    out = Image.new("RGBA", (w, h + 2 * text_size), (255, 255, 255, 0))
-    d = ImageDraw.Draw(out)
-    d.rectangle((0, text_size, w, h + text_size), fill="black")
-    
-    mid = round((w - 4) * love)
-    if love != 0:
-        d.rectangle((2, 2 + text_size, mid, h - 2 + text_size), fill="green")
-    if love != 1:
-        d.rectangle((mid, 2 + text_size, w - 3, h - 2 + text_size), fill="red")
-
-    d.text((0, 1), "Good", "white", font=font)
-    d.text((1, 2 + h + text_size), f"{round(love * 100)}%", "white", font=font)
-
-    c_width = font.getsize("-")[0]
-    d.text((w - c_width * 4 + 7, 1), "Bad", "white", font=font)
-    hate_str = f"{round((1-love) * 100)}%"
-    d.text((w - c_width * len(hate_str) - 2, 2 + h + text_size), hate_str, "white", font=font)
-
-    arr = io.BytesIO()
-    out.save(arr, format='PNG')
-    arr.seek(0)
-
-    return arr
+class SentimentBar:
+    """Draws the good/bad sentiment bar shown on coin info embeds.
+
+    The image only depends on the whole percentage so each one is encoded
+    once and the PNG bytes reused.
+    """
+
+    def __init__(self, w=160, h=16, font_path='assets/Courier-Prime.ttf', text_size=12):
+        self.w = w
+        self.h = h
+        self.font_path = font_path
+        self.text_size = text_size
+        self.font = None
+        # int (percent) -> PNG bytes
+        self.images = dict()
+
+    def png(self, love):
+        """Returns the PNG bytes for love, a fraction from 0 to 1."""
+        percent = min(100, max(0, round(love * 100)))
+        image = self.images.get(percent)
+        if image is None:
+            image = self.images[percent] = self.__render(percent / 100.0)
+        return image
+
+    def warm_up(self):
+        """Renders every percentage ahead of time."""
+        for percent in range(101):
+            self.png(percent / 100.0)
+
+    def __render(self, love):
+        from PIL import Image, ImageDraw, ImageFont
+
+        w, h, text_size = self.w, self.h, self.text_size
+        if self.font is None:
+            self.font = ImageFont.truetype(self.font_path, text_size)
+        font = self.font
+
+        out = Image.new("RGBA", (w, h + 2 * text_size), (255, 255, 255, 0))
+        d = ImageDraw.Draw(out)
+        d.rectangle((0, text_size, w, h + text_size), fill="black")
+
+        mid = round((w - 4) * love)
+        if love != 0:
+            d.rectangle((2, 2 + text_size, mid, h - 2 + text_size), fill="green")
+        if love != 1:
+            d.rectangle((mid, 2 + text_size, w - 3, h - 2 + text_size), fill="red")
+
+        d.text((0, 1), "Good", "white", font=font)
+        d.text((1, 2 + h + text_size), f"{round(love * 100)}%", "white", font=font)
+
+        c_width = font.getlength("-")
+        d.text((w - c_width * 4 + 7, 1), "Bad", "white", font=font)
+        hate_str = f"{round((1-love) * 100)}%"
+        d.text((w - c_width * len(hate_str) - 2, 2 + h + text_size), hate_str, "white", font=font)
+
+        arr = io.BytesIO()
+        out.save(arr, format='PNG')
+        return arr.getvalue()
+
+
+SENTIMENT_BAR = SentimentBar()
+
+
+def shorten(text, length):
+    """Cuts text to at most length characters, marking the cut with '...'."""
+    if len(text) <= length:
+        return text
+    if length < 3:
+        return ''
+    return text[:length - 3].rstrip() + '...'
+
+
+def fit_descriptions(embeds, budget):
+    """Shortens the embeds' descriptions so all of them total at most budget characters.
+
+    Descriptions share what the other fields leave equally, a short one
+    passing what it doesn't need on to the longer ones.
+    """
+    lengths = [len(embed.description or '') for embed in embeds]
+    room = budget - sum(len(embed) for embed in embeds) + sum(lengths)
+    if room >= sum(lengths):
+        return
+    by_length = sorted(range(len(embeds)), key=lengths.__getitem__)
+    for left, i in enumerate(by_length):
+        allowance = min(lengths[i], max(0, room // (len(by_length) - left)))
+        room -= allowance
+        if allowance < lengths[i]:
+            embeds[i].description = shorten(embeds[i].description, allowance)
+
+
+def truncate_html(html, length):
+    """Cuts html to at most length characters without leaving half a tag."""
+    html = html[:length]
+    tag_start = html.rfind('<')
+    if tag_start > html.rfind('>'):
+        html = html[:tag_start]
+    return html
+
+
+class DescriptionRenderer:
+    """Converts coin descriptions from HTML to embed markdown, remembering the results.
+
+    Entries are keyed by coin id and a hash of the HTML so an edited
+    description is converted again. Long descriptions are converted a
+    slice at a time until there is enough text to fill an embed.
+    """
+
+    def __init__(self, max_size=1024, limit=MAX_DESCRIPTION):
+        self.max_size = max_size
+        self.limit = limit
+        self.converter = None
+        # (coin id, HTML digest) -> markdown, least recently used first.
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, id, html):
+        key = (id, hashlib.blake2b(html.encode(), digest_size=16).digest())
+        markdown = self.entries.get(key)
+        if markdown is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return markdown
+
+        self.misses += 1
+        markdown = self.entries[key] = self.__convert(html)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        return markdown
+
+    def __convert(self, html):
+        if self.converter is None:
+            from markdownify import MarkdownConverter
+            self.converter = MarkdownConverter(strip=HTML_STRIP)
+
+        # Start with twice the limit, markup mostly disappears when converted.
+        length = 2 * self.limit
+        while True:
+            truncated = len(html) > length
+            markdown = self.converter.convert(truncate_html(html, length) if truncated else html).strip()
+            if not truncated or len(markdown) >= self.limit:
+                break
+            length *= 2
+
+        if truncated or len(markdown) > self.limit:
+            markdown = shorten(markdown, self.limit)
+        return markdown
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries)}
+
+
+DESCRIPTIONS = DescriptionRenderer()
 
 
 def format_crypto_info(info_map):
@@ -99,7 +262,7 @@ def format_crypto_info(info_map):
     else:
         index = description.find('\r\n\r')
         description =  description[:index] if index != -1 else description
-        description = markdownify(description, strip=HTML_STRIP)
+        description = DESCRIPTIONS.render(id, description)
     
     embed = discord.Embed(
         title=f'{name} ({symbol}){rank}',
@@ -113,14 +276,15 @@ def format_crypto_info(info_map):
     fp = None
     if love:
         myid = uuid.uuid4()
-        bio = create_sentiment_bar(160, 16, love / 100.0)
+        png = SENTIMENT_BAR.png(love / 100.0)
         embed.set_image(url=f"attachment://sentiment{myid}.png")
-        fp = discord.File(bio, f'sentiment{myid}.png')
+        fp = discord.File(io.BytesIO(png), f'sentiment{myid}.png')
 
     return (embed, fp)
 
 
-def format_crypto_price_info(info_map):
+def format_crypto_price_info(info_map, currency=fx_rates.USD, rate=1.0):
+    """Builds the /price embed, converting USD prices to currency at rate units per USD."""
     if not info_map:
         return discord.Embed(
             title=f'Error',
@@ -136,9 +300,10 @@ def format_crypto_price_info(info_map):
     thumbnail = info_map.get('image', {}).get('small', '')
 
     market_map = info_map.get('market_data', {})
-    price = market_map.get('current_price', {}).get('usd', 0)
-    high_24 = market_map.get('high_24h', {}).get('usd', 0)
-    low_24 = market_map.get('low_24h', {}).get('usd', 0)
+    price = market_map.get('current_price', {}).get('usd', 0) * rate
+    high_24 = market_map.get('high_24h', {}).get('usd', 0) * rate
+    low_24 = market_map.get('low_24h', {}).get('usd', 0) * rate
+    target = currency.upper()
 
     price_changes = dict()
     price_changes['1h'] = market_map.get('price_change_percentage_1h_in_currency', {}).get('usd', 0)
@@ -153,9 +318,9 @@ def format_crypto_price_info(info_map):
     if thumbnail:
         embed.set_thumbnail(url=thumbnail)
 
-    embed.add_field(name='Price', value=price_str(price))
-    embed.add_field(name='24h High', value=price_str(high_24))
-    embed.add_field(name='24h Low', value=price_str(low_24))
+    embed.add_field(name='Price', value=price_str(price, target=target))
+    embed.add_field(name='24h High', value=price_str(high_24, target=target))
+    embed.add_field(name='24h Low', value=price_str(low_24, target=target))
     
     invalid = True
     price_changes_str = dict()
@@ -174,37 +339,151 @@ def format_crypto_price_info(info_map):
     return embed
 
 
-def fig2buf(fig):
-    """Convert a Matplotlib figure to a buffer and return it"""
-    buf = io.BytesIO()
-    fig.savefig(buf, format='png')
-    buf.seek(0)
-    return buf
+def info_message(infos, warning=None, budget=announcer.MAX_MESSAGE_LENGTH):
+    """Builds send/respond kwargs showing the info embeds for one or more coins.
+
+    Descriptions are shortened to keep the embeds within budget characters in total.
+    """
+    embeds = []
+    files = []
+    buttons = []
+    for info in infos:
+        embed, fp = format_crypto_info(info)
+        if warning:
+            embed.set_footer(text=warning)
+        embeds.append(embed)
+        if fp:
+            files.append(fp)
+
+        website = (info.get('links', {}).get('homepage') or [''])[0]
+        if website:
+            label = 'Website' if len(infos) == 1 else f"{info.get('name')} Website"[:80]
+            buttons.append(discord.ui.Button(
+                    style=discord.ButtonStyle.link,
+                    label=label,
+                    url=website))
+
+    fit_descriptions(embeds, budget)
+    view = discord.ui.View(*buttons, timeout=None) if buttons else None
+    return dict(embeds=embeds, files=files or None, view=view)
+
+
+def resolve_coin(cg, id, is_id=False):
+    """Maps an id or symbol to a coin id.
+
+    Returns (coin id, warning), coin id is None if nothing matches.
+    """
+    crypto = id.lower()
+    if not is_id:
+        crypto = cg.lookup(id.upper(), preferred=True)
+        # Autocomplete offers ids alongside symbols.
+        if not crypto and id.lower() in cg.coins:
+            crypto = id.lower()
+
+    if not crypto:
+        return None, ''
+
+    warning = ''
+    if isinstance(crypto, set):
+        if len(crypto) > 1:
+            id_str = '{%s}' % (', '.join(crypto))
+            crypto = random.choice(list(crypto))
+            warning = f'Warning multiple tokens map to this symbol.\nPicked {crypto} from {id_str}'
+        else:
+            crypto = next(iter(crypto))
+
+    return crypto, warning
+
+
+async def symbol_id_searcher(cog, ctx: discord.AutocompleteContext):
+    """Autocompletes a coin id or symbol in any cog with a CoinGeckoAPI as cg."""
+    with METRICS.timer('autocomplete_seconds', field='symbol_id'):
+        return cog.cg.search(ctx.value or '')
+
+
+async def fetch_prices(cg, ids, priority=coingecko_helper.PRIORITY_BACKGROUND):
+    """Returns {coin id: USD price} for ids, PRICES_BATCH of them per simple/price request."""
+    prices = dict()
+    for start in range(0, len(ids), PRICES_BATCH):
+        prices.update(await cg.prices(ids[start:start + PRICES_BATCH], priority=priority))
+    return prices
+
+
+def split_ids(value):
+    """Splits a space or comma separated list of ids/symbols."""
+    return value.replace(',', ' ').split()
 
 
 class CoinGeckoCog(commands.Cog):
-    def __init__(self, client, cg, new_crypto_config=None):
+    def __init__(self, client, cg, new_crypto_config=None, snapshot=None, renderer=None, history=None, registry=None, warm_up_images=False,
+                 settings=None, fx=None, hot_prices_config=None, shared=False):
         self.client = client
         self.cg = cg
+        self.settings = settings or guild_settings.GuildSettings()
+        self.fx = fx or fx_rates.FxTable(cg)
+        self.registry = registry
+        self.warm_up_images = warm_up_images
+        self.history = history or history_store.HistoryStore(cg)
+        # Without a configured snapshot rows are still fetched in batches, just not kept fresh.
+        self.snapshot = snapshot or market_snapshot.MarketSnapshot(cg, top_n=0)
+        self.renderer = renderer or chart_renderer.ChartRenderer()
+
+        hot_prices_config = hot_prices_config or {}
+        # (coin id, currency) -> PriceEmbed for the most requested coins.
+        self.hot_prices = hot_cache.HotCache(hot_prices_config.get('capacity', 256))
+        # Hot coins' rows are fetched again this many seconds before they expire.
+        self.hot_prices_ahead = hot_prices_config.get('refresh_ahead', 30)
+        self.hot_prices_interval = hot_prices_config.get('interval', {'seconds': 30})
         
+        new_crypto_config = new_crypto_config or {}
         self.new_crypto_channel = new_crypto_config.get('channel')
         self.new_crypto_interval = new_crypto_config.get('interval', {'hours': 1})
+        self.announcer = None
+        if self.new_crypto_channel:
+            self.announcer = announcer.NewCoinAnnouncer(
+                client, cg, self.new_crypto_channel, info_message,
+                state_path=new_crypto_config.get('state', 'announced-coins.json'),
+                fetch_concurrency=new_crypto_config.get('fetch_concurrency', 4))
+        # Shard workers are pushed the coin list, snapshot and rates the
+        # cluster's parent refreshes, instead of each fetching them.
+        self.shared = shared
+        # Set by coins_refreshed() when the parent has a new coin list.
+        self.parent_coins = asyncio.Event()
         self.update_cryptocurrencies.start()
+        if self.snapshot.top_n and not shared:
+            self.update_market_snapshot.start()
+        self.refresh_hot_prices.start()
 
     async def symbol_searcher(self, ctx: discord.AutocompleteContext):
-        symbols = self.cg.get_symbols()
-        return [s for s in symbols if s.startswith(ctx.value.upper())]
+        with METRICS.timer('autocomplete_seconds', field='symbol'):
+            return self.cg.search_symbols(ctx.value or '')
 
     async def id_searcher(self, ctx: discord.AutocompleteContext):
-        ids = self.cg.get_ids()
-        return [s for s in ids if s.startswith(ctx.value.lower())]
-
-    async def symbol_id_searcher(self, ctx: discord.AutocompleteContext):
-        symbols = await self.symbol_searcher(ctx)
-        ids = await self.id_searcher(ctx)
-        all = symbols + ids
-        return sorted(all)
-    
+        with METRICS.timer('autocomplete_seconds', field='id'):
+            return self.cg.search_ids(ctx.value or '')
+
+    async def multi_symbol_id_searcher(self, ctx: discord.AutocompleteContext):
+        """Completes the last of several space separated ids/symbols.
+
+        Choices too long for Discord are left out, the rest are still offered.
+        """
+        value = ctx.value or ''
+        head, _, last = value.rpartition(' ')
+        prefix = f'{head} ' if head else ''
+        with METRICS.timer('autocomplete_seconds', field='multi_symbol_id'):
+            return [prefix + key for key in self.cg.search(last) if len(prefix) + len(key) <= MAX_CHOICE_LENGTH]
+
+    async def currency_searcher(self, ctx: discord.AutocompleteContext):
+        return self.fx.search(ctx.value or '')
+
+    async def currency_for(self, ctx):
+        """Returns (currency, units per USD) to show prices in for ctx's server."""
+        currency = self.settings.currency(ctx.guild_id)
+        rate = await self.fx.rate(currency)
+        if rate is None:
+            return fx_rates.USD, 1.0
+        return currency, rate
+
     @slash_command()
     async def info(
         self,
@@ -213,24 +492,12 @@ class CoinGeckoCog(commands.Cog):
         is_id: Option(bool, 'True if Coingecko ID', required=False, default=False),
     ):
         """Gets information/website for a cryptocurrency."""
-        crypto = id
-        if not is_id:
-            crypto = self.cg.lookup(id, preferred=True)
-
+        crypto, warning = resolve_coin(self.cg, id, is_id)
         if not crypto:
             await ctx.respond(f'Hi {ctx.author.mention}\n'
                            f'Unfortunately Coin/Token {id} doesn\'t appear to exist.')
             return
 
-        warning = ''
-        if isinstance(crypto, set):
-            if len(crypto) > 1:
-                id_str = '{%s}' % (', '.join(crypto))
-                crypto = random.choice(list(crypto))
-                warning = f'Warning multiple tokens map to this symbol.\nPicked {crypto} from {id_str}'
-            else:
-                crypto = next(iter(crypto))
-
         info = await self.cg.coin_by_id(crypto)
         await self.do_send_info(ctx.respond, info, warning=warning)
     
@@ -238,91 +505,121 @@ class CoinGeckoCog(commands.Cog):
     async def price(
         self,
         ctx,
-        id: Option(str, 'Coingecko id or Symbol', autocomplete=symbol_id_searcher),
-        is_id: Option(bool, 'True if Coingecko id', required=False, default=False),
+        id: Option(str, 'Coingecko ids or Symbols, space separated', autocomplete=multi_symbol_id_searcher),
+        is_id: Option(bool, 'True if Coingecko ids', required=False, default=False),
     ):
-        """Gets price information about a cryptocurrency."""
-        crypto = id
-
-        if not is_id:
-            crypto = self.cg.lookup(id, preferred=True)
-
-        if not crypto:
+        """Gets price information about one or more cryptocurrencies."""
+        names = split_ids(id)[:MAX_EMBEDS]
+        resolved = [resolve_coin(self.cg, name, is_id) for name in names]
+        unknown = [name for name, (crypto, _) in zip(names, resolved) if not crypto]
+        if not names or unknown:
             await ctx.respond(f'Hi {ctx.author.mention}\n'
-                           f'Unfortunately Coin/Token {id} doesn\'t appear to exist.')
+                           f'Unfortunately Coin/Token {", ".join(unknown) or id} doesn\'t appear to exist.')
             return
 
-        warning = ''
-        if isinstance(crypto, set):
-            if len(crypto) > 1:
-                id_str = '{%s}' % (', '.join(crypto))
-                crypto = random.choice(list(crypto))
-                warning = f'Warning multiple tokens map to this symbol.\nPicked {crypto} from {id_str}'
-            else:
-                crypto = next(iter(crypto))
-
-        embed = format_crypto_price_info(await self.cg.coin_by_id(crypto))
-        embed.set_footer(text=warning)
-        await ctx.respond(embed=embed)
+        currency, rate = await self.currency_for(ctx)
+        cryptos = [crypto for crypto, _ in resolved]
+        embeds = [self.cached_price_embed(crypto, currency, rate) for crypto in cryptos]
+        missing = [crypto for crypto, embed in zip(cryptos, embeds) if embed is None]
+        if missing:
+            # Coins in the snapshot cost nothing, the rest share one request.
+            rows = dict(zip(missing, await self.snapshot.fetch(missing)))
+            embeds = [embed or self.build_price_embed(crypto, currency, rate, rows[crypto])
+                      for crypto, embed in zip(cryptos, embeds)]
+
+        for i, (_, warning) in enumerate(resolved):
+            if warning:
+                # Cached embeds are shared, the warning goes on a copy.
+                embeds[i] = embeds[i].copy()
+                embeds[i].set_footer(text=warning)
+        await ctx.respond(embeds=embeds)
+
+    def cached_price_embed(self, crypto, currency, rate):
+        """Returns the hot cache's /price embed if it was built from the current row and rate."""
+        def current(entry):
+            return entry.row is self.snapshot.get(crypto) and entry.rate == rate
+
+        entry = self.hot_prices.get((crypto, currency), current)
+        return entry.embed if entry else None
+
+    def build_price_embed(self, crypto, currency, rate, row):
+        embed = format_crypto_price_info(market_snapshot.market_row_to_info(row), currency, rate)
+        if row is not None:
+            self.hot_prices.put((crypto, currency), PriceEmbed(row, rate, embed))
+        return embed
 
     @slash_command(name='history')
     async def price_history(
         self,
         ctx,
-        id: Option(str, 'Coingecko id or Symbol', autocomplete=symbol_id_searcher),
-        is_id: Option(bool, 'True if Coingecko id', required=False, default=False),
+        id: Option(str, 'Coingecko ids or Symbols, space separated to compare', autocomplete=multi_symbol_id_searcher),
+        is_id: Option(bool, 'True if Coingecko ids', required=False, default=False),
         start: Option(str, 'Start time', required=False, default='1 year ago'),
         end: Option(str, 'End time', required=False, default=None),
+        style: Option(str, 'Chart style, candles for one coin only', choices=['line', 'candles'], required=False, default='line'),
     ):
-        """Gets price history for a cryptocurrency."""
-        crypto = id
-
-        if not is_id:
-            crypto = self.cg.lookup(id, preferred=True)
-
-        if not crypto:
+        """Gets price history for one cryptocurrency, or compares several."""
+        names = list(dict.fromkeys(split_ids(id)))
+        resolved = [resolve_coin(self.cg, name, is_id) for name in names]
+        unknown = [name for name, (crypto, _) in zip(names, resolved) if not crypto]
+        if not names or unknown:
             await ctx.respond(f'Hi {ctx.author.mention}\n'
-                           f'Unfortunately Coin/Token {id} doesn\'t appear to exist.')
+                           f'Unfortunately Coin/Token {", ".join(unknown) or id} doesn\'t appear to exist.')
+            return
+        # A symbol and an id can name the same coin.
+        cryptos = list(dict.fromkeys(crypto for crypto, _ in resolved))[:MAX_COMPARE]
+        warning = '\n'.join(warning for _, warning in resolved if warning)
+        if len(cryptos) > 1 and style != 'line':
+            await ctx.respond('Candles can only be drawn for one coin, compare coins as lines.', ephemeral=True)
             return
 
-        warning = ''
-        if isinstance(crypto, set):
-            if len(crypto) > 1:
-                id_str = '{%s}' % (', '.join(crypto))
-                crypto = random.choice(list(crypto))
-                warning = f'Warning multiple tokens map to this symbol.\nPicked {crypto} from {id_str}'
-            else:
-                crypto = next(iter(crypto))
+        # Fetching and drawing can outlast the initial response window.
+        await ctx.defer()
 
+        import dateparser
         from_time = dateparser.parse(start)
         end_time = dateparser.parse(end) if end else datetime.datetime.now()
-        
-        kwargs = dict()
-        kwargs['from'] = int(time.mktime(from_time.timetuple()))
-        kwargs['to'] = int(time.mktime(end_time.timetuple()))
-        price_data = await self.cg.coin_price_history(crypto, **kwargs)
-        
-        history = [price for _, price in price_data['prices']]
-        times = [datetime.datetime.fromtimestamp(ts / 1000) for ts, _ in price_data['prices']]
 
-        fig1, ax1 = plt.subplots()
-        
-        ax1.plot(times, history, label=crypto)
-        ax1.legend(bbox_to_anchor=(1.04, 1), loc="upper left")
-        fig1.tight_layout()
-        fig1.autofmt_xdate()
-        
-        buf = fig2buf(fig1)
-        plt.close(fig1)
-        
-        coin_info = self.cg.get_coin_info(crypto)
+        histories = await self.history.prices_many(
+            cryptos,
+            int(time.mktime(from_time.timetuple())),
+            int(time.mktime(end_time.timetuple())))
+        missing = [crypto for crypto, (times, _) in zip(cryptos, histories) if not len(times)]
+        if missing:
+            await ctx.respond(f'No price history for {", ".join(missing)} in that time range.')
+            return
+
+        if len(cryptos) > 1:
+            # Percent change is the same in every currency, no conversion needed.
+            func, args = chart_renderer.render_comparison, (histories, cryptos)
+            name = ', '.join(self.cg.get_coin_info(crypto).name for crypto in cryptos)
+        else:
+            times, history = histories[0]
+            # Converted at today's rate, exchange_rates has no history.
+            currency, rate = await self.currency_for(ctx)
+            if rate != 1.0:
+                history = history * rate
+            func, args = chart_renderer.render_price_history, (times, history, f'{cryptos[0]} ({currency.upper()})', style)
+            name = self.cg.get_coin_info(cryptos[0]).name
+
+        try:
+            png = await self.renderer.render(func, *args)
+        except chart_renderer.RendererBusy:
+            await ctx.respond('Too many charts are being drawn right now, please try again shortly.')
+            return
+        except asyncio.TimeoutError:
+            await ctx.respond('Drawing the chart took too long, try a shorter time range.')
+            return
+        except concurrent.futures.process.BrokenProcessPool:
+            await ctx.respond('Drawing the chart failed, please try again.')
+            return
 
         embed = discord.Embed(
-            title='{0} price history from {1} to {2}'.format(coin_info.name, from_time.strftime('%Y-%m-%d %H:%M:%S'), end_time.strftime('%Y-%m-%d %H:%M:%S'))
+            title='{0} price history from {1} to {2}'.format(name, from_time.strftime('%Y-%m-%d %H:%M:%S'), end_time.strftime('%Y-%m-%d %H:%M:%S'))
         )
         embed.set_image(url="attachment://history.png")
         embed.set_footer(text=warning)
-        await ctx.respond(file=discord.File(buf, 'history.png'), embed=embed)
+        await ctx.respond(file=discord.File(io.BytesIO(png), 'history.png'), embed=embed)
 
 
     @slash_command()
@@ -336,22 +633,24 @@ class CoinGeckoCog(commands.Cog):
             await func('Could not query info for coin')
             return
 
-        website = info.get('links', {}).get('homepage', ['','',''])[0]
-        embed, fp = format_crypto_info(info)
-
-        if warning:
-            embed.set_footer(text=warning)
+        await func(**info_message([info], warning=warning))
 
-        view = None
-        if website:
-            component = discord.ui.Button(
-                    style=discord.ButtonStyle.link,
-                    label='Website',
-                    url=website)
-            view = discord.ui.View(component, timeout=None)
+    @slash_command(name='currency')
+    @commands.guild_only()
+    @commands.has_permissions(manage_guild=True)
+    async def set_currency(
+        self,
+        ctx,
+        currency: Option(str, 'Currency code such as usd, eur or jpy', autocomplete=currency_searcher),
+    ):
+        """Sets the currency prices are shown in on this server."""
+        currency = currency.lower()
+        if await self.fx.rate(currency) is None:
+            await ctx.respond(f'Unfortunately {currency.upper()} isn\'t a currency I can convert to.', ephemeral=True)
+            return
 
-        files = [fp] if fp else None
-        await func(files=files, embed=embed, view=view)
+        await self.settings.set_currency(ctx.guild_id, currency)
+        await ctx.respond(f'Prices on this server are now shown in {currency.upper()} ({self.fx.names.get(currency, currency.upper())})')
 
     @slash_command(name='set')
     async def set_symbol(
@@ -360,28 +659,36 @@ class CoinGeckoCog(commands.Cog):
         symbol: Option(str, 'Symbol for cryptocurrency', autocomplete=symbol_searcher),
         id: Option(str, 'Coingecko id', autocomplete=id_searcher),
     ):
-        """Sets id to return for symbol. *NOTE* currently doesn't persist."""
+        """Sets id to return for symbol."""
         symbol = symbol.upper()
         id = id.lower()
 
-        ids = self.cg.lookup(symbol)
+        ids = self.cg.symbol_map.get(symbol)
 
         if not ids or id not in ids:
             await ctx.respond(f'Hi {ctx.author.mention}\n'
                            f'Unfortunately Coin/Token {symbol} doesn\'t appear to exist or {id} doesn\'t map to {symbol}')
             return
 
-        self.cg.set_preferred(symbol, id)
-        # TODO implement writing to database
-        #write_symbol_override(symbol, id)
+        await self.cg.prefer(symbol, id)
+        if self.registry:
+            await self.registry.save(self.cg)
 
         await ctx.respond(f"I've set {symbol} to specify {id}")
 
+    def coins_refreshed(self, payload=None):
+        """Has a shard worker update its coin list, after the parent refreshed its own."""
+        self.parent_coins.set()
+
     @tasks.loop(hours=1)
     async def update_cryptocurrencies(self):
+        if self.shared:
+            await self.parent_coins.wait()
+            self.parent_coins.clear()
         try:
             logger.info('Updating crypto from coingecko')
-            await self.do_update_cryptocurrencies()
+            with METRICS.timer('update_loop_seconds', loop='new_coins'):
+                await self.do_update_cryptocurrencies()
             logger.info('Received latest coin update from coingecko')
         except Exception as e:
             logger.exception(e)
@@ -389,13 +696,84 @@ class CoinGeckoCog(commands.Cog):
     @update_cryptocurrencies.before_loop
     async def before_update_cryptocurrencies(self):
         await self.client.wait_until_ready()
-        self.update_cryptocurrencies.change_interval(**self.new_crypto_interval)
+        self.renderer.start()
+        if self.announcer and getattr(self.client, 'shard_ids', None) is not None and not self.client.get_channel(self.new_crypto_channel):
+            # Another shard worker has the channel's guild and announces.
+            self.announcer = None
+        times = await asyncio.to_thread(preload_modules)
+        logger.info('Preloaded %s in %.2fs', ', '.join(times), sum(times.values()))
+        if self.warm_up_images:
+            await asyncio.to_thread(SENTIMENT_BAR.warm_up)
+        # A shard worker's loop runs whenever the parent's coin list changes.
+        self.update_cryptocurrencies.change_interval(**({'seconds': 0} if self.shared else self.new_crypto_interval))
+        if self.announcer:
+            self.announcer.start()
+
+    @tasks.loop(minutes=2)
+    async def update_market_snapshot(self):
+        try:
+            with METRICS.timer('update_loop_seconds', loop='market_snapshot'):
+                await self.snapshot.refresh()
+        except Exception as e:
+            logger.exception(e)
+
+    @update_market_snapshot.before_loop
+    async def before_update_market_snapshot(self):
+        await self.client.wait_until_ready()
+        self.update_market_snapshot.change_interval(**self.snapshot.interval)
+
+    @tasks.loop(seconds=30)
+    async def refresh_hot_prices(self):
+        try:
+            with METRICS.timer('update_loop_seconds', loop='hot_prices'):
+                await self.do_refresh_hot_prices()
+        except Exception as e:
+            logger.exception(e)
+
+    @refresh_hot_prices.before_loop
+    async def before_refresh_hot_prices(self):
+        await self.client.wait_until_ready()
+        self.refresh_hot_prices.change_interval(**self.hot_prices_interval)
+
+    async def do_refresh_hot_prices(self):
+        """Refetches hot coins' rows before they expire and rebuilds their embeds, so /price keeps hitting.
+
+        A shard worker only rebuilds them from the rows the parent pushed.
+        """
+        entries = self.hot_prices.items()
+        if not entries:
+            return
+
+        ids = list(dict.fromkeys(crypto for (crypto, _), _ in entries))
+        if self.shared:
+            rows = [self.snapshot.get(id) for id in ids]
+        else:
+            rows = await self.snapshot.fetch(ids, priority=coingecko_helper.PRIORITY_BACKGROUND, ahead=self.hot_prices_ahead)
+        rows = dict(zip(ids, rows))
+        rates = dict()
+        for (crypto, currency), entry in entries:
+            if currency not in rates:
+                rates[currency] = await self.fx.rate(currency)
+            row, rate = rows[crypto], rates[currency]
+            if row is None or rate is None or (entry.row is row and entry.rate == rate):
+                continue
+            embed = format_crypto_price_info(market_snapshot.market_row_to_info(row), currency, rate)
+            self.hot_prices.put((crypto, currency), PriceEmbed(row, rate, embed))
 
     async def do_update_cryptocurrencies(self):
         new_coins = await self.cg.new_coins()
-        if not new_coins or not self.new_crypto_channel:
+        if self.registry:
+            await self.registry.save(self.cg)
+        if not new_coins or not self.announcer:
             return
-        channel = self.client.get_channel(self.new_crypto_channel)
-        for id in new_coins:
-            info = await self.cg.coin_by_id(id)
-            await self.do_send_info(channel.send, info, warning='')
+        # Fetching and posting happens in the announcer's own tasks.
+        self.announcer.enqueue(sorted(new_coins))
+
+    def cog_unload(self):
+        self.update_cryptocurrencies.cancel()
+        self.update_market_snapshot.cancel()
+        self.refresh_hot_prices.cancel()
+        self.renderer.close()
+        self.history.close()
+        if self.announcer:
+            self.announcer.stop()
@@ -1,23 +1,264 @@
 import aiohttp
+import asyncio
+import coin_index
 import collections
+import email.utils
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import metrics
 import random
+import sys
+import time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 API_URL_BASE = 'https://api.coingecko.com/api/v3/'
 
+logger = logging.getLogger(__name__)
+
+# Request priorities, lower values are sent first when rate limited.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+# Statuses worth retrying after a backoff.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
 CoinInfo = collections.namedtuple('CoinInfo', 'id symbol name')
 
+# Seconds a successful response stays cached, by endpoint. 0 disables caching
+# for that endpoint (concurrent identical requests are still coalesced).
+DEFAULT_CACHE_TTLS = {
+    'ping': 0,
+    'simple/price': 30,
+    'coins/list': 300,
+    'coins/markets': 60,
+    'coins/{id}': 60,
+    'coins/{id}/market_chart/range': 300,
+    'exchange_rates': 300,
+}
+
+_MISSING = object()
+
+# Decodes response bodies, orjson when installed.
+json_loads = orjson.loads if orjson is not None else json.loads
+
+
+class ResponseCache:
+    """LRU cache of decoded responses with per-entry expiry and single-flight fetching.
+
+    Cached values are shared between callers and must not be mutated.
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        # key -> (expires_at, value), least recently used first.
+        self.entries = collections.OrderedDict()
+        # key -> asyncio.Future of the request currently fetching key.
+        self.in_flight = dict()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return _MISSING
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self.entries[key]
+            return _MISSING
+
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value, ttl):
+        if ttl <= 0 or self.max_size <= 0:
+            return
+
+        self.entries[key] = (time.monotonic() + ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    async def fetch(self, key, ttl, factory):
+        """Returns the cached value for key, awaiting factory() on a miss.
+
+        Callers asking for a key that is already being fetched wait on the
+        same request instead of starting another one.
+        """
+        value = self.get(key)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+
+        future = self.in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            future = asyncio.ensure_future(self.__fill(key, ttl, factory))
+            # Mark failures as retrieved in case every waiter was cancelled.
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            self.in_flight[key] = future
+
+        # Shielded so one cancelled waiter doesn't cancel the shared request.
+        return await asyncio.shield(future)
+
+    async def __fill(self, key, ttl, factory):
+        try:
+            value = await factory()
+            if value is not None:
+                self.put(key, value, ttl)
+            return value
+        finally:
+            self.in_flight.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'size': len(self.entries),
+            'in_flight': len(self.in_flight),
+        }
+
+
+class TokenBucket:
+    """Token bucket rate limiter that hands out tokens in priority order.
+
+    Callers queue when no token is available rather than failing.
+    """
+
+    def __init__(self, rate, capacity):
+        # Tokens added per second.
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        # heap of (priority, sequence, future)
+        self.waiters = []
+        self.sequence = itertools.count()
+        self.dispatcher = None
+
+    def __refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, priority=PRIORITY_INTERACTIVE):
+        self.__refill()
+        if not self.waiters and self.tokens >= 1 and time.monotonic() >= self.paused_until:
+            self.tokens -= 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.sequence), future))
+        if self.dispatcher is None or self.dispatcher.done():
+            self.dispatcher = asyncio.ensure_future(self.__dispatch())
+        await future
+
+    def pause(self, seconds):
+        """Stops handing out tokens for the given number of seconds."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    def queued(self):
+        return len(self.waiters)
+
+    async def __dispatch(self):
+        while self.waiters:
+            delay = self.paused_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            self.__refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                continue
+
+            _, _, future = heapq.heappop(self.waiters)
+            # Waiter was cancelled while queued.
+            if future.done():
+                continue
+            self.tokens -= 1
+            future.set_result(None)
+
+
+def retry_after_seconds(headers):
+    """Parses a Retry-After header into seconds, None if missing or invalid."""
+    value = headers.get('Retry-After')
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def coins_list_digest(coins_list):
+    """Hashes the fields of a coins/list response that the coin registry uses."""
+    digest = hashlib.blake2b(digest_size=16)
+    for info_map in coins_list:
+        digest.update(f"{info_map['id']}\0{info_map['symbol']}\0{info_map.get('name')}\n".encode())
+    return digest.hexdigest()
+
+
 class CoinGeckoAPI:
     """Simple wrapper over Coingecko's API in using async."""
 
-    def __init__(self, api_base_url=API_URL_BASE):
+    def __init__(self, api_base_url=API_URL_BASE, cache_size=1024, cache_ttls=None,
+                 calls_per_minute=30, burst=5, max_retries=4, retry_base_delay=1.0, retry_max_delay=60.0,
+                 connection_limit=20, connection_limit_per_host=10, dns_cache_ttl=300, keepalive_timeout=30,
+                 total_timeout=30, connect_timeout=10, read_timeout=20, compress=True):
         self.api_base_url = api_base_url
-        self.session = aiohttp.ClientSession(raise_for_status=True)
+        # Created by start() or the first request, inside the running loop.
+        self.session = None
+        self.connector_options = dict(
+            limit=connection_limit,
+            limit_per_host=connection_limit_per_host,
+            ttl_dns_cache=dns_cache_ttl,
+            keepalive_timeout=keepalive_timeout)
+        self.timeout = aiohttp.ClientTimeout(total=total_timeout, connect=connect_timeout, sock_read=read_timeout)
+        self.compress = compress
+        self.cache = ResponseCache(max_size=cache_size)
+        self.cache_ttls = dict(DEFAULT_CACHE_TTLS)
+        self.cache_ttls.update(cache_ttls or {})
+        self.limiter = TokenBucket(calls_per_minute / 60.0, burst)
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
         # str (coin id) -> CoinInfo
         self.coins = dict()
         # str (symbol) -> set[coin_id]
         self.symbol_map = collections.defaultdict(set)
         # str (symbol) -> coin_id
         self.preferred_ids = dict()
+        # str (coin id) -> market cap rank
+        self.ranks = dict()
+        # Digest of the last coins/list response applied.
+        self.coins_digest = None
+        # Autocomplete indexes, kept in sync by new_coins().
+        self.symbol_index = coin_index.PrefixIndex(rank=self.__symbol_rank)
+        self.id_index = coin_index.PrefixIndex(rank=self.__id_rank)
 
     def get_symbols(self):
         return list(self.symbol_map.keys())
@@ -25,70 +266,238 @@ class CoinGeckoAPI:
     def get_ids(self):
         return list(self.coins.keys())
 
-    async def __request(self, url, params=None):
+    def __id_rank(self, id):
+        return self.ranks.get(id, coin_index.UNRANKED)
+
+    def __symbol_rank(self, symbol):
+        return min((self.__id_rank(id) for id in self.symbol_map.get(symbol, ())), default=coin_index.UNRANKED)
+
+    def search_symbols(self, prefix, limit=coin_index.MAX_RESULTS):
+        return self.symbol_index.search(prefix.upper(), limit)
+
+    def search_ids(self, prefix, limit=coin_index.MAX_RESULTS):
+        return self.id_index.search(prefix.lower(), limit)
+
+    def search(self, prefix, limit=coin_index.MAX_RESULTS):
+        """Searches both symbols and ids, merging prefix matches by rank.
+
+        Close matches found when nothing starts with prefix keep their
+        similarity order and come after the prefix matches.
+        """
+        ranked = []
+        fuzzy = []
+        for index, results, query in ((self.symbol_index, self.search_symbols(prefix, limit), prefix.upper()),
+                                      (self.id_index, self.search_ids(prefix, limit), prefix.lower())):
+            for key in results:
+                if key.startswith(query):
+                    ranked.append((index.sort_key(key, query), key))
+                else:
+                    fuzzy.append(key)
+        ranked.sort()
+        return ([key for _, key in ranked] + fuzzy)[:limit]
+
+    def update_ranks(self, ranks):
+        """Updates market cap ranks used to order search results."""
+        self.ranks.update(ranks)
+        self.symbol_index.invalidate()
+        self.id_index.invalidate()
+
+    def cache_stats(self):
+        return self.cache.stats()
+
+    def queued_requests(self):
+        return self.limiter.queued()
+
+    async def start(self):
+        """Opens the connection pool, must be called from the loop it is used on."""
+        if self.session is None or self.session.closed:
+            # Without compression ask for identity so CoinGecko doesn't gzip anyway.
+            headers = {} if self.compress else {'Accept-Encoding': 'identity'}
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(**self.connector_options),
+                timeout=self.timeout,
+                headers=headers)
+        return self.session
+
+    async def close(self):
+        """Closes the connection pool, requests made afterwards open a new one."""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def request(self, url, params=None, endpoint=None, priority=PRIORITY_INTERACTIVE):
+        """Returns the decoded response for url, from the cache when fresh.
+
+        RemoteCoinGeckoAPI overrides this to ask the shard cluster's fetcher instead.
+        """
         if not params:
             params = dict()
 
-        async with self.session.get(url, params=params) as r:
-            if r.status == 200:
-                return await r.json()
+        key = (url, tuple(sorted(params.items())))
+        ttl = self.cache_ttls.get(endpoint, 0)
+        return await self.cache.fetch(key, ttl, lambda: self.__fetch(url, params, priority, endpoint))
 
-        return None
+    async def __fetch(self, url, params, priority, endpoint):
+        attempt = 0
+        while True:
+            await self.limiter.acquire(priority)
+            session = await self.start()
+            with metrics.METRICS.timer('coingecko_request_seconds', endpoint=endpoint):
+                async with session.get(url, params=params) as r:
+                    metrics.METRICS.inc('coingecko_responses', endpoint=endpoint, status=r.status)
+                    if r.status not in RETRY_STATUSES or attempt >= self.max_retries:
+                        r.raise_for_status()
+                        if r.status == 200:
+                            return await r.json(loads=json_loads)
+                        return None
+
+                    delay = retry_after_seconds(r.headers)
+                    if delay is None:
+                        delay = min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt)
+                        delay *= random.uniform(0.8, 1.2)
+                    if r.status == 429:
+                        # Everyone else would get a 429 too, hold the whole queue.
+                        self.limiter.pause(delay)
+                    logger.warning('%s returned %d, retrying in %.1fs', url, r.status, delay)
 
-    async def ping(self):
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def ping(self, priority=PRIORITY_INTERACTIVE):
         api_url = '{0}ping'.format(self.api_base_url)
-        return await self.__request(api_url)
+        return await self.request(api_url, endpoint='ping', priority=priority)
 
-    async def prices(self, ids, **kwargs):
+    async def prices(self, ids, priority=PRIORITY_INTERACTIVE, **kwargs):
         api_url = '{0}simple/price'.format(self.api_base_url)
         kwargs['ids'] = ','.join([id.lower() for id in ids])
         kwargs['vs_currencies'] = 'usd'
-        prices = await self.__request(api_url, params=kwargs)
-        return {id: value['usd'] for id, value in prices.items()}
+        prices = await self.request(api_url, params=kwargs, endpoint='simple/price', priority=priority)
+        return {id: value['usd'] for id, value in (prices or {}).items() if 'usd' in value}
 
-    async def coins_list(self):
+    async def coins_list(self, priority=PRIORITY_INTERACTIVE):
         api_url = '{0}coins/list'.format(self.api_base_url)
-        return await self.__request(api_url)
+        return await self.request(api_url, endpoint='coins/list', priority=priority)
 
-    async def coins_markets(self, **kwargs):
+    async def coins_markets(self, priority=PRIORITY_INTERACTIVE, **kwargs):
         api_url = '{0}coins/markets'.format(self.api_base_url)
         kwargs['vs_currency'] = 'usd'
-        return await self.__request(api_url, params=kwargs)
+        return await self.request(api_url, params=kwargs, endpoint='coins/markets', priority=priority)
 
-    async def coin_by_id(self, id, **kwargs):
+    async def coin_by_id(self, id, priority=PRIORITY_INTERACTIVE, **kwargs):
         api_url = '{0}coins/{1}/'.format(self.api_base_url, id.lower())
-        return await self.__request(api_url, params=kwargs)
+        info = await self.request(api_url, params=kwargs, endpoint='coins/{id}', priority=priority)
+        if info and info.get('market_cap_rank'):
+            # Picked up by the memoized short prefix results on the next rebuild.
+            self.ranks[info['id']] = info['market_cap_rank']
+        return info
 
-    async def coin_price_history(self, id, **kwargs):
+    async def coin_price_history(self, id, priority=PRIORITY_INTERACTIVE, **kwargs):
         api_url = '{0}coins/{1}/market_chart/range'.format(self.api_base_url, id.lower())
         kwargs['vs_currency'] = 'usd'
-        return await self.__request(api_url, params=kwargs)
+        return await self.request(api_url, params=kwargs, endpoint='coins/{id}/market_chart/range', priority=priority)
+
+    async def exchange_rates(self, priority=PRIORITY_INTERACTIVE):
+        api_url = '{0}exchange_rates'.format(self.api_base_url)
+        return await self.request(api_url, endpoint='exchange_rates', priority=priority)
 
     # Derived functions
-    async def new_coins(self):
-        new_coins_by_id = dict()
-        new_coins = set()
+    async def new_coins(self, priority=PRIORITY_BACKGROUND):
+        """Refreshes the coin list in place and returns the ids added by this refresh.
 
-        coins_list = await self.coins_list()
+        Nothing is reported as new on the first refresh.
+        """
+        coins_list = await self.coins_list(priority=priority)
+        if not coins_list:
+            return set()
+
+        digest = coins_list_digest(coins_list)
+        if digest == self.coins_digest:
+            return set()
+        self.coins_digest = digest
+
+        first_load = not self.coins
+        added = set()
+        changed = list()
+        kept = 0
         for info_map in coins_list:
             id = info_map['id'].lower()
+            if not id:
+                continue
             symbol = info_map['symbol'].upper()
             name = info_map.get('name')
 
-            if id:
-                new_coins_by_id[id] = CoinInfo(id=id, symbol=symbol, name=name)
-            if symbol:
-                self.symbol_map[symbol].add(id)
+            coin = self.coins.get(id)
+            if coin is None:
+                added.add(id)
+                changed.append((id, symbol, name))
+                continue
+
+            kept += 1
+            if coin.symbol != symbol or coin.name != name:
+                changed.append((id, symbol, name))
+
+        removed = ()
+        if kept != len(self.coins):
+            current = {info_map['id'].lower() for info_map in coins_list}
+            removed = [id for id in self.coins if id not in current]
+
+        # Index inserts are linear, past a point rebuilding them is cheaper.
+        bulk = len(changed) + len(removed) > len(self.coins) // 10 + 100
+        for id in removed:
+            self.__remove_coin(id, update_index=not bulk)
+        for id, symbol, name in changed:
+            self.__set_coin(id, symbol, name, update_index=not bulk)
+        if bulk:
+            self.symbol_index.rebuild(self.symbol_map.keys())
+            self.id_index.rebuild(self.coins.keys())
+
+        if changed or removed:
+            logger.info('Coin list refresh: %d added, %d removed, %d renamed',
+                        len(added), len(removed), len(changed) - len(added))
+
+        return set() if first_load else added
+
+    def __set_coin(self, id, symbol, name, update_index=True):
+        old = self.coins.get(id)
+        if old is not None and old.symbol != symbol:
+            self.__unmap_symbol(old.symbol, id, update_index)
 
-        if self.coins:
-            new_coins = set(new_coins_by_id.keys()) - set(self.coins.keys())
+        id = sys.intern(id)
+        symbol = sys.intern(symbol)
+        self.coins[id] = CoinInfo(id=id, symbol=symbol, name=name)
+        if update_index:
+            self.id_index.add(id)
 
-        self.coins = new_coins_by_id
+        if symbol and (old is None or old.symbol != symbol):
+            ids = self.symbol_map.get(symbol)
+            if ids is None:
+                ids = self.symbol_map[symbol] = set()
+                if update_index:
+                    self.symbol_index.add(symbol)
+            ids.add(id)
 
-        return new_coins
+    def __remove_coin(self, id, update_index=True):
+        coin = self.coins.pop(id)
+        self.__unmap_symbol(coin.symbol, id, update_index)
+        self.ranks.pop(id, None)
+        if update_index:
+            self.id_index.remove(id)
+        for symbol, preferred in list(self.preferred_ids.items()):
+            if preferred == id:
+                del self.preferred_ids[symbol]
+
+    def __unmap_symbol(self, symbol, id, update_index):
+        ids = self.symbol_map.get(symbol)
+        if ids is None:
+            return
+        ids.discard(id)
+        if not ids:
+            del self.symbol_map[symbol]
+            if update_index:
+                self.symbol_index.remove(symbol)
 
     async def random_coin(self):
-        id = random.choice(list(self.coins.keys()))
+        id = random.choice(self.id_index.keys)
         return await self.coin_by_id(id)
 
     def lookup(self, symbol, preferred=False):
@@ -101,4 +510,37 @@ class CoinGeckoAPI:
         return self.coins.get(id)
 
     def set_preferred(self, symbol, id):
-        self.preferred_ids[symbol] = id.lower()
\ No newline at end of file
+        self.preferred_ids[symbol] = id.lower()
+
+    async def prefer(self, symbol, id):
+        """Sets symbol's preferred id wherever the registry is shared."""
+        self.set_preferred(symbol, id)
+
+    def export_registry(self):
+        """Returns the coin registry as plain data, see load_registry()."""
+        ids = self.id_index.keys
+        return {
+            'digest': self.coins_digest,
+            'ids': ids,
+            'symbols': [self.coins[id].symbol for id in ids],
+            'names': [self.coins[id].name for id in ids],
+            'preferred_ids': self.preferred_ids,
+            'ranks': self.ranks,
+        }
+
+    def load_registry(self, registry):
+        """Replaces the coin registry with data from export_registry()."""
+        self.coins = dict()
+        self.symbol_map = collections.defaultdict(set)
+        for id, symbol, name in zip(registry['ids'], registry['symbols'], registry['names']):
+            id = sys.intern(id)
+            symbol = sys.intern(symbol)
+            self.coins[id] = CoinInfo(id=id, symbol=symbol, name=name)
+            if symbol:
+                self.symbol_map[symbol].add(id)
+
+        self.preferred_ids = dict(registry['preferred_ids'])
+        self.ranks = dict(registry['ranks'])
+        self.coins_digest = registry['digest']
+        self.id_index.rebuild(self.coins.keys())
+        self.symbol_index.rebuild(self.symbol_map.keys())
\ No newline at end of file
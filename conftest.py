@@ -0,0 +1,23 @@
+import contextlib
+import coingecko_helper
+import pytest
+
+from benchmarks.fake_coingecko import FakeCoinGecko
+
+
+@contextlib.asynccontextmanager
+async def serve_fake_api(count=200, **kwargs):
+    """Yields (FakeCoinGecko, CoinGeckoAPI using it) with no latency or rate limit to speak of."""
+    fake = FakeCoinGecko(count=count, latency=kwargs.pop('latency', 0), jitter=0, **kwargs)
+    url = await fake.start()
+    cg = coingecko_helper.CoinGeckoAPI(url, calls_per_minute=60000, burst=1000, retry_base_delay=0.01)
+    try:
+        yield fake, cg
+    finally:
+        await cg.close()
+        await fake.close()
+
+
+@pytest.fixture
+def fake_api():
+    return serve_fake_api
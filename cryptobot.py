@@ -1,103 +1,365 @@
+import time
+# Taken before the other imports so startup timings include them.
+STARTED = time.perf_counter()
+
 import argparse
 import asyncio
 import aiohttp
+import alert_cog
+import alert_engine
+import chart_renderer
 import coingecko_cog
 import coingecko_helper
-import datetime
 import discord
+import error_reporter
+import fx_rates
+import guild_settings
+import history_store
 import json
 import logging
+import market_snapshot
+import multiprocessing
+import paper_ledger
+import paper_trader_cog
+import rankings_cog
+import registry_snapshot
+import shard_cluster
+import shared_state
+import stats_cog
 import sys
-import traceback
 import yaml
 
 
 from discord.ext import commands, tasks
+from metrics import METRICS
+
+IMPORTED = time.perf_counter()
+
+class CryptoBot(commands.AutoShardedBot):
+    async def close(self):
+        # Unloading stops the cogs' loops and worker processes.
+        for name in list(self.cogs):
+            self.remove_cog(name)
+        await super().close()
+        if cg is not None:
+            await cg.close()
+
+    async def on_error(self, event, *args, **kwargs):
+        error = sys.exc_info()[1]
+        if reporter is not None and error is not None:
+            reporter.report('Event Error', error, f'Event: {event}')
+        else:
+            logging.exception('Error in %s', event)
+
+    async def on_application_command_error(self, ctx, error):
+        if isinstance(error, discord.ext.commands.errors.MissingPermissions):
+            await ctx.respond('You do not have permission to execute this command', ephemeral=True)
+        elif isinstance(error, discord.ext.commands.errors.NoPrivateMessage):
+            await ctx.respond('This command is only to be used on servers', ephemeral=True)
+        elif isinstance(error, (discord.CheckFailure, commands.CheckFailure)):
+            # Such as /stats for anyone but the owner, not worth reporting.
+            await ctx.respond('You can\'t use this command', ephemeral=True)
+        elif isinstance(error, discord.NotFound):
+            logging.warning('Not found: %s', ''.join(error.args))
+        else:
+            # The command's own exception, rather than the wrapper py-cord raises.
+            error = getattr(error, 'original', error)
+            command = ctx.command.qualified_name if ctx.command else 'unknown'
+            context = f'Command: /{command}, guild {ctx.guild_id}, user {ctx.author.id}'
+            if reporter is not None:
+                reporter.report('Command Error', error, context)
+            else:
+                logging.error('%s', context, exc_info=(type(error), error, error.__traceback__))
+
+    async def on_ready(self):
+        print('We have logged in as {0.user}'.format(self))
+        global ready_after
+        if ready_after is None:
+            ready_after = time.perf_counter() - STARTED
+            METRICS.observe('startup_seconds', ready_after, phase='ready')
+            logging.info('Ready %.2fs after start, %.2fs of it importing', ready_after, IMPORTED - STARTED)
+        if isinstance(cg, shard_cluster.RemoteCoinGeckoAPI):
+            # Catch up on what the parent publishes, and follow it from now on.
+            await cg.start()
+        # Initialize coingecko coin lists to make commands work, unless they
+        # were loaded from the registry snapshot.
+        if not cg.coins:
+            await cg.new_coins()
+        # Updates handled in CoinGeckoCog.
+
 
-client = commands.Bot(
-    command_prefix='/',
-    description='I do crypto stuff.',
-    activity=discord.Game(name='\U0001F3B7')
-)
+def make_client(**options):
+    return CryptoBot(
+        command_prefix='/',
+        description='I do crypto stuff.',
+        activity=discord.Game(name='\U0001F3B7'),
+        **options
+    )
 
+
+# Set up by main() or run_worker(), never on import: shard worker
+# processes are spawned and import this module again.
+client = None
 config = {}
-cg = coingecko_helper.CoinGeckoAPI()
-
-@client.event
-async def on_error(event, *args, **kwargs):
-    embed = discord.Embed(title=':x: Event Error', colour=0xe74c3c) #Red
-    embed.add_field(name='Event', value=event)
-    embed.description = '```py\n%s\n```' % traceback.format_exc()
-    embed.timestamp = datetime.datetime.utcnow()
-    channel_id = config.get('channels', {}).get('logging', {}).get('channel')
-    if channel_id:
-        channel = client.get_channel(channel_id)
+cg = None
+reporter = None
+ready_after = None
+
+
+def import_report():
+    """Prints how long startup imports take and what each deferred import adds on first use."""
+    print(f'Startup imports took {IMPORTED - STARTED:.3f}s')
+    loaded = [name for name in coingecko_cog.DEFERRED_IMPORTS if name in sys.modules]
+    if loaded:
+        print(f'Imported at startup although deferred: {", ".join(loaded)}')
+    for name, seconds in coingecko_cog.preload_modules().items():
+        print(f'  deferred {name:<16} {seconds:.3f}s')
+    print('Run with python -X importtime for a per module breakdown.')
+
+
+def start_logging(loglevel, worker=None):
+    log_config = config.get('logging', {})
+    path = log_config.get('file')
+    error_reporter.start_logging(
+        loglevel,
+        format=log_config.get('format', 'text'),
+        path=shard_cluster.worker_path(path, worker),
+        fields={'worker': f'worker{worker}'} if worker is not None else None)
+
+
+def make_api(config):
+    coingecko_config = config.get('coingecko', {})
+    cache_config = coingecko_config.get('cache', {})
+    rate_limit_config = coingecko_config.get('rate_limit', {})
+    retry_config = coingecko_config.get('retry', {})
+    http_config = coingecko_config.get('http', {})
+    return coingecko_helper.CoinGeckoAPI(
+        cache_size=cache_config.get('size', 1024),
+        cache_ttls=cache_config.get('ttl'),
+        calls_per_minute=rate_limit_config.get('calls_per_minute', 30),
+        burst=rate_limit_config.get('burst', 5),
+        max_retries=retry_config.get('max_retries', 4),
+        retry_base_delay=retry_config.get('base_delay', 1.0),
+        retry_max_delay=retry_config.get('max_delay', 60.0),
+        connection_limit=http_config.get('limit', 20),
+        connection_limit_per_host=http_config.get('limit_per_host', 10),
+        dns_cache_ttl=http_config.get('dns_cache_ttl', 300),
+        keepalive_timeout=http_config.get('keepalive_timeout', 30),
+        total_timeout=http_config.get('total_timeout', 30),
+        connect_timeout=http_config.get('connect_timeout', 10),
+        read_timeout=http_config.get('read_timeout', 20),
+        compress=http_config.get('compress', True))
+
+
+def add_cogs(worker=None):
+    """Adds the bot's cogs, with worker's own state files when running as a shard worker."""
+    #if 'ENABLE_LEAGUES' in config:
+    #    cog = LeagueServer(bot)
+    #    client.loop.create_task(cog.webserver())
+    #    client.add_cog(cog)
+
+    # Serve commands from the last saved coin list until CoinGecko's is fetched.
+    registry = make_registry()
+    registry.load(cg)
+    if worker is not None:
+        # The parent saves the registry, workers only read it.
+        registry = None
+
+    channel_config = config.get('channels', {})
+    logging_config = channel_config.get('logging', {})
+    global reporter
+    reporter = error_reporter.ErrorReporter(
+        client,
+        channel_id=logging_config.get('channel'),
+        window=logging_config.get('window', 300),
+        interval=logging_config.get('interval'))
+    client.add_cog(reporter)
+
+    new_crypto_config = channel_config.get('new_crypto')
+
+    snapshot = make_snapshot(cg)
+
+    chart_config = config.get('charts', {})
+    renderer = chart_renderer.ChartRenderer(
+        workers=chart_config.get('workers', 2),
+        max_pending=chart_config.get('max_pending', 8),
+        timeout=chart_config.get('timeout', 30))
+
+    if worker is None:
+        history = make_history(cg)
+        settings = make_settings()
+        fx = make_fx(cg)
     else:
-        channel = bot.AppInfo.owner
-    await channel.send(embed=embed)
-
-@client.event
-async def on_application_command_error(ctx, error):
-    if isinstance(error, discord.ext.commands.errors.MissingPermissions):
-        await ctx.send('You do not have permission to execute this command')
-    elif isinstance(error, discord.ext.commands.errors.NoPrivateMessage):
-        await ctx.send('This command is only to be used on servers')
-    elif isinstance(error, discord.NotFound):
-        print(''.join(error.args))
+        # The parent refreshes the coin list, snapshot and rates and pushes them.
+        history = shared_state.RemoteHistoryStore(cg)
+        settings = shared_state.RemoteGuildSettings(cg)
+        fx = shared_state.RemoteFxTable(cg, max_age=config.get('currency', {}).get('max_age', 300))
+        cg.subscribe('snapshot', snapshot.update)
+
+    cog = coingecko_cog.CoinGeckoCog(client, cg, new_crypto_config=new_crypto_config, snapshot=snapshot, renderer=renderer, history=history, registry=registry,
+        warm_up_images=config.get('images', {}).get('warm_up', False), settings=settings, fx=fx,
+        hot_prices_config=config.get('hot_prices'), shared=worker is not None)
+    client.add_cog(cog)
+    if worker is not None:
+        cg.subscribe('coins', cog.coins_refreshed)
+
+    if snapshot.top_n:
+        client.add_cog(rankings_cog.RankingsCog(client, snapshot, currency_for=cog.currency_for))
+
+    # Workers' alerts and paper trading accounts are the parent's, which checks and values them.
+    alert_config = config.get('alerts', {})
+    if worker is None:
+        client.add_cog(alert_cog.AlertCog(client, cg, make_alerts(), interval=alert_config.get('interval')))
     else:
-        try:
-            embed = discord.Embed(title=':x: Event Error', colour=0xe74c3c) #Red
-            embed.add_field(name='Event', value=event)
-            embed.description = '```py\n%s\n```' % traceback.format_exc()
-            embed.timestamp = datetime.datetime.utcnow()
-            channel_id = config.get('channels', {}).get('logging', {}).get('channel')
-            if channel_id:
-                channel = client.get_channel(channel_id)
-            else:
-                channel = bot.AppInfo.owner
-            await channel.send(embed=embed)
-        except:
-            # well...
-            pass
+        engine = shared_state.RemoteAlertEngine(cg, max_per_user=alert_config.get('max_per_user', 10))
+        alerts = alert_cog.AlertCog(client, cg, engine, check=False)
+        engine.listen(alerts.notify_own)
+        client.add_cog(alerts)
+
+    paper_config = config.get('paper_trading')
+    if paper_config is not None:
+        book = make_paper_book(cg, snapshot) if worker is None else shared_state.RemotePaperBook(cg)
+        client.add_cog(paper_trader_cog.PaperTraderCog(client, cg, book, interval=paper_config.get('interval'), valuate=worker is None))
+
+    metrics_config = dict(config.get('metrics') or {})
+    if worker is not None and metrics_config.get('port'):
+        # One port per worker.
+        metrics_config['port'] += worker
+    client.add_cog(stats_cog.StatsCog(client, cg, metrics_config=metrics_config))
+
+
+def make_registry():
+    return registry_snapshot.RegistrySnapshot(config.get('registry_snapshot', {}).get('path', 'coin-registry.snapshot'))
 
-        raise error
 
-@client.event
-async def on_ready():
-    print('We have logged in as {0.user}'.format(client))
-    # Initialize coingecko coin lists to make commands work.
-    await cg.new_coins()
-    # Updates handled in CoinGeckoCog.
+def make_snapshot(cg):
+    market_config = config.get('market_snapshot', {})
+    return market_snapshot.MarketSnapshot(
+        cg,
+        top_n=market_config.get('top_n', 500),
+        max_age=market_config.get('max_age', 300),
+        interval=market_config.get('interval'))
+
+
+def make_fx(cg):
+    return fx_rates.FxTable(cg, max_age=config.get('currency', {}).get('max_age', 300))
+
+
+def make_history(cg):
+    history_config = config.get('history_store', {})
+    return history_store.HistoryStore(
+        cg,
+        path=history_config.get('path', 'price-history.sqlite3'),
+        fetch_concurrency=history_config.get('fetch_concurrency', 4))
+
+
+def make_settings():
+    return guild_settings.GuildSettings(config.get('currency', {}).get('settings', 'guild-settings.json'))
+
+
+def make_alerts():
+    alert_config = config.get('alerts', {})
+    return alert_engine.AlertEngine(
+        path=alert_config.get('path', 'alerts.json'),
+        max_per_user=alert_config.get('max_per_user', 10))
+
+
+def make_paper_book(cg, snapshot=None):
+    paper_config = config.get('paper_trading') or {}
+    ledger = paper_ledger.PaperLedger(
+        path=paper_config.get('path', 'paper-trading.sqlite3'),
+        starting_cash=paper_config.get('starting_cash', 10000.0))
+    return paper_trader_cog.PaperBook(cg, ledger, snapshot=snapshot)
+
+
+def make_shared_state(cg):
+    """The state workers share, owned by the parent and kept in the same files as without sharding."""
+    registry = make_registry()
+    registry.load(cg)
+    snapshot = make_snapshot(cg)
+    paper_config = config.get('paper_trading')
+    intervals = {
+        'new_coins': (config.get('channels', {}).get('new_crypto') or {}).get('interval'),
+        'alerts': config.get('alerts', {}).get('interval'),
+        'paper_trading': (paper_config or {}).get('interval'),
+    }
+    return shared_state.SharedState(
+        cg, registry=registry, history=make_history(cg), settings=make_settings(), alerts=make_alerts(),
+        book=make_paper_book(cg, snapshot) if paper_config is not None else None, intervals=intervals,
+        snapshot=snapshot, fx=make_fx(cg))
+
+
+def run_cluster(args, sharding_config):
+    """Runs the bot's shards across worker processes sharing this process's CoinGecko client."""
+    shard_count = sharding_config.get('shards')
+    if not shard_count:
+        shard_count = asyncio.run(shard_cluster.recommended_shards(config['token']))
+    shards = shard_cluster.split_shards(shard_count, sharding_config.get('workers', 1))
+    socket_path = sharding_config.get('socket', 'cryptobot-fetcher.sock')
+    logging.info('Running %d shards in %d workers', shard_count, len(shards))
+
+    context = multiprocessing.get_context('spawn')
+
+    def start_worker(worker, shard_ids):
+        process = context.Process(
+            target=run_worker, name=f'cryptobot-worker{worker}',
+            args=(args.config, args.loglevel, worker, shard_ids, shard_count, socket_path))
+        process.start()
+        return process
+
+    async def run():
+        cg = make_api(config)
+        await shard_cluster.run_cluster(cg, socket_path, shards, start_worker, state=make_shared_state(cg))
+
+    asyncio.run(run())
+
+
+def run_worker(config_file, loglevel, worker, shard_ids, shard_count, socket_path):
+    global config
+    with open(config_file) as f:
+        config = yaml.safe_load(f)
+    start_logging(loglevel, worker)
+
+    global cg
+    cg = shard_cluster.RemoteCoinGeckoAPI(socket_path)
+
+    global client
+    # Every worker has the same commands, one of them registering them is enough.
+    client = make_client(shard_ids=shard_ids, shard_count=shard_count, auto_sync_commands=worker == 0)
+    add_cogs(worker)
+    client.run(config['token'])
 
 
 def main():
     parser = argparse.ArgumentParser(description='Discord Cryptobot.')
     parser.add_argument('-c', '--config', type=str, default='cryptobot-config.yaml', help='Config file location.')
     parser.add_argument('-l', '--loglevel', default='info', help='Logging level.')
+    parser.add_argument('--import-report', action='store_true', help='Print startup import times and exit.')
 
     args = parser.parse_args()
-    logging.basicConfig(level=args.loglevel.upper())
+    if args.import_report:
+        import_report()
+        return
+
     config_file = args.config
 
     global config
     with open(config_file) as f:
         config = yaml.safe_load(f)
+    start_logging(args.loglevel)
+    METRICS.observe('startup_seconds', IMPORTED - STARTED, phase='imports')
 
-    #if 'ENABLE_LEAGUES' in config:
-    #    cog = LeagueServer(bot)
-    #    client.loop.create_task(cog.webserver())
-    #    client.add_cog(cog)
-
-    #if 'ENABLE_PAPER_TRADING' in config:
-    #    client.add_cog(PaperTraderCog(client))
-
-    channel_config = config.get('channels', {})
-    new_crypto_config = channel_config.get('new_crypto')
-
-    cog = coingecko_cog.CoinGeckoCog(client, cg, new_crypto_config=new_crypto_config)
-    client.add_cog(cog)
+    sharding_config = config.get('sharding', {})
+    if sharding_config.get('workers', 1) > 1:
+        run_cluster(args, sharding_config)
+        return
 
+    global cg
+    cg = make_api(config)
+    global client
+    client = make_client()
+    add_cogs()
     client.run(config['token'])
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,209 @@
+import atexit
+import collections
+import copy
+import datetime
+import discord
+import json
+import logging
+import logging.handlers
+import queue
+import time
+import traceback
+
+from discord.ext import commands, tasks
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# Errors shown in full in one digest, the rest are only counted.
+MAX_REPORTS = 5
+
+# Discord's limit on the total text of a message's embeds, less room for titles and fields.
+DIGEST_TEXT = 5600
+
+TEXT_FORMAT = '%(levelname)s:%(name)s:%(message)s'
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """Queues records for the listener thread without formatting them first.
+
+    The stock handler formats the message and traceback on the logging
+    thread. Only the message is merged here, tracebacks are formatted by
+    the listener.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, with fields added to every record."""
+
+    def __init__(self, fields=None):
+        super().__init__()
+        self.fields = fields or {}
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            **self.fields,
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def start_logging(level='info', format='text', path=None, fields=None):
+    """Sends every log record through a queue to handlers run by a background thread.
+
+    Records are written to stderr and to path if set, as text or as JSON
+    lines with fields added. Returns the listener, stopped at exit.
+    """
+    if format == 'json':
+        formatter = JsonFormatter(fields)
+    else:
+        prefix = ''.join(f'{value}:' for value in (fields or {}).values())
+        formatter = logging.Formatter(prefix + TEXT_FORMAT)
+
+    handlers = [logging.StreamHandler()]
+    if path:
+        handlers.append(logging.FileHandler(path))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.setLevel(level.upper())
+    root.addHandler(QueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def signature(error):
+    """Identifies an error by its type and where it was raised, ignoring the message."""
+    frames = tuple((frame.f_code.co_filename, lineno) for frame, lineno in traceback.walk_tb(error.__traceback__))
+    return type(error).__qualname__, frames
+
+
+class Report:
+    """An error waiting to go out in the next digest."""
+
+    def __init__(self, title, context, error, count):
+        self.title = title
+        self.context = context
+        self.error = error
+        self.count = count
+        self.first_seen = datetime.datetime.now(datetime.timezone.utc)
+
+
+class ErrorReporter(commands.Cog):
+    """Collects errors and sends them to the logging channel as periodic digests.
+
+    Reporting is a dictionary update, nothing is formatted or sent until
+    the next digest. Errors with the same type and traceback are merged and
+    counted, and are shown again at most once per window seconds. At most
+    one message is sent per interval, whatever the number of errors.
+    """
+
+    def __init__(self, client, channel_id=None, window=300, interval=None):
+        self.client = client
+        self.channel_id = channel_id
+        self.window = window
+        self.interval = interval or {'seconds': 30}
+        # signature -> Report, in the order first seen.
+        self.pending = dict()
+        # signature -> time.monotonic() it was last sent
+        self.sent = dict()
+        # signature -> occurrences since it was last sent
+        self.repeats = collections.Counter()
+        # Occurrences merged into errors already sent, since the last digest.
+        self.repeated = 0
+        self.owner = None
+        self.send_digest.start()
+
+    def cog_unload(self):
+        self.send_digest.cancel()
+
+    def report(self, title, error, context=''):
+        """Logs error and queues it for the next digest."""
+        logger.error('%s %s', title, context, exc_info=(type(error), error, error.__traceback__))
+        key = signature(error)
+        pending = self.pending.get(key)
+        if pending is not None:
+            pending.count += 1
+            METRICS.inc('errors_reported', outcome='merged')
+        elif time.monotonic() - self.sent.get(key, float('-inf')) < self.window:
+            self.repeats[key] += 1
+            self.repeated += 1
+            METRICS.inc('errors_reported', outcome='repeated')
+        else:
+            self.pending[key] = Report(title, context, error, 1 + self.repeats.pop(key, 0))
+            METRICS.inc('errors_reported', outcome='queued')
+
+    @tasks.loop(seconds=30)
+    async def send_digest(self):
+        try:
+            await self.do_send_digest()
+        except Exception as e:
+            logger.exception(e)
+
+    @send_digest.before_loop
+    async def before_send_digest(self):
+        await self.client.wait_until_ready()
+        self.send_digest.change_interval(**self.interval)
+
+    async def destination(self):
+        if self.channel_id:
+            return self.client.get_channel(self.channel_id)
+        if self.owner is None:
+            self.owner = (await self.client.application_info()).owner
+        return self.owner
+
+    async def do_send_digest(self):
+        if not self.pending and not self.repeated:
+            return
+
+        reports = sorted(self.pending.values(), key=lambda report: report.count, reverse=True)
+        now = time.monotonic()
+        for key in self.pending:
+            self.sent[key] = now
+        self.pending = dict()
+        repeated, self.repeated = self.repeated, 0
+
+        embeds = [self.__embed(report, DIGEST_TEXT // len(reports[:MAX_REPORTS])) for report in reports[:MAX_REPORTS]]
+        notes = []
+        if len(reports) > MAX_REPORTS:
+            notes.append(f'{len(reports) - MAX_REPORTS} more distinct errors, see the logs.')
+        if repeated:
+            notes.append(f'{repeated} repeats of errors reported in the last {self.window}s.')
+
+        channel = await self.destination()
+        if channel is None:
+            logger.warning('No channel to report %d errors to', len(reports))
+            return
+        try:
+            await channel.send('\n'.join(notes) or None, embeds=embeds)
+        except discord.HTTPException:
+            logger.exception('Could not send the error digest')
+
+    def __embed(self, report, length):
+        embed = discord.Embed(title=f':x: {report.title}', colour=0xe74c3c) #Red
+        if report.context:
+            embed.add_field(name='Context', value=report.context[:1024])
+        if report.count > 1:
+            embed.add_field(name='Count', value=str(report.count))
+        text = ''.join(traceback.format_exception(type(report.error), report.error, report.error.__traceback__))
+        # The end of a traceback says the most, keep that.
+        if len(text) > length - 12:
+            text = '...' + text[-(length - 15):]
+        embed.description = '```py\n%s\n```' % text
+        embed.timestamp = report.first_seen
+        return embed
@@ -0,0 +1,54 @@
+import coingecko_helper
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+USD = 'usd'
+
+
+class FxTable:
+    """Converts USD prices to other currencies through CoinGecko's exchange_rates.
+
+    Prices are always fetched in USD and converted locally, so serving a
+    server in EUR or JPY costs no extra requests. The table is refreshed on
+    use once it is max_age seconds old, one request for every currency.
+    """
+
+    def __init__(self, cg, max_age=300):
+        self.cg = cg
+        self.max_age = max_age
+        # str (currency) -> units per USD
+        self.rates = {USD: 1.0}
+        # str (currency) -> name, such as 'Euro'
+        self.names = {USD: 'US Dollar'}
+        self.updated = None
+
+    async def refresh(self):
+        data = await self.cg.exchange_rates(priority=coingecko_helper.PRIORITY_BACKGROUND)
+        rates = (data or {}).get('rates', {})
+        usd = rates.get(USD, {}).get('value')
+        if not usd:
+            logger.warning('exchange_rates has no USD rate, keeping the old table')
+            return
+
+        # CoinGecko quotes every currency against BTC.
+        self.rates = {code: info['value'] / usd for code, info in rates.items() if info.get('value')}
+        self.names = {code: info.get('name', code.upper()) for code, info in rates.items()}
+        self.updated = time.monotonic()
+
+    async def rate(self, currency):
+        """Returns units of currency per USD, None for unknown currencies."""
+        if currency == USD:
+            return 1.0
+        if self.updated is None or time.monotonic() - self.updated > self.max_age:
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception('Could not refresh exchange rates')
+        return self.rates.get(currency)
+
+    def search(self, prefix, limit=25):
+        """Currency codes starting with prefix, for autocomplete."""
+        prefix = prefix.lower()
+        return [code for code in sorted(self.rates) if code.startswith(prefix)][:limit]
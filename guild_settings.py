@@ -0,0 +1,41 @@
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CURRENCY = 'usd'
+
+
+class GuildSettings:
+    """Per server preferences, saved as JSON."""
+
+    def __init__(self, path=None):
+        self.path = path
+        # str (guild id) -> {setting: value}
+        self.guilds = dict()
+        self.load()
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            self.guilds = json.load(f)
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.guilds, f)
+        os.replace(tmp_path, self.path)
+
+    def currency(self, guild_id):
+        """Currency prices are shown in for guild_id, USD in direct messages."""
+        if guild_id is None:
+            return DEFAULT_CURRENCY
+        return self.guilds.get(str(guild_id), {}).get('currency', DEFAULT_CURRENCY)
+
+    async def set_currency(self, guild_id, currency):
+        self.guilds.setdefault(str(guild_id), {})['currency'] = currency
+        self.save()
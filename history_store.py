@@ -0,0 +1,182 @@
+import asyncio
+import collections
+import coingecko_helper
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DAY = 24 * 60 * 60
+
+# CoinGecko picks the granularity of market_chart/range from the length of
+# the range, so each granularity is stored separately.
+# (tier, longest range in seconds, point spacing in milliseconds)
+TIERS = [
+    (0, DAY, 5 * 60 * 1000),
+    (1, 90 * DAY, 60 * 60 * 1000),
+    (2, None, DAY * 1000),
+]
+
+# Right edge gaps shorter than this (milliseconds) aren't fetched.
+MIN_GAP = 5 * 60 * 1000
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS prices (
+    coin_id TEXT NOT NULL,
+    tier INTEGER NOT NULL,
+    ts INTEGER NOT NULL,
+    price REAL NOT NULL,
+    PRIMARY KEY (coin_id, tier, ts)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS coverage (
+    coin_id TEXT NOT NULL,
+    tier INTEGER NOT NULL,
+    start_ts INTEGER NOT NULL,
+    end_ts INTEGER NOT NULL,
+    PRIMARY KEY (coin_id, tier)
+);
+'''
+
+
+def tier_for(start, end):
+    """Returns (tier, longest range in seconds, spacing in milliseconds) for a range in seconds."""
+    for tier, longest, step in TIERS:
+        if longest is None or end - start <= longest:
+            return tier, longest, step
+
+
+def split_gap(start, end, length):
+    """Splits start..end into pieces no longer than length, whole if length is None."""
+    if length is None:
+        return [(start, end)]
+    return [(piece, min(piece + length, end)) for piece in range(start, end, length)]
+
+
+def thin(times, prices, step):
+    """Keeps the last point of every step wide bucket."""
+    import numpy as np
+
+    if not len(times):
+        return times, prices
+    buckets = times // step
+    last = np.append(buckets[1:] != buckets[:-1], True)
+    return times[last], prices[last]
+
+
+class HistoryStore:
+    """SQLite backed store of market_chart/range price history.
+
+    Each coin and granularity tier keeps one contiguous covered range. A
+    request only fetches what lies outside that range, so repeated and
+    overlapping /history requests mostly read locally. Points newer than
+    one tier step are provisional and replaced by the next fetch.
+    """
+
+    def __init__(self, cg, path=':memory:', fetch_concurrency=4):
+        self.cg = cg
+        # Coins fetched at once by prices_many().
+        self.fetch_semaphore = asyncio.Semaphore(fetch_concurrency)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db_lock = threading.Lock()
+        with self.db_lock, self.db:
+            self.db.executescript(SCHEMA)
+        # (coin id, tier) -> lock held while filling gaps.
+        self.locks = collections.defaultdict(asyncio.Lock)
+
+    def close(self):
+        with self.db_lock:
+            self.db.close()
+
+    async def prices(self, id, start, end, priority=coingecko_helper.PRIORITY_INTERACTIVE):
+        """Returns (millisecond timestamps, prices) arrays for id between start and end seconds."""
+        # numpy is imported on first use to keep it off the startup path.
+        import price_series
+
+        tier, longest, step = tier_for(start, end)
+        start_ms = start * 1000
+        end_ms = end * 1000
+
+        async with self.locks[(id, tier)]:
+            coverage = await asyncio.to_thread(self.__coverage, id, tier)
+            gaps = []
+            replace_from = None
+            if coverage:
+                covered_start, covered_end = coverage
+                if start_ms < covered_start:
+                    gaps.append((start_ms, covered_start))
+                if end_ms > covered_end + MIN_GAP:
+                    gaps.append((covered_end, end_ms))
+                    # Provisional points past the covered range get refetched.
+                    replace_from = covered_end
+
+            # Nothing stored or it is far from what was asked for, start over.
+            reset = not coverage or sum(b - a for a, b in gaps) > 2 * (end_ms - start_ms)
+            if reset:
+                gaps = [(start_ms, end_ms)]
+                replace_from = None
+
+            # A longer range would come back coarser than the tier, fetch it a
+            # tier's range at a time. Pieces are fetched outwards from what is
+            # covered so coverage stays contiguous if one fails.
+            pieces = []
+            for gap_start, gap_end in gaps:
+                split = split_gap(int(gap_start), int(gap_end), longest and longest * 1000)
+                pieces.extend(reversed(split) if coverage and gap_end == coverage[0] else split)
+
+            for gap_start, gap_end in pieces:
+                kwargs = {'from': gap_start // 1000, 'to': -(-gap_end // 1000)}
+                logger.debug('Fetching %s price history from %d to %d', id, kwargs['from'], kwargs['to'])
+                data = await self.cg.coin_price_history(id, priority=priority, **kwargs)
+                times, prices = price_series.to_arrays((data or {}).get('prices', []))
+                times, prices = thin(times, prices, step)
+                replace = replace_from if gap_start == replace_from else None
+                await asyncio.to_thread(self.__store, id, tier, step, gap_start, gap_end, times, prices, reset, replace)
+                reset = False
+
+            return await asyncio.to_thread(self.__read, id, tier, start_ms, end_ms)
+
+    async def prices_many(self, ids, start, end, priority=coingecko_helper.PRIORITY_INTERACTIVE):
+        """Returns prices() for each of ids, fetching up to fetch_concurrency coins at once."""
+        async def fetch(id):
+            async with self.fetch_semaphore:
+                return await self.prices(id, start, end, priority)
+
+        return await asyncio.gather(*(fetch(id) for id in ids))
+
+    def __coverage(self, id, tier):
+        with self.db_lock:
+            return self.db.execute(
+                'SELECT start_ts, end_ts FROM coverage WHERE coin_id = ? AND tier = ?', (id, tier)).fetchone()
+
+    def __store(self, id, tier, step, gap_start, gap_end, times, prices, reset, replace_from):
+        # Anything past this is still changing and gets fetched again.
+        stable_end = min(gap_end, int(time.time() * 1000) - step)
+        with self.db_lock, self.db:
+            if reset:
+                self.db.execute('DELETE FROM prices WHERE coin_id = ? AND tier = ?', (id, tier))
+                self.db.execute('DELETE FROM coverage WHERE coin_id = ? AND tier = ?', (id, tier))
+            elif replace_from is not None:
+                self.db.execute(
+                    'DELETE FROM prices WHERE coin_id = ? AND tier = ? AND ts > ?', (id, tier, replace_from))
+
+            self.db.executemany(
+                'INSERT OR REPLACE INTO prices (coin_id, tier, ts, price) VALUES (?, ?, ?, ?)',
+                ((id, tier, int(ts), float(price)) for ts, price in zip(times, prices)))
+            self.db.execute('''
+                INSERT INTO coverage (coin_id, tier, start_ts, end_ts) VALUES (?, ?, ?, ?)
+                ON CONFLICT (coin_id, tier) DO UPDATE SET
+                    start_ts = min(start_ts, excluded.start_ts),
+                    end_ts = max(end_ts, excluded.end_ts)
+                ''', (id, tier, gap_start, max(gap_start, stable_end)))
+
+    def __read(self, id, tier, start_ms, end_ms):
+        import numpy as np
+
+        with self.db_lock:
+            rows = self.db.execute(
+                'SELECT ts, price FROM prices WHERE coin_id = ? AND tier = ? AND ts BETWEEN ? AND ? ORDER BY ts',
+                (id, tier, start_ms, end_ms)).fetchall()
+        data = np.array(rows, dtype=np.float64).reshape(-1, 2)
+        return data[:, 0], data[:, 1]
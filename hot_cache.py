@@ -0,0 +1,104 @@
+import collections
+
+# Largest count a sketch counter holds.
+MAX_COUNT = 15
+
+# Odd 64 bit multipliers, one per sketch row. A key's index in each row is
+# taken from the high bits of its hash times the row's multiplier, so keys
+# sharing a counter in one row rarely share it in the others.
+ROW_MULTIPLIERS = (0x9e3779b97f4a7c15, 0xbf58476d1ce4e5b9, 0x94d049bb133111eb, 0xc2b2ae3d27d4eb4f,
+                   0x165667b19e3779f9, 0xd6e8feb86659fd93, 0xff51afd7ed558ccd, 0xc4ceb9fe1a85ec53)
+MASK = (1 << 64) - 1
+
+
+class FrequencySketch:
+    """Approximate recent request counts, a count-min sketch with aging.
+
+    Counts are kept in depth rows of width small counters and read as the
+    smallest of a key's counters. Every sample_size increments all
+    counters are halved, so counts reflect recent popularity.
+    """
+
+    def __init__(self, width, depth=4, sample_size=None):
+        self.width = width
+        self.depth = depth
+        self.sample_size = sample_size or 10 * width
+        self.rows = [[0] * width for _ in range(depth)]
+        self.additions = 0
+
+    def __indexes(self, key):
+        h = hash(key) & MASK
+        return ((((h * multiplier) & MASK) >> 32) % self.width for multiplier in ROW_MULTIPLIERS[:self.depth])
+
+    def increment(self, key):
+        for row, index in zip(self.rows, self.__indexes(key)):
+            if row[index] < MAX_COUNT:
+                row[index] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self.rows = [[count >> 1 for count in row] for row in self.rows]
+            self.additions //= 2
+
+    def estimate(self, key):
+        return min(row[index] for row, index in zip(self.rows, self.__indexes(key)))
+
+
+class HotCache:
+    """Holds values for the most requested keys, up to capacity of them.
+
+    Every lookup counts towards a key's popularity. A new key only takes
+    the place of the least recently used one if it has been asked for more
+    often (TinyLFU admission), so a burst of one-off lookups passes through
+    without pushing out the coins everyone asks for.
+    """
+
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        # Small caches get a wider sketch, so their few keys rarely share every counter.
+        self.sketch = FrequencySketch(max(64, capacity))
+        # key -> value, least recently used first.
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, valid=None):
+        """Returns key's value or None, counting the request either way.
+
+        A value valid(value) rejects is treated as missing, for the caller
+        to put() a new one.
+        """
+        self.sketch.increment(key)
+        value = self.entries.get(key)
+        if value is None or (valid is not None and not valid(value)):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        """Stores value if key is held or popular enough to be admitted. Returns whether it was stored."""
+        if key in self.entries:
+            self.entries[key] = value
+            return True
+        if self.capacity <= 0:
+            return False
+
+        if len(self.entries) >= self.capacity:
+            victim = next(iter(self.entries))
+            if self.sketch.estimate(key) <= self.sketch.estimate(victim):
+                self.rejected += 1
+                return False
+            del self.entries[victim]
+        self.entries[key] = value
+        return True
+
+    def items(self):
+        return list(self.entries.items())
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'rejected': self.rejected, 'size': len(self.entries)}
@@ -0,0 +1,136 @@
+import coingecko_helper
+import logging
+import math
+import ranking_index
+import time
+
+logger = logging.getLogger(__name__)
+
+# Largest page coins/markets serves.
+PAGE_SIZE = 250
+
+# Price change windows requested from coins/markets.
+PRICE_CHANGE_WINDOWS = ['1h', '24h', '7d', '14d', '30d', '1y']
+
+
+def market_row_to_info(row):
+    """Reshapes a coins/markets row like the coins/{id} fields the price formatters read."""
+    if not row:
+        return None
+
+    def usd(value):
+        return {'usd': value} if value is not None else {}
+
+    market_data = {
+        'current_price': usd(row.get('current_price')),
+        'high_24h': usd(row.get('high_24h')),
+        'low_24h': usd(row.get('low_24h')),
+        'price_change_percentage_1h_in_currency': usd(row.get('price_change_percentage_1h_in_currency')),
+    }
+    for window in PRICE_CHANGE_WINDOWS[1:]:
+        value = row.get(f'price_change_percentage_{window}_in_currency')
+        if value is not None:
+            market_data[f'price_change_percentage_{window}'] = value
+
+    return {
+        'id': row.get('id'),
+        'symbol': row.get('symbol'),
+        'name': row.get('name'),
+        'market_cap_rank': row.get('market_cap_rank'),
+        'image': {'small': row.get('image')} if row.get('image') else {},
+        'market_data': market_data,
+    }
+
+
+class MarketSnapshot:
+    """In-memory table of coins/markets rows, kept fresh for the top coins by market cap.
+
+    Rows for other coins are fetched on demand, in one request per batch of ids.
+    """
+
+    def __init__(self, cg, top_n=500, max_age=300, interval=None):
+        self.cg = cg
+        self.top_n = top_n
+        # Seconds a row is served for before it is fetched again.
+        self.max_age = max_age
+        # tasks.loop interval arguments for refresh().
+        self.interval = interval or {'minutes': 2}
+        # str (coin id) -> coins/markets row
+        self.rows = dict()
+        # str (coin id) -> time.monotonic() the row was fetched
+        self.updated = dict()
+        # Top coins ordered by market cap and price changes, for /rankings.
+        self.rankings = ranking_index.RankingIndex(
+            [ranking_index.MARKET_CAP] + [ranking_index.change_metric(window) for window in PRICE_CHANGE_WINDOWS])
+
+    def __store(self, rows):
+        now = time.monotonic()
+        for row in rows:
+            self.rows[row['id']] = row
+            self.updated[row['id']] = now
+
+    def get(self, id, ahead=0):
+        """Returns the row for id if it is fresh enough to serve, otherwise None.
+
+        With ahead, rows expiring within that many seconds count as stale.
+        """
+        updated = self.updated.get(id)
+        if updated is None or time.monotonic() - updated > self.max_age - ahead:
+            return None
+        return self.rows[id]
+
+    async def refresh(self):
+        """Pages through coins/markets for the top coins, updates their rows and returns them."""
+        refreshed = list()
+        ranks = dict()
+        for page in range(1, math.ceil(self.top_n / PAGE_SIZE) + 1):
+            rows = await self.cg.coins_markets(
+                priority=coingecko_helper.PRIORITY_BACKGROUND,
+                order='market_cap_desc',
+                per_page=PAGE_SIZE,
+                page=page,
+                price_change_percentage=','.join(PRICE_CHANGE_WINDOWS))
+            if not rows:
+                break
+            self.__store(rows)
+            self.rankings.update(rows)
+            refreshed.extend(rows)
+            ranks.update((row['id'], row['market_cap_rank']) for row in rows if row.get('market_cap_rank'))
+
+        self.cg.update_ranks(ranks)
+        self.__expire()
+        logger.info('Market snapshot holds %d coins', len(self.rows))
+        return refreshed
+
+    def update(self, rows):
+        """Takes the top coins' rows from another snapshot's refresh(), a shard worker's from the parent's."""
+        self.__store(rows)
+        self.rankings.update(rows)
+        self.cg.update_ranks({row['id']: row['market_cap_rank'] for row in rows if row.get('market_cap_rank')})
+        self.__expire()
+
+    def __expire(self):
+        cutoff = time.monotonic() - self.max_age
+        expired = [id for id, updated in self.updated.items() if updated < cutoff]
+        for id in expired:
+            del self.rows[id]
+            del self.updated[id]
+        self.rankings.remove(expired)
+
+    async def fetch(self, ids, priority=coingecko_helper.PRIORITY_INTERACTIVE, ahead=0):
+        """Returns rows for ids in order, None for unknown coins.
+
+        Fresh rows come from the table, the rest are fetched together. ahead
+        is passed to get(), to refetch rows before they expire.
+        """
+        missing = [id for id in ids if self.get(id, ahead) is None]
+        for start in range(0, len(missing), PAGE_SIZE):
+            batch = missing[start:start + PAGE_SIZE]
+            rows = await self.cg.coins_markets(
+                priority=priority,
+                ids=','.join(batch),
+                per_page=len(batch),
+                price_change_percentage=','.join(PRICE_CHANGE_WINDOWS))
+            self.__store(rows or ())
+
+        return [self.get(id) or self.rows.get(id) for id in ids]
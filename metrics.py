@@ -0,0 +1,135 @@
+import asyncio
+import bisect
+import collections
+import contextlib
+import logging
+import time
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds of the latency histogram buckets.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """Fixed bucket histogram, cheap enough to update on every request."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # The last count is for values above every bucket.
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimates quantile q as the upper bound of the bucket it falls in."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class Metrics:
+    """Registry of counters and latency histograms, labelled by keyword arguments."""
+
+    def __init__(self):
+        # (name, labels) -> value, labels being a sorted tuple of (key, value)
+        self.counters = collections.Counter()
+        self.histograms = dict()
+        # Callables returning {(name, labels): value} of gauges read at export time.
+        self.collectors = []
+
+    def inc(self, name, amount=1, **labels):
+        self.counters[(name, tuple(sorted(labels.items())))] += amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """Observes the time spent in the with block in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def gauges(self):
+        values = dict()
+        for collector in self.collectors:
+            try:
+                values.update(collector())
+            except Exception:
+                logger.exception('Metrics collector failed')
+        return values
+
+    def render_prometheus(self):
+        """Returns every metric in the Prometheus text exposition format."""
+        lines = []
+
+        def labels_str(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            return '{%s}' % ','.join(f'{k}="{v}"' for k, v in pairs)
+
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append(f'{name}_total{labels_str(labels)} {value}')
+
+        for (name, labels), value in sorted(self.gauges().items()):
+            lines.append(f'{name}{labels_str(labels)} {value}')
+
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{labels_str(labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{name}_bucket{labels_str(labels, [("le", "+Inf")])} {histogram.count}')
+            lines.append(f'{name}_sum{labels_str(labels)} {histogram.sum}')
+            lines.append(f'{name}_count{labels_str(labels)} {histogram.count}')
+
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = Metrics()
+
+
+async def sample_loop_lag(interval=0.5):
+    """Records how late the event loop wakes up from a sleep of interval seconds."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        METRICS.observe('event_loop_lag_seconds', max(0.0, time.perf_counter() - start - interval))
+
+
+async def start_server(host='127.0.0.1', port=9100):
+    """Serves METRICS at /metrics from the running loop, returns the runner to clean up."""
+    async def handle(request):
+        return web.Response(text=METRICS.render_prometheus(), content_type='text/plain')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info('Serving metrics on http://%s:%d/metrics', host, port)
+    return runner
@@ -0,0 +1,188 @@
+import asyncio
+import collections
+import concurrent.futures
+import logging
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+BUY = 'buy'
+SELL = 'sell'
+
+# Holdings smaller than this are treated as sold out.
+DUST = 1e-12
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS accounts (
+    guild_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    cash REAL NOT NULL,
+    PRIMARY KEY (guild_id, user_id)
+);
+CREATE TABLE IF NOT EXISTS holdings (
+    guild_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    coin_id TEXT NOT NULL,
+    amount REAL NOT NULL,
+    cost REAL NOT NULL,
+    PRIMARY KEY (guild_id, user_id, coin_id)
+);
+CREATE TABLE IF NOT EXISTS trades (
+    id INTEGER PRIMARY KEY,
+    guild_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    coin_id TEXT NOT NULL,
+    side TEXT NOT NULL,
+    amount REAL NOT NULL,
+    price REAL NOT NULL,
+    ts INTEGER NOT NULL
+);
+'''
+
+# amount held and the USD paid for it.
+Holding = collections.namedtuple('Holding', 'amount cost')
+
+
+class TradeError(Exception):
+    """Raised for a trade the account can't make, the message says why."""
+
+
+class PaperLedger:
+    """SQLite backed paper trading accounts, mirrored in memory.
+
+    Accounts are per guild and user. Trades update memory straight away and
+    are written in order by a single background thread. Valuing every
+    account is one vectorized pass over all holdings, see value_all().
+    """
+
+    def __init__(self, path=':memory:', starting_cash=10000.0):
+        self.starting_cash = starting_cash
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.writer = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='paper-ledger')
+        # (guild id, user id) -> cash
+        self.cash = dict()
+        # (guild id, user id) -> {coin id: Holding}
+        self.holdings = collections.defaultdict(dict)
+        # str (coin id) -> last traded price, used until a tick prices the coin.
+        self.last_prices = dict()
+        # Holdings flattened into arrays for value_all(), rebuilt after trades.
+        self.arrays = None
+        with self.db:
+            self.db.executescript(SCHEMA)
+        self.load()
+
+    def load(self):
+        for guild_id, user_id, cash in self.db.execute('SELECT guild_id, user_id, cash FROM accounts'):
+            self.cash[(guild_id, user_id)] = cash
+        for guild_id, user_id, coin_id, amount, cost in self.db.execute(
+                'SELECT guild_id, user_id, coin_id, amount, cost FROM holdings'):
+            self.holdings[(guild_id, user_id)][coin_id] = Holding(amount, cost)
+        self.last_prices.update(self.db.execute('''
+            SELECT coin_id, price FROM trades WHERE id IN (SELECT max(id) FROM trades GROUP BY coin_id)'''))
+
+    def close(self):
+        self.writer.shutdown(wait=True)
+        self.db.close()
+
+    def held_ids(self):
+        """Returns the ids of every coin anyone holds."""
+        return list({coin_id for coins in self.holdings.values() for coin_id in coins})
+
+    def account(self, account):
+        """Returns (cash, {coin id: Holding}) for an account, starting cash if it never traded."""
+        return self.cash.get(account, self.starting_cash), dict(self.holdings.get(account, {}))
+
+    async def buy(self, account, coin_id, usd, price):
+        """Spends usd on coin_id at price, returns the amount bought."""
+        cash = self.cash.get(account, self.starting_cash)
+        if usd <= 0:
+            raise TradeError('Amount must be positive.')
+        if usd > cash + DUST:
+            raise TradeError(f'You only have ${cash:,.2f} cash.')
+
+        amount = usd / price
+        held = self.holdings[account].get(coin_id, Holding(0.0, 0.0))
+        await self.__trade(account, coin_id, BUY, amount, price, max(0.0, cash - usd),
+                           Holding(held.amount + amount, held.cost + usd))
+        return amount
+
+    async def sell(self, account, coin_id, amount, price):
+        """Sells amount of coin_id at price, everything held if amount is None. Returns the amount sold."""
+        held = self.holdings.get(account, {}).get(coin_id)
+        if held is None:
+            raise TradeError(f'You don\'t hold any {coin_id}.')
+        if amount is None:
+            amount = held.amount
+        if amount <= 0:
+            raise TradeError('Amount must be positive.')
+        if amount > held.amount * (1 + DUST):
+            raise TradeError(f'You only hold {held.amount:g} {coin_id}.')
+
+        amount = min(amount, held.amount)
+        left = held.amount - amount
+        # The cost basis shrinks in proportion to what is sold.
+        remaining = Holding(left, held.cost * left / held.amount) if left > DUST else None
+        cash = self.cash.get(account, self.starting_cash) + amount * price
+        await self.__trade(account, coin_id, SELL, amount, price, cash, remaining)
+        return amount
+
+    async def __trade(self, account, coin_id, side, amount, price, cash, holding):
+        self.cash[account] = cash
+        if holding is None:
+            self.holdings[account].pop(coin_id, None)
+            if not self.holdings[account]:
+                del self.holdings[account]
+        else:
+            self.holdings[account][coin_id] = holding
+        self.last_prices[coin_id] = price
+        self.arrays = None
+
+        trade = (*account, coin_id, side, amount, price, int(time.time()))
+        await asyncio.get_running_loop().run_in_executor(self.writer, self.__write, account, coin_id, cash, holding, trade)
+
+    def __write(self, account, coin_id, cash, holding, trade):
+        guild_id, user_id = account
+        with self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO accounts (guild_id, user_id, cash) VALUES (?, ?, ?)', (guild_id, user_id, cash))
+            if holding is None:
+                self.db.execute(
+                    'DELETE FROM holdings WHERE guild_id = ? AND user_id = ? AND coin_id = ?', (guild_id, user_id, coin_id))
+            else:
+                self.db.execute(
+                    'INSERT OR REPLACE INTO holdings (guild_id, user_id, coin_id, amount, cost) VALUES (?, ?, ?, ?, ?)',
+                    (guild_id, user_id, coin_id, holding.amount, holding.cost))
+            self.db.execute(
+                'INSERT INTO trades (guild_id, user_id, coin_id, side, amount, price, ts) VALUES (?, ?, ?, ?, ?, ?, ?)', trade)
+
+    def __build_arrays(self):
+        import numpy as np
+
+        accounts = sorted(self.cash.keys() | self.holdings.keys())
+        index = {account: i for i, account in enumerate(accounts)}
+        coin_ids = self.held_ids()
+        coin_index = {coin_id: i for i, coin_id in enumerate(coin_ids)}
+        rows = [(index[account], coin_index[coin_id], holding.amount)
+                for account, coins in self.holdings.items()
+                for coin_id, holding in coins.items()]
+        holding_accounts, holding_coins, amounts = (np.array(column) for column in zip(*rows)) if rows else (
+            np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp), np.zeros(0))
+        cash = np.array([self.cash.get(account, self.starting_cash) for account in accounts], dtype=np.float64)
+        self.arrays = (accounts, coin_ids, holding_accounts, holding_coins, amounts, cash)
+
+    def value_all(self, prices):
+        """Marks every account to market, returns ([account], numpy array of total USD value).
+
+        prices maps coin id -> USD. Coins missing from it are valued at their
+        last traded price.
+        """
+        import numpy as np
+
+        if self.arrays is None:
+            self.__build_arrays()
+        accounts, coin_ids, holding_accounts, holding_coins, amounts, cash = self.arrays
+        coin_prices = np.array([prices.get(coin_id) or self.last_prices.get(coin_id, 0.0) for coin_id in coin_ids],
+                               dtype=np.float64)
+        values = np.bincount(holding_accounts, weights=amounts * coin_prices[holding_coins], minlength=len(accounts))
+        return accounts, cash + values
@@ -0,0 +1,223 @@
+import coingecko_cog
+import collections
+import discord
+import heapq
+import logging
+import paper_ledger
+import time
+
+from discord.ext import commands, tasks
+from discord.commands import Option, slash_command
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# Accounts shown by /leaderboard.
+LEADERBOARD_SIZE = 10
+
+# A held coin, its cost basis and the price it is valued at.
+Position = collections.namedtuple('Position', 'coin_id amount cost price')
+
+
+class PaperBook:
+    """Paper trading accounts and their valuation.
+
+    Every held coin is priced once per tick(), from the market snapshot
+    where it is fresh and otherwise in one simple/price request, and all
+    accounts are then valued together. Portfolios and leaderboards only read
+    the results, so they cost no CoinGecko requests however many users trade.
+    """
+
+    def __init__(self, cg, ledger, snapshot=None, max_price_age=120):
+        self.cg = cg
+        self.ledger = ledger
+        self.snapshot = snapshot
+        # Seconds a tick price is traded at before fetching the coin's price again.
+        self.max_price_age = max_price_age
+        # str (coin id) -> USD price as of the last tick
+        self.prices = dict()
+        self.priced_at = 0.0
+        # int (guild id) -> [(total USD, user id)], best first
+        self.leaderboards = dict()
+
+    def close(self):
+        self.ledger.close()
+
+    def __price(self, coin_id):
+        """Returns a known price for coin_id without any request, or None."""
+        row = self.snapshot.get(coin_id) if self.snapshot else None
+        if row and row.get('current_price') is not None:
+            return row['current_price']
+        if time.monotonic() - self.priced_at < self.max_price_age:
+            return self.prices.get(coin_id)
+        return None
+
+    async def __trade_price(self, coin_id):
+        price = self.__price(coin_id)
+        if price is None:
+            price = (await self.cg.prices([coin_id])).get(coin_id)
+        if not price:
+            raise paper_ledger.TradeError(f'There is no price for {coin_id} right now.')
+        return price
+
+    async def buy(self, account, coin_id, usd):
+        """Spends usd on coin_id at its current price, returns (amount bought, price)."""
+        price = await self.__trade_price(coin_id)
+        return await self.ledger.buy(account, coin_id, usd, price), price
+
+    async def sell(self, account, coin_id, amount):
+        """Sells amount of coin_id at its current price, everything if None. Returns (amount sold, price)."""
+        price = await self.__trade_price(coin_id)
+        return await self.ledger.sell(account, coin_id, amount, price), price
+
+    async def portfolio(self, account):
+        """Returns (cash, [Position], starting cash) for an account."""
+        cash, holdings = self.ledger.account(account)
+        positions = [Position(coin_id, holding.amount, holding.cost,
+                              self.__price(coin_id) or self.prices.get(coin_id) or self.ledger.last_prices.get(coin_id, 0.0))
+                     for coin_id, holding in sorted(holdings.items())]
+        return cash, positions, self.ledger.starting_cash
+
+    async def leaderboard(self, guild_id):
+        """Returns [(total USD, user id)] for guild_id's best accounts as of the last tick."""
+        return self.leaderboards.get(guild_id, [])
+
+    async def tick(self):
+        prices = dict()
+        missing = []
+        for coin_id in self.ledger.held_ids():
+            row = self.snapshot.get(coin_id) if self.snapshot else None
+            if row and row.get('current_price') is not None:
+                prices[coin_id] = row['current_price']
+            else:
+                missing.append(coin_id)
+
+        prices.update(await coingecko_cog.fetch_prices(self.cg, missing))
+        self.prices = prices
+        self.priced_at = time.monotonic()
+
+        accounts, totals = self.ledger.value_all(prices)
+        by_guild = collections.defaultdict(list)
+        for (guild_id, user_id), total in zip(accounts, totals.tolist()):
+            by_guild[guild_id].append((total, user_id))
+        self.leaderboards = {guild_id: heapq.nlargest(LEADERBOARD_SIZE, entries) for guild_id, entries in by_guild.items()}
+
+
+class PaperTraderCog(commands.Cog):
+    """Paper trading with fake USD, valued against live prices, see PaperBook."""
+
+    def __init__(self, client, cg, book, interval=None, valuate=True):
+        self.client = client
+        self.cg = cg
+        self.book = book
+        self.interval = interval or {'minutes': 1}
+        # Without valuate the book is valued by whoever owns it, see shared_state.
+        if valuate:
+            self.valuation_tick.start()
+
+    def cog_unload(self):
+        self.valuation_tick.cancel()
+        self.book.close()
+
+    def __account(self, ctx):
+        return (ctx.guild_id or 0, ctx.author.id)
+
+    async def __resolve(self, ctx, id, is_id):
+        crypto, warning = coingecko_cog.resolve_coin(self.cg, id, is_id)
+        if not crypto:
+            await ctx.respond(f'Hi {ctx.author.mention}\n'
+                           f'Unfortunately Coin/Token {id} doesn\'t appear to exist.', ephemeral=True)
+        return crypto
+
+    @slash_command()
+    async def buy(
+        self,
+        ctx,
+        id: Option(str, 'Coingecko id or Symbol', autocomplete=coingecko_cog.symbol_id_searcher),
+        usd: Option(float, 'USD to spend', min_value=0),
+        is_id: Option(bool, 'True if Coingecko id', required=False, default=False),
+    ):
+        """Buys a cryptocurrency with paper money."""
+        crypto = await self.__resolve(ctx, id, is_id)
+        if not crypto:
+            return
+
+        try:
+            amount, price = await self.book.buy(self.__account(ctx), crypto, usd)
+        except paper_ledger.TradeError as e:
+            await ctx.respond(str(e), ephemeral=True)
+            return
+        await ctx.respond(f'Bought {amount:g} {crypto} at {coingecko_cog.price_str(price)} for ${usd:,.2f}')
+
+    @slash_command()
+    async def sell(
+        self,
+        ctx,
+        id: Option(str, 'Coingecko id or Symbol', autocomplete=coingecko_cog.symbol_id_searcher),
+        amount: Option(float, 'Amount of the coin to sell, everything if not given', required=False, default=None, min_value=0),
+        is_id: Option(bool, 'True if Coingecko id', required=False, default=False),
+    ):
+        """Sells a cryptocurrency bought with paper money."""
+        crypto = await self.__resolve(ctx, id, is_id)
+        if not crypto:
+            return
+
+        try:
+            amount, price = await self.book.sell(self.__account(ctx), crypto, amount)
+        except paper_ledger.TradeError as e:
+            await ctx.respond(str(e), ephemeral=True)
+            return
+        await ctx.respond(f'Sold {amount:g} {crypto} at {coingecko_cog.price_str(price)} for ${amount * price:,.2f}')
+
+    @slash_command()
+    async def portfolio(
+        self,
+        ctx,
+        user: Option(discord.Member, 'Whose portfolio, yours if not given', required=False, default=None),
+    ):
+        """Shows a paper trading portfolio."""
+        user = user or ctx.author
+        cash, positions, starting_cash = await self.book.portfolio((ctx.guild_id or 0, user.id))
+
+        embed = discord.Embed(title=f'{user.display_name}\'s portfolio')
+        total = cash
+        lines = []
+        for position in positions:
+            value = position.amount * position.price
+            total += value
+            change = (value / position.cost - 1) * 100 if position.cost else 0.0
+            lines.append((value, f'{position.amount:g} {position.coin_id} at {coingecko_cog.price_str(position.price)} = ${value:,.2f} ({change:+.2f}%)'))
+
+        # Largest positions first, within Discord's description limit.
+        description = '\n'.join(line for _, line in sorted(lines, reverse=True))
+        embed.description = description[:coingecko_cog.MAX_DESCRIPTION] or 'No coins held.'
+        embed.add_field(name='Cash', value=f'${cash:,.2f}')
+        embed.add_field(name='Total', value=f'${total:,.2f}')
+        change = (total / starting_cash - 1) * 100
+        embed.add_field(name='Return', value=f'{change:+.2f}%')
+        await ctx.respond(embed=embed)
+
+    @slash_command()
+    async def leaderboard(self, ctx):
+        """Shows this server's best paper traders as of the last valuation."""
+        entries = await self.book.leaderboard(ctx.guild_id or 0)
+        if not entries:
+            await ctx.respond('Nobody has traded here yet.')
+            return
+
+        lines = [f'{rank}. <@{user_id}> ${total:,.2f}' for rank, (total, user_id) in enumerate(entries, 1)]
+        embed = discord.Embed(title='Paper trading leaderboard', description='\n'.join(lines))
+        await ctx.respond(embed=embed, allowed_mentions=discord.AllowedMentions.none())
+
+    @tasks.loop(minutes=1)
+    async def valuation_tick(self):
+        try:
+            with METRICS.timer('update_loop_seconds', loop='paper_trading'):
+                await self.book.tick()
+        except Exception as e:
+            logger.exception(e)
+
+    @valuation_tick.before_loop
+    async def before_valuation_tick(self):
+        await self.client.wait_until_ready()
+        self.valuation_tick.change_interval(**self.interval)
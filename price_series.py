@@ -0,0 +1,92 @@
+import numpy as np
+
+
+def to_arrays(prices):
+    """Converts a market_chart [[timestamp_ms, price], ...] list into two float arrays.
+
+    Points without a price are dropped.
+    """
+    data = np.array(prices, dtype=np.float64).reshape(-1, 2)
+    data = data[~np.isnan(data).any(axis=1)]
+    return data[:, 0], data[:, 1]
+
+
+def _buckets(values, count):
+    """Reshapes values into count rows, padding the last row with NaN.
+
+    Returns (rows, bucket_size).
+    """
+    size = -(-len(values) // count)
+    padded = np.full(count * size, np.nan)
+    padded[:len(values)] = values
+    return padded.reshape(count, size), size
+
+
+def lttb(x, y, count):
+    """Downsamples to count points with Largest-Triangle-Three-Buckets.
+
+    Keeps the first and last points. Each bucket keeps the point forming the
+    largest triangle with the previously kept point and the mean of the
+    next bucket, which preserves the visual shape of the line.
+    """
+    n = len(y)
+    if count >= n or count < 3:
+        return x, y
+
+    edges = np.linspace(1, n - 1, count - 1).astype(np.intp)
+    index = np.empty(count, dtype=np.intp)
+    index[0] = 0
+    index[-1] = n - 1
+
+    # Means of every bucket, the "next bucket" point for the one before it.
+    sums_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1)
+    sizes = np.diff(edges)
+    mean_x = np.append(sums_x / sizes, x[-1])
+    mean_y = np.append(sums_y / sizes, y[-1])
+
+    a = 0
+    for i in range(count - 2):
+        lo, hi = edges[i], edges[i + 1]
+        bx = x[lo:hi]
+        by = y[lo:hi]
+        # Twice the triangle area, the constant factor doesn't change the argmax.
+        area = np.abs((x[a] - mean_x[i + 1]) * (by - y[a]) - (x[a] - bx) * (mean_y[i + 1] - y[a]))
+        a = lo + int(np.argmax(area))
+        index[i + 1] = a
+
+    return x[index], y[index]
+
+
+def ohlc(x, y, count):
+    """Aggregates into count candles of equal point count.
+
+    Returns (times, opens, highs, lows, closes), each candle timed at its first point.
+    """
+    count = min(count, len(y))
+    rows, size = _buckets(y, count)
+    rows = rows[~np.isnan(rows).all(axis=1)]
+    starts = np.arange(len(rows)) * size
+    ends = np.minimum(starts + size, len(y)) - 1
+    return x[starts], y[starts], np.nanmax(rows, axis=1), np.nanmin(rows, axis=1), y[ends]
+
+
+def align(series, count):
+    """Resamples several (times, prices) series onto one grid of count times.
+
+    The grid spans every series, each is linearly interpolated onto it and
+    is NaN outside its own range. Returns (times, 2D array of prices with a
+    row per series).
+    """
+    start = min(times[0] for times, _ in series)
+    end = max(times[-1] for times, _ in series)
+    grid = np.linspace(start, end, count)
+    rows = np.vstack([np.interp(grid, times, prices, left=np.nan, right=np.nan) for times, prices in series])
+    return grid, rows
+
+
+def percent_change(rows):
+    """Converts each row of prices into percent change from its first price."""
+    first = np.argmax(~np.isnan(rows), axis=1)
+    base = rows[np.arange(len(rows)), first][:, np.newaxis]
+    return (rows / base - 1) * 100
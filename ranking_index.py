@@ -0,0 +1,65 @@
+import bisect
+
+MARKET_CAP = 'market_cap'
+
+
+def change_metric(window):
+    """Name of the metric ranking coins by price change over window, such as '24h'."""
+    return f'price_change_percentage_{window}_in_currency'
+
+
+class RankingIndex:
+    """Coins kept sorted by market cap and price changes.
+
+    Each metric keeps a sorted list of (value, coin id). Updating a coin is a
+    bisection to remove its old entry and one to insert the new one, so a
+    page of rankings is a slice rather than a sort over every coin.
+    """
+
+    def __init__(self, metrics):
+        # metric -> sorted list of (value, coin id), ascending
+        self.sorted = {metric: [] for metric in metrics}
+        # str (coin id) -> {metric: value}
+        self.values = dict()
+
+    def __len__(self):
+        return len(self.values)
+
+    def update(self, rows):
+        """Adds or moves coins from coins/markets rows."""
+        for row in rows:
+            id = row['id']
+            old = self.values.get(id, {})
+            new = dict()
+            for metric, entries in self.sorted.items():
+                value = row.get(metric)
+                if value is not None:
+                    new[metric] = value
+                if old.get(metric) == value:
+                    continue
+                if metric in old:
+                    del entries[bisect.bisect_left(entries, (old[metric], id))]
+                if value is not None:
+                    bisect.insort(entries, (value, id))
+            if new:
+                self.values[id] = new
+            else:
+                # Not ranked by anything, don't count it.
+                self.values.pop(id, None)
+
+    def remove(self, ids):
+        for id in ids:
+            for metric, value in self.values.pop(id, {}).items():
+                entries = self.sorted[metric]
+                del entries[bisect.bisect_left(entries, (value, id))]
+
+    def count(self, metric):
+        return len(self.sorted[metric])
+
+    def page(self, metric, start, count, descending=True):
+        """Returns up to count (value, coin id) from position start, highest first if descending."""
+        entries = self.sorted[metric]
+        if not descending:
+            return entries[start:start + count]
+        end = len(entries) - start
+        return entries[max(0, end - count):max(0, end)][::-1]
@@ -0,0 +1,123 @@
+import coingecko_cog
+import discord
+import fx_rates
+import logging
+import market_snapshot
+import ranking_index
+
+from discord.ext import commands
+from discord.commands import Option, SlashCommandGroup
+
+logger = logging.getLogger(__name__)
+
+# Coins per page.
+PAGE_SIZE = 10
+
+# Seconds the page buttons keep working.
+VIEW_TIMEOUT = 300
+
+
+class RankingsView(discord.ui.View):
+    """Previous/next buttons over a ranking, each page read from the index when shown."""
+
+    def __init__(self, cog, title, metric, descending, page=0, currency=fx_rates.USD, rate=1.0):
+        super().__init__(timeout=VIEW_TIMEOUT)
+        self.cog = cog
+        self.title = title
+        self.metric = metric
+        self.descending = descending
+        self.page = page
+        self.currency = currency
+        self.rate = rate
+        self.update_buttons()
+
+    def pages(self):
+        return max(1, -(-self.cog.snapshot.rankings.count(self.metric) // PAGE_SIZE))
+
+    def update_buttons(self):
+        self.previous_page.disabled = self.page <= 0
+        self.next_page.disabled = self.page >= self.pages() - 1
+
+    def embed(self):
+        self.page = min(self.page, self.pages() - 1)
+        return self.cog.rankings_embed(self.title, self.metric, self.descending, self.page, self.pages(), self.currency, self.rate)
+
+    @discord.ui.button(label='Previous', style=discord.ButtonStyle.secondary)
+    async def previous_page(self, button, interaction):
+        self.page -= 1
+        await self.show(interaction)
+
+    @discord.ui.button(label='Next', style=discord.ButtonStyle.secondary)
+    async def next_page(self, button, interaction):
+        self.page += 1
+        await self.show(interaction)
+
+    async def show(self, interaction):
+        embed = self.embed()
+        self.update_buttons()
+        await interaction.response.edit_message(embed=embed, view=self)
+
+
+class RankingsCog(commands.Cog):
+    """Top coins by market cap and biggest movers, from the market snapshot's ranking index."""
+
+    rankings = SlashCommandGroup('rankings', 'Coin rankings')
+
+    def __init__(self, client, snapshot, currency_for=None):
+        self.client = client
+        self.snapshot = snapshot
+        # async function of ctx returning (currency, units per USD), see CoinGeckoCog.currency_for.
+        self.currency_for = currency_for
+
+    def rankings_embed(self, title, metric, descending, page, pages, currency=fx_rates.USD, rate=1.0):
+        entries = self.snapshot.rankings.page(metric, page * PAGE_SIZE, PAGE_SIZE, descending)
+        target = currency.upper()
+        lines = []
+        for position, (value, id) in enumerate(entries, page * PAGE_SIZE + 1):
+            row = self.snapshot.rows.get(id, {})
+            name = f"{row.get('name', id)} ({row.get('symbol', '').upper()})"
+            price = coingecko_cog.price_str((row.get('current_price') or 0) * rate, target=target)
+            if metric == ranking_index.MARKET_CAP:
+                value *= rate
+                detail = f'${value:,.0f}' if target == 'USD' else f'{value:,.0f} {target}'
+            else:
+                detail = f'{value:+.2f}%'
+            lines.append(f'{position}. {name} {price} {detail}')
+
+        embed = discord.Embed(title=title, description='\n'.join(lines) or 'No coins ranked yet.')
+        embed.set_footer(text=f'Page {page + 1}/{pages} of the top {len(self.snapshot.rankings)} coins by market cap')
+        return embed
+
+    async def send_rankings(self, ctx, title, metric, descending, page):
+        currency, rate = await self.currency_for(ctx) if self.currency_for else (fx_rates.USD, 1.0)
+        view = RankingsView(self, title, metric, descending, max(0, page - 1), currency, rate)
+        await ctx.respond(embed=view.embed(), view=view)
+
+    @rankings.command(name='marketcap')
+    async def market_cap(
+        self,
+        ctx,
+        page: Option(int, 'Page to start on', required=False, default=1, min_value=1),
+    ):
+        """Lists coins by market cap."""
+        await self.send_rankings(ctx, 'Top coins by market cap', ranking_index.MARKET_CAP, True, page)
+
+    @rankings.command()
+    async def gainers(
+        self,
+        ctx,
+        window: Option(str, 'Price change over', choices=market_snapshot.PRICE_CHANGE_WINDOWS, required=False, default='24h'),
+        page: Option(int, 'Page to start on', required=False, default=1, min_value=1),
+    ):
+        """Lists the coins whose price rose the most."""
+        await self.send_rankings(ctx, f'Top gainers, {window}', ranking_index.change_metric(window), True, page)
+
+    @rankings.command()
+    async def losers(
+        self,
+        ctx,
+        window: Option(str, 'Price change over', choices=market_snapshot.PRICE_CHANGE_WINDOWS, required=False, default='24h'),
+        page: Option(int, 'Page to start on', required=False, default=1, min_value=1),
+    ):
+        """Lists the coins whose price fell the most."""
+        await self.send_rankings(ctx, f'Top losers, {window}', ranking_index.change_metric(window), False, page)
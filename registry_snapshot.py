@@ -0,0 +1,93 @@
+import asyncio
+import json
+import logging
+import os
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+# Bumped whenever the layout of the saved registry changes.
+VERSION = 1
+
+# File header, followed by a format byte and the encoded registry.
+MAGIC = b'CGREG'
+MSGPACK = b'M'
+JSON = b'J'
+
+
+def encode(registry):
+    if msgpack is not None:
+        return MAGIC + MSGPACK + msgpack.packb(registry, use_bin_type=True)
+    return MAGIC + JSON + json.dumps(registry, separators=(',', ':')).encode()
+
+
+def decode(data):
+    if not data.startswith(MAGIC):
+        raise ValueError('not a coin registry snapshot')
+    kind = data[len(MAGIC):len(MAGIC) + 1]
+    payload = data[len(MAGIC) + 1:]
+    if kind == MSGPACK:
+        if msgpack is None:
+            raise ValueError('snapshot was written with msgpack which is not installed')
+        return msgpack.unpackb(payload, raw=False, strict_map_key=False)
+    if kind == JSON:
+        return json.loads(payload)
+    raise ValueError(f'unknown snapshot format {kind!r}')
+
+
+class RegistrySnapshot:
+    """Saves the coin registry to disk so commands work straight after a restart.
+
+    Holds the coin list, preferred ids and market cap ranks. The symbol map
+    and autocomplete indexes are rebuilt from the sorted coin list on load.
+    msgpack is used when installed, JSON otherwise.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Registry digest and preferences as of the last save.
+        self.saved = None
+
+    def load(self, cg):
+        """Loads the snapshot into cg, returns False if there was none usable."""
+        try:
+            with open(self.path, 'rb') as f:
+                registry = decode(f.read())
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            logger.warning('Ignoring coin registry snapshot %s: %s', self.path, e)
+            return False
+
+        if registry.get('version') != VERSION:
+            logger.warning('Ignoring coin registry snapshot %s with version %s', self.path, registry.get('version'))
+            return False
+
+        cg.load_registry(registry)
+        self.saved = self.__state(cg)
+        logger.info('Loaded %d coins from %s', len(cg.coins), self.path)
+        return True
+
+    def __state(self, cg):
+        return (cg.coins_digest, tuple(sorted(cg.preferred_ids.items())))
+
+    async def save(self, cg, force=False):
+        """Writes the registry if the coin list or preferences changed since the last save."""
+        state = self.__state(cg)
+        if not force and state == self.saved:
+            return
+
+        registry = cg.export_registry()
+        registry['version'] = VERSION
+        await asyncio.to_thread(self.__write, encode(registry))
+        self.saved = state
+
+    def __write(self, data):
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
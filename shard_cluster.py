@@ -0,0 +1,309 @@
+import aiohttp
+import alert_engine
+import asyncio
+import coingecko_helper
+import collections
+import itertools
+import json
+import logging
+import multidict
+import os
+import paper_ledger
+import yarl
+
+logger = logging.getLogger(__name__)
+
+GATEWAY_BOT_URL = 'https://discord.com/api/v10/gateway/bot'
+
+# Stream buffer limit, large enough for a whole coins/list response.
+MAX_MESSAGE = 64 * 1024 * 1024
+
+# Seconds between shards identifying, Discord allows one every 5 seconds.
+IDENTIFY_INTERVAL = 5.5
+
+# Seconds before a crashed worker is started again.
+RESTART_DELAY = 10
+
+
+class RemoteFetchError(Exception):
+    """Raised when the fetcher failed a request for a reason other than an HTTP error."""
+
+
+# Exceptions a call can raise that are raised again in the worker, by name.
+SHARED_ERRORS = {error.__name__: error for error in (alert_engine.AlertLimitReached, paper_ledger.TradeError)}
+
+
+def encode(message):
+    if coingecko_helper.orjson is not None:
+        return coingecko_helper.orjson.dumps(message) + b'\n'
+    return json.dumps(message, separators=(',', ':')).encode() + b'\n'
+
+
+def split_shards(shard_count, workers):
+    """Returns the shard ids each worker runs, contiguous and as even as possible."""
+    workers = max(1, min(workers, shard_count))
+    return [list(range(shard_count * w // workers, shard_count * (w + 1) // workers)) for w in range(workers)]
+
+
+def worker_path(path, worker):
+    """Gives each worker its own file, 'cryptobot.log' -> 'cryptobot.worker1.log'."""
+    if worker is None or not path or path == ':memory:':
+        return path
+    root, ext = os.path.splitext(path)
+    return f'{root}.worker{worker}{ext}'
+
+
+async def recommended_shards(token):
+    """Asks Discord how many shards the bot should run."""
+    async with aiohttp.ClientSession() as session:
+        async with session.get(GATEWAY_BOT_URL, headers={'Authorization': f'Bot {token}'}) as r:
+            r.raise_for_status()
+            return (await r.json())['shards']
+
+
+class FetcherServer:
+    """Serves one CoinGeckoAPI and the parent's shared state to the worker processes over a unix socket.
+
+    Each call is a line of JSON, [call id, method, args], answered by
+    [call id, result, error]. 'request' calls go through the API's cache and
+    rate limiter, so workers share them as if they were one bot, other
+    methods are added with register(). publish() pushes [None, topic, payload]
+    to every worker, and the last payload of a kept topic is handed to
+    workers when they connect.
+    """
+
+    def __init__(self, cg, path):
+        self.cg = cg
+        self.path = path
+        self.server = None
+        self.connections = set()
+        # str (method) -> async function called with the call's args
+        self.handlers = {'request': self.__request, 'state': self.__state}
+        # str (topic) -> last payload published with keep
+        self.kept = dict()
+
+    def register(self, method, handler):
+        self.handlers[method] = handler
+
+    def publish(self, topic, payload, keep=False):
+        if keep:
+            self.kept[topic] = payload
+        message = encode([None, topic, payload])
+        for writer in self.connections:
+            writer.write(message)
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.server = await asyncio.start_unix_server(self.__serve, self.path, limit=MAX_MESSAGE)
+        os.chmod(self.path, 0o600)
+        logger.info('Serving CoinGecko requests on %s', self.path)
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            for writer in self.connections:
+                writer.close()
+            await self.server.wait_closed()
+            self.server = None
+        await self.cg.close()
+
+    async def __serve(self, reader, writer):
+        calls = set()
+        self.connections.add(writer)
+        try:
+            while line := await reader.readline():
+                call = asyncio.ensure_future(self.__call(writer, coingecko_helper.json_loads(line)))
+                calls.add(call)
+                call.add_done_callback(calls.discard)
+        except ConnectionError:
+            pass
+        finally:
+            for call in calls:
+                call.cancel()
+            self.connections.discard(writer)
+            writer.close()
+
+    async def __request(self, path, params, endpoint, priority):
+        return await self.cg.request(self.cg.api_base_url + path, params, endpoint, priority)
+
+    async def __state(self):
+        return self.kept
+
+    async def __call(self, writer, message):
+        call_id, method, args = message
+        error = None
+        result = None
+        try:
+            result = await self.handlers[method](*args)
+        except aiohttp.ClientResponseError as e:
+            error = {'status': e.status, 'message': e.message}
+        except asyncio.TimeoutError:
+            error = {'timeout': True}
+        except tuple(SHARED_ERRORS.values()) as e:
+            error = {'type': type(e).__name__, 'message': str(e)}
+        except Exception as e:
+            logger.exception('%s %s for a worker failed', method, args[0] if args else '')
+            error = {'message': str(e)}
+
+        writer.write(encode([call_id, result, error]))
+        await writer.drain()
+
+
+class RemoteCoinGeckoAPI(coingecko_helper.CoinGeckoAPI):
+    """CoinGeckoAPI of a worker process, fetching through the parent's FetcherServer.
+
+    The coin registry and indexes are still kept locally, only requests are
+    forwarded. Caching and rate limiting happen once, in the parent, and
+    preferred ids are set there for every worker. call() and subscribe()
+    reach the rest of the parent's shared state.
+    """
+
+    def __init__(self, socket_path, api_base_url=coingecko_helper.API_URL_BASE):
+        super().__init__(api_base_url)
+        self.socket_path = socket_path
+        self.writer = None
+        self.receiver = None
+        self.connect_lock = asyncio.Lock()
+        self.call_ids = itertools.count()
+        # int (call id) -> asyncio.Future of (result, error)
+        self.pending = dict()
+        # str (topic) -> [callback(payload)]
+        self.subscribers = collections.defaultdict(list)
+        # The parent's cache stats and queued requests, as last published.
+        self.remote_stats = {'cache': {}, 'queued': 0}
+        self.subscribe('preferred', self.__set_preferred_ids)
+        self.subscribe('stats', self.__set_stats)
+
+    async def start(self):
+        async with self.connect_lock:
+            if self.writer is None:
+                reader, self.writer = await asyncio.open_unix_connection(self.socket_path, limit=MAX_MESSAGE)
+                self.receiver = asyncio.ensure_future(self.__receive(reader, self.writer))
+                # Catch up on what was published before this connection.
+                kept, error = await self.__call('state', ())
+                if error is None:
+                    for topic, payload in kept.items():
+                        self.__publish(topic, payload)
+
+    def subscribe(self, topic, callback):
+        """Calls callback(payload) for everything the parent publishes on topic."""
+        self.subscribers[topic].append(callback)
+
+    def __publish(self, topic, payload):
+        for callback in self.subscribers.get(topic, ()):
+            try:
+                callback(payload)
+            except Exception:
+                logger.exception('Handling %s from the parent failed', topic)
+
+    def __set_preferred_ids(self, preferred_ids):
+        self.preferred_ids = dict(preferred_ids)
+
+    def __set_stats(self, stats):
+        self.remote_stats = stats
+
+    def cache_stats(self):
+        return self.remote_stats['cache']
+
+    def queued_requests(self):
+        return self.remote_stats['queued']
+
+    async def prefer(self, symbol, id):
+        self.set_preferred(symbol, id)
+        await self.call('set_preferred', symbol, id)
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.receiver.cancel()
+            self.writer = None
+
+    async def __receive(self, reader, writer):
+        try:
+            while line := await reader.readline():
+                call_id, result, error = coingecko_helper.json_loads(line)
+                if call_id is None:
+                    self.__publish(result, error)
+                    continue
+                future = self.pending.get(call_id)
+                if future is not None and not future.done():
+                    future.set_result((result, error))
+        except ConnectionError:
+            pass
+        finally:
+            if self.writer is writer:
+                logger.warning('Lost the connection to the CoinGecko fetcher')
+                self.writer = None
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError('Lost the connection to the CoinGecko fetcher'))
+
+    async def __call(self, method, args):
+        call_id = next(self.call_ids)
+        future = self.pending[call_id] = asyncio.get_running_loop().create_future()
+        try:
+            self.writer.write(encode([call_id, method, args]))
+            await self.writer.drain()
+            return await future
+        finally:
+            del self.pending[call_id]
+
+    async def call(self, method, *args, url=None):
+        """Calls one of the parent's methods, see FetcherServer.register()."""
+        await self.start()
+        result, error = await self.__call(method, args)
+        if error is None:
+            return result
+        if 'status' in error:
+            url = yarl.URL(url or self.api_base_url)
+            request_info = aiohttp.RequestInfo(url, 'GET', multidict.CIMultiDictProxy(multidict.CIMultiDict()), url)
+            raise aiohttp.ClientResponseError(request_info, (), status=error['status'], message=error['message'])
+        if error.get('timeout'):
+            raise asyncio.TimeoutError()
+        if error.get('type') in SHARED_ERRORS:
+            raise SHARED_ERRORS[error['type']](error['message'])
+        raise RemoteFetchError(error['message'])
+
+    async def request(self, url, params=None, endpoint=None, priority=coingecko_helper.PRIORITY_INTERACTIVE):
+        return await self.call('request', url[len(self.api_base_url):], params or {}, endpoint, priority, url=url)
+
+
+async def supervise(name, start, delay=0):
+    """Runs start()'s process after delay seconds, starting it again if it crashes."""
+    await asyncio.sleep(delay)
+    while True:
+        process = start()
+        try:
+            await asyncio.to_thread(process.join)
+        except asyncio.CancelledError:
+            process.terminate()
+            raise
+        if process.exitcode == 0:
+            return
+        logger.error('%s exited with %s, restarting in %ds', name, process.exitcode, RESTART_DELAY)
+        await asyncio.sleep(RESTART_DELAY)
+
+
+async def run_cluster(cg, socket_path, shards, start_worker, state=None):
+    """Runs a worker process per list in shards, sharing cg through a FetcherServer.
+
+    start_worker(worker, shard_ids) starts and returns a worker's process.
+    Workers are started in turn so their shards don't identify at once.
+    state, a shared_state.SharedState, is served to the workers and its
+    loops run alongside them.
+    """
+    server = FetcherServer(cg, socket_path)
+    if state is not None:
+        state.serve(server)
+    await server.start()
+    try:
+        delays = itertools.accumulate((len(shard_ids) * IDENTIFY_INTERVAL for shard_ids in shards), initial=0)
+        await asyncio.gather(*(
+            supervise(f'Worker {worker}', lambda worker=worker, shard_ids=shard_ids: start_worker(worker, shard_ids), delay)
+            for (worker, shard_ids), delay in zip(enumerate(shards), delays)),
+            *([state.run()] if state is not None else []))
+    finally:
+        if state is not None:
+            state.close()
+        await server.close()
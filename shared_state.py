@@ -0,0 +1,245 @@
+import alert_cog
+import alert_engine
+import asyncio
+import coingecko_helper
+import datetime
+import fx_rates
+import guild_settings
+import history_store
+import logging
+import market_snapshot
+import paper_trader_cog
+import time
+
+logger = logging.getLogger(__name__)
+
+# How often the parent's cache stats are published to the workers.
+STATS_INTERVAL = {'seconds': 15}
+
+
+class SharedState:
+    """State the shard workers share, owned by the cluster's parent process.
+
+    Preferred ids, price history, guild settings, alerts and paper trading
+    accounts are kept here in one set of files, so every worker sees the same
+    and nothing is lost when shards move between workers. Workers reach it
+    through the FetcherServer using the Remote classes below. Refreshing the
+    coin list, market snapshot and exchange rates, checking alerts and valuing
+    accounts run here once instead of once per worker, and the results are
+    published to the workers.
+    """
+
+    def __init__(self, cg, registry=None, history=None, settings=None, alerts=None, book=None, intervals=None,
+                 snapshot=None, fx=None):
+        self.cg = cg
+        self.registry = registry
+        self.history = history or history_store.HistoryStore(cg)
+        self.settings = settings or guild_settings.GuildSettings()
+        self.alerts = alerts or alert_engine.AlertEngine()
+        self.book = book
+        self.snapshot = snapshot or market_snapshot.MarketSnapshot(cg, top_n=0)
+        self.fx = fx or fx_rates.FxTable(cg)
+        # loop name -> interval, as keyword arguments of timedelta
+        self.intervals = {'new_coins': {'hours': 1}, 'alerts': {'minutes': 1}, 'paper_trading': {'minutes': 1},
+                          'stats': STATS_INTERVAL, 'market_snapshot': self.snapshot.interval,
+                          'fx': {'seconds': self.fx.max_age}}
+        self.intervals.update({name: interval for name, interval in (intervals or {}).items() if interval})
+        self.server = None
+
+    def serve(self, server):
+        """Registers the workers' calls with server, a shard_cluster.FetcherServer."""
+        self.server = server
+        server.register('set_preferred', self.set_preferred)
+        server.register('history', self.history_prices)
+        server.register('set_currency', self.set_currency)
+        server.register('add_alert', self.add_alert)
+        server.register('list_alerts', self.list_alerts)
+        server.register('remove_alert', self.remove_alert)
+        if self.book:
+            server.register('paper_buy', self.paper_buy)
+            server.register('paper_sell', self.paper_sell)
+            server.register('portfolio', self.portfolio)
+            server.register('leaderboard', self.leaderboard)
+        server.publish('preferred', dict(self.cg.preferred_ids), keep=True)
+        server.publish('settings', self.settings.guilds, keep=True)
+
+    def close(self):
+        self.history.close()
+        if self.book:
+            self.book.close()
+
+    async def run(self):
+        loops = [self.__every('new_coins', self.update_coins), self.__every('alerts', self.check_alerts),
+                 self.__every('stats', self.publish_stats), self.__every('fx', self.refresh_rates)]
+        if self.snapshot.top_n:
+            loops.append(self.__every('market_snapshot', self.refresh_snapshot))
+        if self.book:
+            loops.append(self.__every('paper_trading', self.book.tick))
+        await asyncio.gather(*loops)
+
+    async def __every(self, name, func):
+        while True:
+            try:
+                await func()
+            except Exception as e:
+                logger.exception(e)
+            await asyncio.sleep(datetime.timedelta(**self.intervals[name]).total_seconds())
+
+    async def update_coins(self):
+        await self.cg.new_coins()
+        if self.registry:
+            await self.registry.save(self.cg)
+        # Removed coins lose their preferences.
+        self.server.publish('preferred', dict(self.cg.preferred_ids), keep=True)
+        # Workers refresh theirs from the coins/list response just cached here.
+        self.server.publish('coins', None)
+
+    async def refresh_snapshot(self):
+        rows = await self.snapshot.refresh()
+        self.server.publish('snapshot', rows, keep=True)
+
+    async def refresh_rates(self):
+        await self.fx.refresh()
+        self.server.publish('fx', {'rates': self.fx.rates, 'names': self.fx.names}, keep=True)
+
+    async def check_alerts(self):
+        fired = await alert_cog.check_prices(self.cg, self.alerts)
+        if fired:
+            # The worker that has the alert's server sends it, see AlertCog.notify_own().
+            self.server.publish('alerts', [[list(alert), price] for alert, price in fired])
+
+    async def publish_stats(self):
+        self.server.publish('stats', {'cache': self.cg.cache_stats(), 'queued': self.cg.queued_requests()}, keep=True)
+
+    async def set_preferred(self, symbol, id):
+        self.cg.set_preferred(symbol, id)
+        if self.registry:
+            await self.registry.save(self.cg)
+        self.server.publish('preferred', dict(self.cg.preferred_ids), keep=True)
+
+    async def history_prices(self, ids, start, end, priority):
+        series = await self.history.prices_many(ids, start, end, priority)
+        return [[times.tolist(), prices.tolist()] for times, prices in series]
+
+    async def set_currency(self, guild_id, currency):
+        await self.settings.set_currency(guild_id, currency)
+        self.server.publish('settings', self.settings.guilds, keep=True)
+
+    async def add_alert(self, user_id, channel_id, coin_id, direction, threshold, guild_id=None):
+        return list(await self.alerts.add(user_id, channel_id, coin_id, direction, threshold, guild_id))
+
+    async def list_alerts(self, user_id):
+        return [list(alert) for alert in await self.alerts.for_user(user_id)]
+
+    async def remove_alert(self, user_id, alert_id):
+        return await self.alerts.remove(user_id, alert_id)
+
+    async def paper_buy(self, account, coin_id, usd):
+        return await self.book.buy(tuple(account), coin_id, usd)
+
+    async def paper_sell(self, account, coin_id, amount):
+        return await self.book.sell(tuple(account), coin_id, amount)
+
+    async def portfolio(self, account):
+        cash, positions, starting_cash = await self.book.portfolio(tuple(account))
+        return cash, [list(position) for position in positions], starting_cash
+
+    async def leaderboard(self, guild_id):
+        return await self.book.leaderboard(guild_id)
+
+
+class RemoteHistoryStore:
+    """HistoryStore of a worker, reading the parent's."""
+
+    def __init__(self, cg):
+        self.cg = cg
+
+    def close(self):
+        pass
+
+    async def prices(self, id, start, end, priority=coingecko_helper.PRIORITY_INTERACTIVE):
+        return (await self.prices_many([id], start, end, priority))[0]
+
+    async def prices_many(self, ids, start, end, priority=coingecko_helper.PRIORITY_INTERACTIVE):
+        import numpy as np
+
+        series = await self.cg.call('history', list(ids), start, end, priority)
+        return [(np.array(times, dtype=np.float64), np.array(prices, dtype=np.float64)) for times, prices in series]
+
+
+class RemoteGuildSettings(guild_settings.GuildSettings):
+    """GuildSettings of a worker, a copy of the parent's kept up to date by it."""
+
+    def __init__(self, cg):
+        super().__init__()
+        self.cg = cg
+        cg.subscribe('settings', self.__update)
+
+    def __update(self, guilds):
+        self.guilds = guilds
+
+    async def set_currency(self, guild_id, currency):
+        await self.cg.call('set_currency', guild_id, currency)
+
+
+class RemoteFxTable(fx_rates.FxTable):
+    """FxTable of a worker, a copy of the parent's kept up to date by it."""
+
+    def __init__(self, cg, max_age=300):
+        super().__init__(cg, max_age)
+        cg.subscribe('fx', self.__update)
+
+    def __update(self, table):
+        self.rates = table['rates']
+        self.names = table['names']
+        self.updated = time.monotonic()
+
+    async def refresh(self):
+        # The parent refreshes the rates, stale ones are kept until it does.
+        pass
+
+
+class RemoteAlertEngine:
+    """AlertEngine of a worker, the parent's alerts checked by the parent."""
+
+    def __init__(self, cg, max_per_user=10):
+        self.cg = cg
+        self.max_per_user = max_per_user
+
+    def listen(self, callback):
+        """Has callback([(alert, price)]) called with every batch of fired alerts."""
+        def fired(payload):
+            asyncio.ensure_future(callback([(alert_engine.Alert(*fields), price) for fields, price in payload]))
+        self.cg.subscribe('alerts', fired)
+
+    async def add(self, user_id, channel_id, coin_id, direction, threshold, guild_id=None):
+        return alert_engine.Alert(*await self.cg.call('add_alert', user_id, channel_id, coin_id, direction, threshold, guild_id))
+
+    async def remove(self, user_id, alert_id):
+        return await self.cg.call('remove_alert', user_id, alert_id)
+
+    async def for_user(self, user_id):
+        return [alert_engine.Alert(*fields) for fields in await self.cg.call('list_alerts', user_id)]
+
+
+class RemotePaperBook:
+    """PaperBook of a worker, the parent's accounts valued by the parent."""
+
+    def __init__(self, cg):
+        self.cg = cg
+
+    def close(self):
+        pass
+
+    async def buy(self, account, coin_id, usd):
+        return tuple(await self.cg.call('paper_buy', account, coin_id, usd))
+
+    async def sell(self, account, coin_id, amount):
+        return tuple(await self.cg.call('paper_sell', account, coin_id, amount))
+
+    async def portfolio(self, account):
+        cash, positions, starting_cash = await self.cg.call('portfolio', account)
+        return cash, [paper_trader_cog.Position(*fields) for fields in positions], starting_cash
+
+    async def leaderboard(self, guild_id):
+        return [tuple(entry) for entry in await self.cg.call('leaderboard', guild_id)]
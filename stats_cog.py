@@ -0,0 +1,105 @@
+import asyncio
+import coingecko_cog
+import discord
+import logging
+import math
+import metrics
+import time
+
+from discord.ext import commands
+from discord.commands import slash_command
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+
+def format_seconds(value):
+    if math.isinf(value):
+        return 'inf'
+    return f'{value * 1000:.0f}ms' if value < 1 else f'{value:.1f}s'
+
+
+class StatsCog(commands.Cog):
+    """Records command latencies and event loop lag and reports them through /stats."""
+
+    def __init__(self, client, cg, metrics_config=None):
+        self.client = client
+        self.cg = cg
+        metrics_config = metrics_config or {}
+        # Serve Prometheus metrics on this port if set.
+        self.port = metrics_config.get('port')
+        self.host = metrics_config.get('host', '127.0.0.1')
+        self.lag_task = None
+        self.runner = None
+        METRICS.add_collector(self.collect)
+
+    def collect(self):
+        gauges = {(f'coingecko_cache_{key}', ()): value for key, value in self.cg.cache_stats().items()}
+        gauges[('coingecko_queued_requests', ())] = self.cg.queued_requests()
+        for key, value in coingecko_cog.DESCRIPTIONS.stats().items():
+            gauges[(f'description_cache_{key}', ())] = value
+        cog = self.client.get_cog('CoinGeckoCog')
+        if cog is not None:
+            for key, value in cog.hot_prices.stats().items():
+                gauges[(f'hot_price_cache_{key}', ())] = value
+        if math.isfinite(self.client.latency):
+            gauges[('discord_gateway_latency_seconds', ())] = self.client.latency
+        return gauges
+
+    def cog_unload(self):
+        METRICS.collectors.remove(self.collect)
+        if self.lag_task:
+            self.lag_task.cancel()
+        if self.runner:
+            asyncio.ensure_future(self.runner.cleanup())
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        if self.lag_task is None:
+            self.lag_task = asyncio.ensure_future(metrics.sample_loop_lag())
+        if self.port and self.runner is None:
+            self.runner = await metrics.start_server(self.host, self.port)
+
+    @commands.Cog.listener()
+    async def on_application_command(self, ctx):
+        ctx.metrics_start = time.perf_counter()
+
+    @commands.Cog.listener()
+    async def on_application_command_completion(self, ctx):
+        self.__record(ctx, 'ok')
+
+    @commands.Cog.listener()
+    async def on_application_command_error(self, ctx, error):
+        self.__record(ctx, 'error')
+
+    def __record(self, ctx, outcome):
+        name = ctx.command.qualified_name if ctx.command else 'unknown'
+        METRICS.inc('commands', command=name, outcome=outcome)
+        start = getattr(ctx, 'metrics_start', None)
+        if start is not None:
+            METRICS.observe('command_seconds', time.perf_counter() - start, command=name)
+
+    @slash_command()
+    @commands.is_owner()
+    async def stats(self, ctx):
+        """Shows bot performance statistics. Owner only."""
+        lines = []
+        current = None
+        for (name, labels), histogram in sorted(METRICS.histograms.items()):
+            if name != current:
+                current = name
+                lines.append(f'{name}')
+            label = ' '.join(str(value) for _, value in labels) or '-'
+            lines.append(f'  {label[:32]:<32} n={histogram.count:<6} '
+                         f'p50={format_seconds(histogram.quantile(0.5)):<6} '
+                         f'p99={format_seconds(histogram.quantile(0.99))}')
+
+        lines.append('gauges')
+        for (name, _), value in sorted(METRICS.gauges().items()):
+            lines.append(f'  {name:<32} {value:g}')
+
+        text = '\n'.join(lines)
+        if len(text) > coingecko_cog.MAX_DESCRIPTION - 8:
+            text = text[:coingecko_cog.MAX_DESCRIPTION - 12] + '\n...'
+        embed = discord.Embed(title='Bot stats', description=f'```\n{text}\n```')
+        await ctx.respond(embed=embed, ephemeral=True)
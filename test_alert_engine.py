@@ -0,0 +1,121 @@
+import alert_cog
+import alert_engine
+import asyncio
+import discord
+import logging
+import pytest
+
+ABOVE = alert_engine.ABOVE
+BELOW = alert_engine.BELOW
+
+
+def test_alerts_fire_once_when_crossed(tmp_path):
+    async def main():
+        path = str(tmp_path / 'alerts.json')
+        engine = alert_engine.AlertEngine(path)
+        low = await engine.add(1, 10, 'bitcoin', ABOVE, 100)
+        high = await engine.add(1, 10, 'bitcoin', ABOVE, 200)
+        floor = await engine.add(2, 20, 'bitcoin', BELOW, 50)
+        other = await engine.add(2, 20, 'ethereum', BELOW, 10)
+
+        assert await engine.evaluate({'bitcoin': 99}) == []
+        assert await engine.evaluate({'bitcoin': 150, 'ethereum': None}) == [(low, 150)]
+        assert await engine.evaluate({'bitcoin': 150}) == []
+        assert await engine.evaluate({'bitcoin': 50}) == [(floor, 50)]
+        assert sorted(engine.watched_ids()) == ['bitcoin', 'ethereum']
+
+        # What is left survives a restart.
+        engine = alert_engine.AlertEngine(path)
+        assert await engine.for_user(1) == [high]
+        assert await engine.for_user(2) == [other]
+        assert await engine.evaluate({'bitcoin': 1000, 'ethereum': 1}) == [(high, 1000), (other, 1)]
+        assert engine.watched_ids() == []
+        assert (await engine.add(1, 10, 'bitcoin', ABOVE, 1)).id == other.id + 1
+
+    asyncio.run(main())
+
+
+def test_users_are_limited_and_only_remove_their_own():
+    async def main():
+        engine = alert_engine.AlertEngine(max_per_user=2)
+        first = await engine.add(1, 10, 'bitcoin', ABOVE, 100)
+        await engine.add(1, 10, 'bitcoin', BELOW, 50)
+        with pytest.raises(alert_engine.AlertLimitReached):
+            await engine.add(1, 10, 'ethereum', ABOVE, 1)
+
+        assert not await engine.remove(2, first.id)
+        assert await engine.remove(1, first.id)
+        assert not await engine.remove(1, first.id)
+        assert await engine.evaluate({'bitcoin': 1000}) == []
+        await engine.add(1, 10, 'ethereum', ABOVE, 1)
+
+    asyncio.run(main())
+
+
+def test_checking_prices_every_watched_coin_in_one_request(fake_api):
+    async def main():
+        async with fake_api() as (fake, cg):
+            ids = [coin['id'] for coin in fake.coins[:5]]
+            prices = await cg.prices(ids)
+            cg.cache.clear()
+            engine = alert_engine.AlertEngine()
+            crossed = [await engine.add(1, 10, id, ABOVE, prices[id] / 2) for id in ids[:3]]
+            for id in ids[3:]:
+                await engine.add(1, 10, id, BELOW, prices[id] / 2)
+
+            fired = await alert_cog.check_prices(cg, engine)
+            assert fake.requests['/api/v3/simple/price'] == 2
+            assert sorted(alert for alert, _ in fired) == crossed
+            assert len(await engine.for_user(1)) == 2
+
+    asyncio.run(main())
+
+
+class StubChannel:
+    def __init__(self, id):
+        self.id = id
+        self.sent = []
+
+    async def send(self, message, allowed_mentions=None):
+        self.sent.append(message)
+
+
+class StubClient:
+    """A shard worker's client, caching the channels of its servers."""
+
+    def __init__(self, shard_ids, channels, fetchable=()):
+        self.shard_ids = shard_ids
+        self.shard_count = 2
+        self.channels = {id: StubChannel(id) for id in channels}
+        self.fetchable = {id: StubChannel(id) for id in fetchable}
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    async def fetch_channel(self, channel_id):
+        if channel_id not in self.fetchable:
+            raise discord.NotFound(type('Response', (), {'status': 404, 'reason': 'Not Found'})(), 'Unknown Channel')
+        return self.fetchable[channel_id]
+
+
+def test_each_alert_is_sent_by_the_worker_owning_it(caplog):
+    async def main():
+        # Servers on shards 0 and 1, a direct message and a deleted channel on shard 1.
+        on_first = alert_engine.Alert(1, 1, 10, 'bitcoin', ABOVE, 1.0, 2 << 22)
+        on_second = alert_engine.Alert(2, 1, 20, 'bitcoin', ABOVE, 1.0, 1 << 22)
+        direct = alert_engine.Alert(3, 1, 30, 'bitcoin', ABOVE, 1.0)
+        deleted = alert_engine.Alert(4, 1, 40, 'bitcoin', ABOVE, 1.0, 3 << 22)
+        fired = [(alert, 2.0) for alert in (on_first, on_second, direct, deleted)]
+
+        first = StubClient([0], channels=[10], fetchable=[30])
+        second = StubClient([1], channels=[20])
+        for client in (first, second):
+            cog = alert_cog.AlertCog(client, None, alert_engine.AlertEngine(), check=False)
+            with caplog.at_level(logging.WARNING):
+                await cog.notify_own(fired)
+
+        assert [len(client.channels[id].sent) for client, id in ((first, 10), (second, 20))] == [1, 1]
+        assert first.fetchable[30].sent[0].startswith('<@1> bitcoin is above')
+        assert 'Dropping 1 alerts for unavailable channel 40' in caplog.text
+
+    asyncio.run(main())
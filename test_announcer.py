@@ -0,0 +1,111 @@
+import announcer
+import asyncio
+import discord
+import json
+
+
+class StubCoinGecko:
+    async def coin_by_id(self, id, priority=None):
+        return {'id': id, 'name': id.title()}
+
+
+class StubChannel:
+    def __init__(self, fail=lambda embeds: False):
+        self.fail = fail
+        self.sent = []
+
+    async def send(self, embeds):
+        if self.fail(embeds):
+            raise discord.HTTPException(type('Response', (), {'status': 400, 'reason': 'Bad Request'})(), 'rejected')
+        self.sent.append([embed.title for embed in embeds])
+
+
+class StubClient:
+    def __init__(self, channel):
+        self.channel = channel
+
+    def get_channel(self, channel_id):
+        return self.channel
+
+
+def build_message(length):
+    def build(infos):
+        return {'embeds': [discord.Embed(title=info['id'], description='x' * length) for info in infos]}
+    return build
+
+
+def make_announcer(channel, length=10, state_path=None):
+    return announcer.NewCoinAnnouncer(
+        StubClient(channel), StubCoinGecko(), 1, build_message(length), state_path=state_path,
+        fetch_concurrency=1, sends_per_period=1000)
+
+
+async def settle(coin_announcer, ids):
+    for _ in range(100):
+        if all(id in coin_announcer.announced for id in ids):
+            return
+        await asyncio.sleep(0.01)
+
+
+def test_ready_coins_are_batched_within_discords_limits():
+    async def main():
+        channel = StubChannel()
+        coin_announcer = make_announcer(channel)
+        ids = [f'coin{i:02}' for i in range(25)]
+        coin_announcer.enqueue(ids)
+        await settle(coin_announcer, ids)
+        assert [len(titles) for titles in channel.sent] == [10, 10, 5]
+        assert sum(channel.sent, []) == ids
+
+        # Embeds of 2500 characters, two fit in a message.
+        channel.sent.clear()
+        coin_announcer.build_message = build_message(2500)
+        ids = [f'big{i}' for i in range(5)]
+        coin_announcer.enqueue(ids)
+        await settle(coin_announcer, ids)
+        assert [len(titles) for titles in channel.sent] == [2, 2, 1]
+        coin_announcer.stop()
+
+    asyncio.run(main())
+
+
+def test_coins_of_a_failed_message_are_retried_on_their_own(monkeypatch):
+    monkeypatch.setattr(announcer, 'RETRY_DELAY', 0)
+
+    async def main():
+        # Discord rejects any message with bad in it.
+        channel = StubChannel(lambda embeds: any(embed.title == 'bad' for embed in embeds))
+        coin_announcer = make_announcer(channel)
+        ids = ['first', 'a', 'bad', 'b']
+        coin_announcer.enqueue(ids)
+        await settle(coin_announcer, ids)
+        assert sorted(channel.sent) == [['a'], ['b'], ['first']]
+        # Given up after failing on its own.
+        assert 'bad' in coin_announcer.announced and not coin_announcer.failed_sends
+        coin_announcer.stop()
+
+    asyncio.run(main())
+
+
+def test_pending_and_announced_coins_survive_a_restart(tmp_path):
+    async def main():
+        path = str(tmp_path / 'announced.json')
+        coin_announcer = make_announcer(None, state_path=path)
+        coin_announcer.enqueue(['a', 'b'])
+        coin_announcer.stop()
+        with open(path) as f:
+            assert json.load(f) == {'announced': [], 'pending': ['a', 'b']}
+
+        channel = StubChannel()
+        restarted = make_announcer(channel, state_path=path)
+        restarted.start()
+        await settle(restarted, ['a', 'b'])
+        assert sum(channel.sent, []) == ['a', 'b']
+        restarted.stop()
+
+        again = make_announcer(channel, state_path=path)
+        again.enqueue(['a', 'c'])
+        assert list(again.pending) == ['c']
+        again.stop()
+
+    asyncio.run(main())
@@ -0,0 +1,83 @@
+import asyncio
+import chart_renderer
+import concurrent.futures
+import numpy as np
+import os
+import pytest
+import sys
+import time
+import types
+
+
+def slow(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+def crash():
+    os._exit(1)
+
+
+def loaded(names):
+    return [name for name in names if name in sys.modules]
+
+
+def test_render_price_history_returns_png():
+    times = np.arange(0, 1000 * 60 * 60 * 1000, 60 * 60 * 1000, dtype=np.float64)
+    prices = np.linspace(1, 2, len(times))
+    for style in ('line', 'candles'):
+        assert chart_renderer.render_price_history(times, prices, 'test', style).startswith(b'\x89PNG')
+
+
+def test_timed_out_render_keeps_its_slot_until_done():
+    async def main():
+        renderer = chart_renderer.ChartRenderer(workers=1, max_pending=1, timeout=0.2)
+        try:
+            with pytest.raises(asyncio.TimeoutError):
+                await renderer.render(slow, 1.5)
+            # The worker is still drawing, so there is no room for another chart.
+            assert renderer.pending == 1
+            with pytest.raises(chart_renderer.RendererBusy):
+                await renderer.render(slow, 0)
+            for _ in range(100):
+                if not renderer.pending:
+                    break
+                await asyncio.sleep(0.05)
+            assert renderer.pending == 0
+            assert await renderer.render(slow, 0) == 0
+        finally:
+            renderer.close()
+
+    asyncio.run(main())
+
+
+def test_crashed_worker_restarts_the_pool():
+    async def main():
+        renderer = chart_renderer.ChartRenderer(workers=1, timeout=30)
+        try:
+            with pytest.raises(concurrent.futures.process.BrokenProcessPool):
+                await renderer.render(crash)
+            assert renderer.executor is None
+            await asyncio.sleep(0)
+            assert renderer.pending == 0
+            assert await renderer.render(slow, 0) == 0
+        finally:
+            renderer.close()
+
+    asyncio.run(main())
+
+
+def test_workers_dont_import_the_bot(monkeypatch):
+    # As when started with python cryptobot.py.
+    main = types.ModuleType('__main__')
+    main.__file__ = os.path.abspath('cryptobot.py')
+    monkeypatch.setitem(sys.modules, '__main__', main)
+
+    async def main():
+        renderer = chart_renderer.ChartRenderer(workers=1)
+        try:
+            assert await renderer.render(loaded, ['discord', 'yaml', 'matplotlib']) == ['matplotlib']
+        finally:
+            renderer.close()
+
+    asyncio.run(main())
@@ -0,0 +1,224 @@
+import asyncio
+import chart_renderer
+import coingecko_cog
+import collections
+import cryptobot
+import discord
+import guild_settings
+import pytest
+
+from discord.ext import commands
+
+CHART = '/api/v3/coins/{id}/market_chart/range'
+
+
+class StubClient:
+    """Never becomes ready, so the cog's background loops stay idle."""
+
+    async def wait_until_ready(self):
+        await asyncio.Event().wait()
+
+
+class StubContext:
+    guild_id = None
+
+    def __init__(self):
+        self.responses = []
+
+    async def defer(self):
+        pass
+
+    async def respond(self, content=None, ephemeral=False, **kwargs):
+        self.responses.append((content, ephemeral))
+
+
+class StubRenderer:
+    """Records what would be drawn instead of starting worker processes."""
+
+    def __init__(self):
+        self.calls = []
+
+    def start(self):
+        pass
+
+    def close(self):
+        pass
+
+    async def render(self, func, *args):
+        self.calls.append((func, args))
+        return b'png'
+
+
+def history(cog, ctx, id, style='line'):
+    return cog.price_history.callback(cog, ctx, id, False, '30 days ago', None, style)
+
+
+def test_history_compares_each_coin_once(fake_api):
+    async def main():
+        async with fake_api() as (fake, cg):
+            await cg.new_coins()
+            symbols = collections.Counter(coin['symbol'] for coin in fake.coins)
+            first, second = [coin for coin in fake.coins if symbols[coin['symbol']] == 1][:2]
+            renderer = StubRenderer()
+            cog = coingecko_cog.CoinGeckoCog(StubClient(), cg, renderer=renderer)
+            try:
+                # The symbol and the id of one coin draw one line.
+                await history(cog, StubContext(), f"{first['symbol']} {first['id']}")
+                assert fake.requests[CHART] == 1
+                func, args = renderer.calls[-1]
+                assert func is chart_renderer.render_price_history
+
+                await history(cog, StubContext(), f"{first['id']} {second['symbol']} {second['id']}")
+                func, (series, labels) = renderer.calls[-1]
+                assert func is chart_renderer.render_comparison
+                assert labels == [first['id'], second['id']]
+                assert len(series) == 2
+            finally:
+                cog.cog_unload()
+
+    asyncio.run(main())
+
+
+def test_history_rejects_candles_for_several_coins(fake_api):
+    async def main():
+        async with fake_api() as (fake, cg):
+            await cg.new_coins()
+            renderer = StubRenderer()
+            cog = coingecko_cog.CoinGeckoCog(StubClient(), cg, renderer=renderer)
+            try:
+                ctx = StubContext()
+                await history(cog, ctx, f"{fake.coins[0]['id']} {fake.coins[1]['id']}", style='candles')
+                assert ctx.responses == [('Candles can only be drawn for one coin, compare coins as lines.', True)]
+                assert not renderer.calls and CHART not in fake.requests
+            finally:
+                cog.cog_unload()
+
+    asyncio.run(main())
+
+
+def test_descriptions_are_converted_once_and_cut_to_the_limit():
+    renderer = coingecko_cog.DescriptionRenderer(limit=100)
+    assert renderer.render('a', '<p>Hello <a href="https://a.example">world</a></p>') == 'Hello world'
+    assert renderer.render('a', '<p>Hello <a href="https://a.example">world</a></p>') == 'Hello world'
+    assert renderer.stats() == {'hits': 1, 'misses': 1, 'size': 1}
+
+    long = renderer.render('b', '<p>' + 'word ' * 1000 + '</p>')
+    assert len(long) <= 100 and long.endswith('...')
+    # An edited description is converted again.
+    renderer.render('a', '<p>Hello</p>')
+    assert renderer.stats() == {'hits': 1, 'misses': 3, 'size': 3}
+
+
+def test_info_message_shares_the_character_budget():
+    def info(id, words):
+        return {'id': id, 'name': id.title(), 'symbol': id, 'description': {'en': f'<p>{"word " * words}</p>'}}
+
+    single, = coingecko_cog.info_message([info('first', 1000)])['embeds']
+    assert len(single.description) <= coingecko_cog.MAX_DESCRIPTION and single.description.endswith('...')
+
+    embeds = coingecko_cog.info_message([info('first', 1000), info('second', 10), info('third', 1000)],
+                                        warning='Picked one')['embeds']
+    assert sum(len(embed) for embed in embeds) <= coingecko_cog.announcer.MAX_MESSAGE_LENGTH
+    # The short one keeps its whole description, the long ones split the rest.
+    assert embeds[1].description == ('word ' * 10).strip()
+    assert abs(len(embeds[0].description) - len(embeds[2].description)) <= 1
+    assert len(embeds[0].description) > 2500
+
+    # The budget only shortens the message's copy, the next /info gets the whole description.
+    again, = coingecko_cog.info_message([info('first', 1000)])['embeds']
+    assert again.description == single.description
+
+
+def test_multi_coin_choices_fit_discords_limit(fake_api):
+    async def main():
+        async with fake_api() as (fake, cg):
+            await cg.new_coins()
+            cog = coingecko_cog.CoinGeckoCog(StubClient(), cg, renderer=StubRenderer())
+            try:
+                coin = fake.coins[0]
+                ctx = type('Context', (), {'value': f"btc eth {coin['id']}"})()
+                choices = await cog.multi_symbol_id_searcher(ctx)
+                assert f"btc eth {coin['id']}" in choices
+
+                ctx.value = 'x' * (coingecko_cog.MAX_CHOICE_LENGTH - len(coin['id'])) + f" {coin['id']}"
+                assert await cog.multi_symbol_id_searcher(ctx) == []
+                ctx.value = 'x' * (coingecko_cog.MAX_CHOICE_LENGTH - len(coin['id']) - 1) + f" {coin['id']}"
+                assert all(len(choice) <= coingecko_cog.MAX_CHOICE_LENGTH for choice in await cog.multi_symbol_id_searcher(ctx))
+                assert ctx.value in await cog.multi_symbol_id_searcher(ctx)
+            finally:
+                cog.cog_unload()
+
+    asyncio.run(main())
+
+
+def test_sentiment_bars_are_drawn_once_per_percentage():
+    bar = coingecko_cog.SentimentBar()
+    first = bar.png(0.5)
+    assert first.startswith(b'\x89PNG')
+    # Rounded to the same whole percentage, the same bytes come back.
+    assert bar.png(0.501) is first
+    assert bar.png(0.51) != first
+    assert sorted(bar.images) == [50, 51]
+
+    bar.warm_up()
+    assert len(bar.images) == 101
+    assert bar.png(2.0) is bar.images[100] and bar.png(-1.0) is bar.images[0]
+
+
+def test_info_embeds_attach_the_cached_sentiment_bar():
+    info = {'id': 'coin', 'name': 'Coin', 'symbol': 'c', 'sentiment_votes_up_percentage': 75.0}
+    embed, fp = coingecko_cog.format_crypto_info(info)
+    assert embed.image.url == f'attachment://{fp.filename}'
+    assert fp.fp.read() == coingecko_cog.SENTIMENT_BAR.png(0.75)
+
+    _, second = coingecko_cog.format_crypto_info(info)
+    # The image is shared, every message still gets its own attachment name.
+    assert second.filename != fp.filename
+
+
+class StubChannel:
+    type = discord.ChannelType.text
+
+    def __init__(self, permissions):
+        self.permissions = permissions
+
+    def permissions_for(self, member):
+        return self.permissions
+
+
+def test_currency_is_set_by_server_managers(fake_api, tmp_path):
+    async def main():
+        async with fake_api() as (fake, cg):
+            path = str(tmp_path / 'settings.json')
+            cog = coingecko_cog.CoinGeckoCog(StubClient(), cg, renderer=StubRenderer(),
+                                             settings=guild_settings.GuildSettings(path))
+            try:
+                ctx = StubContext()
+                ctx.guild_id = 123
+                ctx.guild = object()
+                ctx.author = None
+                ctx.channel = StubChannel(discord.Permissions.none())
+                with pytest.raises(commands.MissingPermissions) as e:
+                    for check in cog.set_currency.checks:
+                        await discord.utils.maybe_coroutine(check, ctx)
+                await cryptobot.CryptoBot.on_application_command_error(None, ctx, e.value)
+                assert ctx.responses == [('You do not have permission to execute this command', True)]
+
+                ctx.responses.clear()
+                ctx.channel = StubChannel(discord.Permissions(manage_guild=True))
+                for check in cog.set_currency.checks:
+                    assert await discord.utils.maybe_coroutine(check, ctx)
+                await cog.set_currency.callback(cog, ctx, 'XYZ')
+                await cog.set_currency.callback(cog, ctx, 'EUR')
+                assert ctx.responses == [("Unfortunately XYZ isn't a currency I can convert to.", True),
+                                         ('Prices on this server are now shown in EUR (Euro)', False)]
+
+                # Saved for the next start.
+                settings = guild_settings.GuildSettings(path)
+                assert settings.currency(123) == 'eur'
+                assert settings.currency(456) == settings.currency(None) == 'usd'
+                assert await cog.currency_for(ctx) == ('eur', pytest.approx(0.92))
+            finally:
+                cog.cog_unload()
+
+    asyncio.run(main())
@@ -0,0 +1,163 @@
+import asyncio
+import coingecko_helper
+import json
+import pytest
+
+
+def make_api(coins, ranks):
+    cg = coingecko_helper.CoinGeckoAPI()
+
+    async def coins_list(priority=None):
+        return coins
+    cg.coins_list = coins_list
+    asyncio.run(cg.new_coins())
+    cg.update_ranks(ranks)
+    return cg
+
+
+def test_search_orders_prefix_matches_by_rank():
+    cg = make_api([
+        {'id': 'bitcoin', 'symbol': 'btc', 'name': 'Bitcoin'},
+        {'id': 'bitcoin-cash', 'symbol': 'bch', 'name': 'Bitcoin Cash'},
+        {'id': 'binancecoin', 'symbol': 'bnb', 'name': 'BNB'},
+    ], {'bitcoin': 1, 'binancecoin': 4, 'bitcoin-cash': 20})
+
+    assert cg.search('b') == ['BTC', 'bitcoin', 'BNB', 'binancecoin', 'BCH', 'bitcoin-cash']
+    assert cg.search('bitcoin') == ['bitcoin', 'bitcoin-cash', 'BTC']
+
+
+def test_search_puts_fuzzy_matches_after_prefix_matches():
+    cg = make_api([
+        {'id': 'solar', 'symbol': 'sxp', 'name': 'Solar'},
+        {'id': 'solaris', 'symbol': 'xlr', 'name': 'Solaris'},
+        {'id': 'soxy-token', 'symbol': 'solxy', 'name': 'Solxy'},
+    ], {'solaris': 3, 'solar': 100, 'soxy-token': 500})
+
+    # SOLXY starts with the query, no id does so the ids are close matches.
+    assert cg.search_ids('solx') == ['solaris', 'solar']
+    assert cg.search('solx') == ['SOLXY', 'solaris', 'solar']
+
+
+def test_concurrent_requests_share_one_fetch(fake_api):
+    async def main():
+        async with fake_api() as (fake, cg):
+            id = fake.coins[0]['id']
+            results = await asyncio.gather(*(cg.prices([id]) for _ in range(20)))
+            assert fake.requests['/api/v3/simple/price'] == 1
+            assert all(result == results[0] for result in results) and results[0][id] > 0
+            assert cg.cache_stats()['coalesced'] == 19
+
+            # Fresh for its TTL, then fetched again.
+            await cg.prices([id])
+            assert fake.requests['/api/v3/simple/price'] == 1
+            cg.cache.clear()
+            await cg.prices([id])
+            assert fake.requests['/api/v3/simple/price'] == 2
+
+    asyncio.run(main())
+
+
+def test_endpoints_without_a_ttl_are_only_coalesced(fake_api):
+    async def main():
+        async with fake_api() as (fake, cg):
+            cg.cache_ttls['simple/price'] = 0
+            id = fake.coins[0]['id']
+            await asyncio.gather(cg.prices([id]), cg.prices([id]))
+            await cg.prices([id])
+            assert fake.requests['/api/v3/simple/price'] == 2
+            assert cg.cache_stats()['size'] == 0
+
+    asyncio.run(main())
+
+
+def test_limiter_serves_interactive_requests_first():
+    async def main():
+        bucket = coingecko_helper.TokenBucket(rate=50, capacity=1)
+        await bucket.acquire()
+        served = []
+
+        async def acquire(name, priority):
+            await bucket.acquire(priority)
+            served.append(name)
+
+        tasks = [asyncio.ensure_future(acquire(f'background{i}', coingecko_helper.PRIORITY_BACKGROUND)) for i in range(3)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.ensure_future(acquire('interactive', coingecko_helper.PRIORITY_INTERACTIVE)))
+        await asyncio.sleep(0)
+        assert bucket.queued() == 4
+        await asyncio.gather(*tasks)
+        assert served == ['interactive', 'background0', 'background1', 'background2']
+
+    asyncio.run(main())
+
+
+def test_throttled_requests_are_retried(fake_api):
+    async def main():
+        async with fake_api(error_rate=0.5, retry_after=0) as (fake, cg):
+            # Enough that giving up isn't a matter of luck.
+            cg.max_retries = 30
+            ids = [coin['id'] for coin in fake.coins[:20]]
+            prices = await asyncio.gather(*(cg.prices([id]) for id in ids))
+            assert fake.throttled > 0
+            assert [list(p) for p in prices] == [[id] for id in ids]
+            assert fake.requests['/api/v3/simple/price'] == len(ids) + fake.throttled
+
+    asyncio.run(main())
+
+
+def test_new_coins_applies_only_the_difference(fake_api):
+    async def main():
+        async with fake_api() as (fake, cg):
+            assert await cg.new_coins() == set()
+            before = {coin['id'] for coin in fake.coins}
+            assert set(cg.coins) == before
+
+            fake.churn(added=10, removed=3)
+            after = {coin['id'] for coin in fake.coins}
+            cg.cache.clear()
+            assert await cg.new_coins() == after - before
+            assert set(cg.coins) == after
+            for id in before - after:
+                assert id not in cg.search_ids(id)
+                assert not any(id in ids for ids in cg.symbol_map.values())
+            for id in after - before:
+                coin = fake.by_id[id]
+                assert id in cg.search_ids(id)
+                assert id in cg.symbol_map[coin['symbol'].upper()]
+
+            # The same list again changes nothing.
+            cg.cache.clear()
+            assert await cg.new_coins() == set()
+
+    asyncio.run(main())
+
+
+def test_orjson_decodes_like_the_standard_library(fake_api, monkeypatch, tmp_path):
+    pytest.importorskip('orjson')
+    coins = [{'id': 'bitcoin', 'symbol': 'btc', 'name': 'Bitcoin', 'platforms': {}},
+             {'id': 'café-token', 'symbol': 'é', 'name': 'Café \U0001f680 "quoted" \\ \n',
+              'platforms': {'ethereum': '0x' + 'f' * 40, 'supply': 21e6, 'price': 1.0000000000000002,
+                            'big': 2 ** 62, 'tiny': 5e-324, 'ok': True, 'none': None}}]
+    (tmp_path / 'coins_list.json').write_text(json.dumps(coins))
+
+    async def fetch():
+        async with fake_api(fixtures_dir=str(tmp_path)) as (fake, cg):
+            return await cg.coins_list()
+
+    assert coingecko_helper.json_loads is coingecko_helper.orjson.loads
+    decoded = asyncio.run(fetch())
+    monkeypatch.setattr(coingecko_helper, 'json_loads', json.loads)
+    assert decoded == asyncio.run(fetch()) == coins
+
+
+def test_closed_connection_pool_is_reopened(fake_api):
+    async def main():
+        async with fake_api() as (fake, cg):
+            session = await cg.start()
+            assert await cg.start() is session
+            await cg.close()
+            assert cg.session is None
+            assert await cg.ping() is not None
+            assert cg.session is not None and cg.session is not session and not cg.session.closed
+
+    asyncio.run(main())
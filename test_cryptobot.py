@@ -0,0 +1,28 @@
+import coingecko_cog
+import cryptobot
+import os
+import subprocess
+import sys
+
+
+def test_heavy_modules_are_not_imported_at_startup():
+    deferred = coingecko_cog.DEFERRED_IMPORTS + ['numpy', 'matplotlib']
+    loaded = subprocess.run(
+        [sys.executable, '-c', f'import cryptobot, sys; print([m for m in {deferred!r} if m in sys.modules])'],
+        capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    assert loaded.strip() == '[]'
+
+
+def test_preloading_times_every_module():
+    times = coingecko_cog.preload_modules(['json', 'price_series'])
+    assert list(times) == ['json', 'price_series']
+    assert all(seconds >= 0 for seconds in times.values())
+    assert 'price_series' in sys.modules
+
+
+def test_import_report_lists_the_deferred_modules(capsys):
+    cryptobot.import_report()
+    out = capsys.readouterr().out
+    assert out.startswith('Startup imports took ')
+    for name in coingecko_cog.DEFERRED_IMPORTS:
+        assert f'deferred {name} ' in out
@@ -0,0 +1,96 @@
+import asyncio
+import cryptobot
+import discord
+import error_reporter
+
+from discord.ext import commands
+
+
+class StubChannel:
+    id = 1
+
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, content=None, embeds=None):
+        self.sent.append((content, embeds))
+
+
+class StubClient:
+    def __init__(self):
+        self.channel = StubChannel()
+
+    async def wait_until_ready(self):
+        await asyncio.Event().wait()
+
+    def get_channel(self, channel_id):
+        return self.channel
+
+
+class StubContext:
+    command = None
+    guild_id = 1
+
+    def __init__(self):
+        self.responses = []
+
+    async def respond(self, content, ephemeral=False):
+        self.responses.append((content, ephemeral))
+
+
+def fail(message):
+    try:
+        raise ValueError(message)
+    except ValueError as e:
+        return e
+
+
+def fail_elsewhere():
+    try:
+        raise ValueError('elsewhere')
+    except ValueError as e:
+        return e
+
+
+def test_same_error_is_merged_into_one_digest():
+    async def main():
+        client = StubClient()
+        reporter = error_reporter.ErrorReporter(client, channel_id=1)
+        reporter.report('Command Error', fail('a'))
+        reporter.report('Command Error', fail('b'))
+        reporter.report('Command Error', fail_elsewhere())
+        assert sorted(report.count for report in reporter.pending.values()) == [1, 2]
+
+        await reporter.do_send_digest()
+        (content, embeds), = client.channel.sent
+        assert content is None
+        assert len(embeds) == 2 and 'ValueError: a' in embeds[0].description
+
+        # Seen within the window, only counted in the next digest.
+        reporter.report('Command Error', fail('c'))
+        assert not reporter.pending
+        await reporter.do_send_digest()
+        assert client.channel.sent[1] == ('1 repeats of errors reported in the last 300s.', [])
+
+        await reporter.do_send_digest()
+        assert len(client.channel.sent) == 2
+        reporter.cog_unload()
+
+    asyncio.run(main())
+
+
+def test_check_failures_are_answered_not_reported(monkeypatch):
+    async def main():
+        reporter = error_reporter.ErrorReporter(StubClient(), channel_id=1)
+        monkeypatch.setattr(cryptobot, 'reporter', reporter)
+        for error in (commands.NotOwner(), discord.CheckFailure()):
+            ctx = StubContext()
+            await cryptobot.CryptoBot.on_application_command_error(None, ctx, error)
+            assert ctx.responses == [('You can\'t use this command', True)]
+
+        # Outside an except block there is no exception to report.
+        await cryptobot.CryptoBot.on_error(None, 'on_message')
+        assert not reporter.pending
+        reporter.cog_unload()
+
+    asyncio.run(main())
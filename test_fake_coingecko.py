@@ -0,0 +1,76 @@
+import aiohttp
+import asyncio
+import json
+import pytest
+
+from benchmarks import fake_coingecko
+
+
+def test_synthetic_coins_are_reproducible():
+    coins = fake_coingecko.synthetic_coins_list(500, seed=1)
+    assert coins == fake_coingecko.synthetic_coins_list(500, seed=1)
+    assert len({coin['id'] for coin in coins}) == 500
+    # Some symbols are shared, like on CoinGecko.
+    assert len({coin['symbol'] for coin in coins}) < 500
+    assert fake_coingecko.price_at('bitcoin', 1000) == fake_coingecko.price_at('bitcoin', 1000) > 0
+
+
+def test_churn_adds_and_removes_coins():
+    fake = fake_coingecko.FakeCoinGecko(count=100)
+    before = fake.coins
+    ids = {coin['id'] for coin in before}
+    fake.churn(added=10, removed=2)
+    # A new list, so the client's cache sees a new response.
+    assert fake.coins is not before
+    assert len(fake.coins) == 108
+    assert len(ids - fake.by_id.keys()) == 2
+    assert [coin['id'] for coin in fake.coins] == list(fake.by_id)
+
+
+def test_requests_are_counted_and_throttled(fake_api):
+    async def main():
+        async with fake_api(count=50, error_rate=0.5, retry_after=0) as (fake, cg):
+            cg.max_retries = 30
+            coins = await cg.coins_list()
+            assert [coin['id'] for coin in coins] == [coin['id'] for coin in fake.coins]
+            rows = await cg.coins_markets(per_page=10, page=1)
+            assert [row['market_cap_rank'] for row in rows] == sorted(row['market_cap_rank'] for row in rows)
+
+            # Every 429 was retried until the request went through.
+            served = fake.requests['/api/v3/coins/list'] + fake.requests['/api/v3/coins/markets']
+            assert served == 2 + fake.throttled
+
+    asyncio.run(main())
+
+
+def test_markets_are_paged_in_rank_order(fake_api):
+    async def main():
+        async with fake_api(count=50) as (fake, cg):
+            first = await cg.coins_markets(per_page=20, page=1)
+            second = await cg.coins_markets(per_page=20, page=2)
+            last = await cg.coins_markets(per_page=20, page=3)
+            assert len(first) == len(second) == 20 and len(last) == 10
+            ranked = sorted(fake.coins, key=lambda coin: fake.rank(coin['id']))
+            assert [row['id'] for row in first + second + last] == [coin['id'] for coin in ranked]
+
+            ids = [fake.coins[3]['id'], 'missing', fake.coins[1]['id']]
+            assert [row['id'] for row in await cg.coins_markets(ids=','.join(ids))] == [ids[0], ids[2]]
+
+            rates = (await cg.exchange_rates())['rates']
+            assert rates['btc']['value'] == 1.0
+            assert rates['eur']['value'] == pytest.approx(rates['usd']['value'] * 0.92)
+            with pytest.raises(aiohttp.ClientResponseError) as e:
+                await cg.coin_by_id('missing')
+            assert e.value.status == 404
+            assert fake.requests['/api/v3/coins/markets'] == 4
+
+    asyncio.run(main())
+
+
+def test_recorded_fixtures_replace_synthetic_data(tmp_path):
+    coins = [{'id': 'bitcoin', 'symbol': 'btc', 'name': 'Bitcoin'}]
+    (tmp_path / 'coins_list.json').write_text(json.dumps(coins))
+    (tmp_path / 'coin.json').write_text(json.dumps({'description': {'en': 'Recorded'}}))
+    fake = fake_coingecko.FakeCoinGecko(count=100, fixtures_dir=str(tmp_path))
+    assert fake.coins == coins and fake.markets is None
+    assert fake.coin_template == {'description': {'en': 'Recorded'}}
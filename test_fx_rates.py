@@ -0,0 +1,50 @@
+import asyncio
+import fx_rates
+import pytest
+
+RATES = '/api/v3/exchange_rates'
+
+
+def test_rates_are_refreshed_once_stale(fake_api):
+    async def main():
+        async with fake_api() as (fake, cg):
+            fx = fx_rates.FxTable(cg, max_age=300)
+            assert await fx.rate('usd') == 1.0
+            assert fake.requests.get(RATES, 0) == 0
+
+            assert await fx.rate('eur') == pytest.approx(0.92)
+            assert await fx.rate('jpy') == pytest.approx(150.0)
+            assert await fx.rate('xyz') is None
+            assert fx.names['eur'] == 'Euro'
+            cg.cache.clear()
+            await fx.rate('eur')
+            assert fake.requests[RATES] == 1
+
+            fx.updated -= 301
+            cg.cache.clear()
+            await fx.rate('eur')
+            assert fake.requests[RATES] == 2
+
+    asyncio.run(main())
+
+
+def test_old_rates_are_kept_when_a_refresh_fails(fake_api):
+    async def main():
+        async with fake_api() as (fake, cg):
+            fx = fx_rates.FxTable(cg, max_age=0)
+            eur = await fx.rate('eur')
+            updated = fx.updated
+
+            async def failing(priority=None):
+                raise RuntimeError('CoinGecko is down')
+            cg.exchange_rates = failing
+            assert await fx.rate('eur') == eur
+
+            async def without_usd(priority=None):
+                return {'rates': {'eur': {'name': 'Euro', 'value': 1.0}}}
+            cg.exchange_rates = without_usd
+            assert await fx.rate('eur') == eur
+            assert fx.updated == updated
+            assert fx.search('e') == ['eur']
+
+    asyncio.run(main())
@@ -0,0 +1,68 @@
+import asyncio
+import history_store
+import numpy as np
+import time
+
+DAY = history_store.DAY
+HOUR_MS = 60 * 60 * 1000
+CHART = '/api/v3/coins/{id}/market_chart/range'
+
+
+def test_repeated_range_is_read_locally(fake_api):
+    async def main():
+        async with fake_api() as (fake, cg):
+            await cg.new_coins()
+            id = fake.coins[0]['id']
+            store = history_store.HistoryStore(cg)
+            end = int(time.time())
+            times, prices = await store.prices(id, end - 30 * DAY, end)
+            assert len(times) > 700
+            assert np.all(np.diff(times) == HOUR_MS)
+            fetched = fake.requests[CHART]
+
+            again, _ = await store.prices(id, end - 20 * DAY, end - 10 * DAY)
+            assert fake.requests[CHART] == fetched
+            assert np.array_equal(again, times[(times >= (end - 20 * DAY) * 1000) & (times <= (end - 10 * DAY) * 1000)])
+            store.close()
+
+    asyncio.run(main())
+
+
+def test_gaps_longer_than_the_tier_keep_its_granularity(fake_api):
+    async def main():
+        async with fake_api() as (fake, cg):
+            await cg.new_coins()
+            id = fake.coins[0]['id']
+            store = history_store.HistoryStore(cg)
+            now = int(time.time())
+            await store.prices(id, now - 160 * DAY, now - 100 * DAY)
+
+            # The gap to the covered range is 100 days, longer than hourly data is served for.
+            times, _ = await store.prices(id, now - 60 * DAY, now)
+            assert len(times) > 1400
+            assert np.all(np.diff(times) <= HOUR_MS)
+
+            # Nothing coarser was stored between the two requests either.
+            times, _ = await store.prices(id, now - 90 * DAY, now - 60 * DAY)
+            assert np.all(np.diff(times) <= HOUR_MS)
+            store.close()
+
+    asyncio.run(main())
+
+
+def test_tiers_are_stored_separately(fake_api):
+    async def main():
+        async with fake_api() as (fake, cg):
+            await cg.new_coins()
+            id = fake.coins[0]['id']
+            store = history_store.HistoryStore(cg)
+            now = int(time.time())
+            hourly, _ = await store.prices(id, now - 30 * DAY, now)
+            five_minutes, _ = await store.prices(id, now - DAY // 2, now)
+            daily, _ = await store.prices(id, now - 365 * DAY, now)
+            assert np.all(np.diff(hourly) == HOUR_MS)
+            assert np.all(np.diff(five_minutes) == 5 * 60 * 1000)
+            assert np.all(np.diff(daily) == DAY * 1000)
+            store.close()
+
+    asyncio.run(main())
@@ -0,0 +1,30 @@
+import hot_cache
+
+
+def test_one_off_keys_dont_push_out_popular_ones():
+    cache = hot_cache.HotCache(capacity=2)
+    for key in ('bitcoin', 'ethereum'):
+        for _ in range(5):
+            cache.get(key)
+        assert cache.put(key, key.upper())
+
+    for i in range(20):
+        key = f'once{i}'
+        assert cache.get(key) is None
+        assert not cache.put(key, i)
+    assert cache.get('bitcoin') == 'BITCOIN' and cache.get('ethereum') == 'ETHEREUM'
+    assert cache.stats()['rejected'] == 20
+
+    # A key asked for more often than the least recently used one takes its place.
+    for _ in range(10):
+        cache.get('solana')
+    assert cache.put('solana', 'SOLANA')
+    assert sorted(key for key, _ in cache.items()) == ['ethereum', 'solana']
+
+
+def test_invalid_values_count_as_misses():
+    cache = hot_cache.HotCache(capacity=4)
+    cache.put('bitcoin', 1)
+    assert cache.get('bitcoin', valid=lambda value: value > 1) is None
+    assert cache.get('bitcoin') == 1
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
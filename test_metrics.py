@@ -0,0 +1,34 @@
+import metrics
+import pytest
+
+
+def test_histogram_buckets_include_their_upper_bound():
+    histogram = metrics.Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 1.0, 2.0):
+        histogram.observe(value)
+    assert histogram.counts == [2, 2, 1]
+    assert histogram.count == 5 and histogram.sum == pytest.approx(3.65)
+
+    assert histogram.quantile(0.4) == 0.1
+    assert histogram.quantile(0.5) == 1.0
+    assert histogram.quantile(0.99) == float('inf')
+    assert metrics.Histogram().quantile(0.5) == 0.0
+
+
+def test_prometheus_export_is_cumulative():
+    registry = metrics.Metrics()
+    registry.inc('commands', command='price', outcome='ok')
+    registry.inc('commands', 2, command='price', outcome='ok')
+    registry.observe('command_seconds', 0.003, command='price')
+    registry.observe('command_seconds', 0.2, command='price')
+    registry.add_collector(lambda: {('queued', ()): 4})
+    registry.add_collector(lambda: 1 / 0)
+
+    lines = registry.render_prometheus().splitlines()
+    assert 'commands_total{command="price",outcome="ok"} 3' in lines
+    assert 'queued 4' in lines
+    assert 'command_seconds_bucket{command="price",le="0.0025"} 0' in lines
+    assert 'command_seconds_bucket{command="price",le="0.005"} 1' in lines
+    assert 'command_seconds_bucket{command="price",le="0.25"} 2' in lines
+    assert 'command_seconds_bucket{command="price",le="+Inf"} 2' in lines
+    assert 'command_seconds_count{command="price"} 2' in lines
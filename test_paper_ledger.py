@@ -0,0 +1,97 @@
+import alert_cog
+import asyncio
+import coingecko_cog
+import paper_ledger
+import paper_trader_cog
+import pytest
+
+
+def test_trades_update_cash_and_cost_basis(tmp_path):
+    async def main():
+        path = str(tmp_path / 'paper.sqlite3')
+        ledger = paper_ledger.PaperLedger(path, starting_cash=1000.0)
+        account = (1, 2)
+        assert await ledger.buy(account, 'bitcoin', 500.0, 100.0) == 5.0
+        with pytest.raises(paper_ledger.TradeError):
+            await ledger.buy(account, 'bitcoin', 600.0, 100.0)
+        assert await ledger.sell(account, 'bitcoin', 2.0, 200.0) == 2.0
+        cash, holdings = ledger.account(account)
+        assert cash == 900.0
+        assert holdings == {'bitcoin': paper_ledger.Holding(3.0, 300.0)}
+
+        with pytest.raises(paper_ledger.TradeError):
+            await ledger.sell(account, 'ethereum', None, 1.0)
+        assert await ledger.sell(account, 'bitcoin', None, 100.0) == 3.0
+        ledger.close()
+
+        ledger = paper_ledger.PaperLedger(path, starting_cash=1000.0)
+        assert ledger.account(account) == (1200.0, {})
+        assert ledger.held_ids() == []
+        ledger.close()
+
+    asyncio.run(main())
+
+
+def test_value_all_marks_every_account_to_market():
+    async def main():
+        ledger = paper_ledger.PaperLedger(starting_cash=100.0)
+        await ledger.buy((1, 1), 'bitcoin', 50.0, 10.0)
+        await ledger.buy((1, 1), 'ethereum', 50.0, 5.0)
+        await ledger.buy((1, 2), 'ethereum', 20.0, 5.0)
+        await ledger.buy((2, 1), 'dogecoin', 10.0, 1.0)
+
+        accounts, totals = ledger.value_all({'bitcoin': 20.0, 'ethereum': 1.0})
+        # dogecoin has no price and is valued at its last trade.
+        assert dict(zip(accounts, totals.tolist())) == {(1, 1): 110.0, (1, 2): 84.0, (2, 1): 100.0}
+
+        await ledger.sell((1, 1), 'bitcoin', None, 20.0)
+        accounts, totals = ledger.value_all({'bitcoin': 20.0, 'ethereum': 1.0})
+        assert dict(zip(accounts, totals.tolist()))[(1, 1)] == 110.0
+        ledger.close()
+
+    asyncio.run(main())
+
+
+def test_book_values_accounts_from_one_price_request(fake_api):
+    async def main():
+        async with fake_api() as (fake, cg):
+            ids = [coin['id'] for coin in fake.coins[:3]]
+            book = paper_trader_cog.PaperBook(cg, paper_ledger.PaperLedger(starting_cash=1000.0))
+            for user_id, id in enumerate(ids):
+                await book.buy((1, user_id), id, 100.0 * (user_id + 1))
+            await book.buy((2, 0), ids[0], 10.0)
+            trades = fake.requests['/api/v3/simple/price']
+
+            cg.cache.clear()
+            await book.tick()
+            assert fake.requests['/api/v3/simple/price'] == trades + 1
+            accounts, totals = book.ledger.value_all(book.prices)
+            expected = sorted(((total, user_id) for (guild_id, user_id), total in zip(accounts, totals.tolist())
+                               if guild_id == 1), reverse=True)
+            assert await book.leaderboard(1) == expected
+            assert [user_id for _, user_id in await book.leaderboard(2)] == [0]
+
+            cash, positions, starting_cash = await book.portfolio((1, 2))
+            assert (cash, starting_cash) == (700.0, 1000.0)
+            assert [(p.coin_id, p.price) for p in positions] == [(ids[2], book.prices[ids[2]])]
+            book.close()
+
+    asyncio.run(main())
+
+
+def test_trading_and_alert_commands_share_coin_autocomplete(fake_api):
+    async def main():
+        async with fake_api() as (fake, cg):
+            await cg.new_coins()
+            cog = paper_trader_cog.PaperTraderCog(None, cg, paper_trader_cog.PaperBook(cg, paper_ledger.PaperLedger()),
+                                                  valuate=False)
+            options = [option for command in (cog.buy, cog.sell, alert_cog.AlertCog.add_alert)
+                       for option in command.options if option.name == 'id']
+            assert all(option.autocomplete is coingecko_cog.symbol_id_searcher for option in options)
+
+            # py-cord passes the command's cog, any with a cg will do.
+            ctx = type('Context', (), {'value': fake.coins[0]['symbol']})()
+            assert await options[0].autocomplete(cog, ctx) == cg.search(fake.coins[0]['symbol'])
+            cog.cog_unload()
+
+    asyncio.run(main())
@@ -0,0 +1,16 @@
+import numpy as np
+import price_series
+
+
+def test_align_is_nan_outside_each_series():
+    first = (np.array([0.0, 10.0]), np.array([1.0, 2.0]))
+    second = (np.array([5.0, 20.0]), np.array([4.0, 4.0]))
+    times, rows = price_series.align([first, second], 5)
+    assert times.tolist() == [0.0, 5.0, 10.0, 15.0, 20.0]
+    assert np.array_equal(rows[0], [1.0, 1.5, 2.0, np.nan, np.nan], equal_nan=True)
+    assert np.array_equal(rows[1], [np.nan, 4.0, 4.0, 4.0, 4.0], equal_nan=True)
+
+
+def test_percent_change_starts_at_each_rows_first_price():
+    rows = np.array([[2.0, 3.0, 1.0], [np.nan, 4.0, 5.0]])
+    assert np.array_equal(price_series.percent_change(rows), [[0.0, 50.0, -50.0], [np.nan, 0.0, 25.0]], equal_nan=True)
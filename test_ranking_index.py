@@ -0,0 +1,56 @@
+import asyncio
+import market_snapshot
+import ranking_index
+import rankings_cog
+
+CHANGE = ranking_index.change_metric('24h')
+
+
+def test_pages_follow_updates_and_removals():
+    index = ranking_index.RankingIndex([ranking_index.MARKET_CAP, CHANGE])
+    index.update([{'id': f'coin{i}', ranking_index.MARKET_CAP: i * 100, CHANGE: 5 - i} for i in range(10)])
+    assert [id for _, id in index.page(ranking_index.MARKET_CAP, 0, 3)] == ['coin9', 'coin8', 'coin7']
+    assert [id for _, id in index.page(ranking_index.MARKET_CAP, 9, 3)] == ['coin0']
+    assert [id for _, id in index.page(CHANGE, 0, 2, descending=False)] == ['coin9', 'coin8']
+    assert index.page(ranking_index.MARKET_CAP, 10, 3) == []
+
+    index.update([{'id': 'coin0', ranking_index.MARKET_CAP: 10000, CHANGE: None}])
+    assert index.page(ranking_index.MARKET_CAP, 0, 1) == [(10000, 'coin0')]
+    assert index.count(CHANGE) == 9
+
+    index.remove(['coin9', 'missing'])
+    assert len(index) == 9
+    assert index.count(ranking_index.MARKET_CAP) == 9
+
+
+def test_coins_without_metrics_are_not_counted():
+    index = ranking_index.RankingIndex([ranking_index.MARKET_CAP])
+    index.update([{'id': 'a', ranking_index.MARKET_CAP: 1}, {'id': 'b', ranking_index.MARKET_CAP: None}])
+    assert len(index) == 1
+
+    index.update([{'id': 'a', ranking_index.MARKET_CAP: None}])
+    assert len(index) == 0
+    assert index.count(ranking_index.MARKET_CAP) == 0
+
+
+def test_rankings_are_shown_in_the_server_currency(fake_api):
+    async def main():
+        async with fake_api() as (fake, cg):
+            snapshot = market_snapshot.MarketSnapshot(cg, top_n=25)
+            await snapshot.refresh()
+            cog = rankings_cog.RankingsCog(None, snapshot)
+            value, id = snapshot.rankings.page(ranking_index.MARKET_CAP, 0, 1)[0]
+
+            embed = cog.rankings_embed('Top', ranking_index.MARKET_CAP, True, 0, 3, 'eur', 2.0)
+            first = embed.description.splitlines()[0]
+            assert first.startswith(f"1. {snapshot.rows[id]['name']}")
+            assert first.endswith(f'{value * 2:,.0f} EUR')
+            assert embed.footer.text == f'Page 1/3 of the top {len(snapshot.rankings)} coins by market cap'
+            assert len(embed.description.splitlines()) == rankings_cog.PAGE_SIZE
+
+            usd = cog.rankings_embed('Top', ranking_index.MARKET_CAP, True, 2, 3)
+            assert usd.description.splitlines()[0].startswith('21. ')
+            assert usd.description.splitlines()[0].endswith(
+                f'${snapshot.rankings.page(ranking_index.MARKET_CAP, 20, 1)[0][0]:,.0f}')
+
+    asyncio.run(main())
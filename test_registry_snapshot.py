@@ -0,0 +1,44 @@
+import asyncio
+import coingecko_helper
+import os
+import registry_snapshot
+
+
+def test_snapshot_restores_the_registry(fake_api, tmp_path):
+    async def main():
+        path = str(tmp_path / 'registry.snapshot')
+        async with fake_api() as (fake, cg):
+            await cg.new_coins()
+            coin = fake.coins[0]
+            cg.set_preferred(coin['symbol'].upper(), coin['id'])
+            cg.update_ranks({coin['id']: 1})
+            snapshot = registry_snapshot.RegistrySnapshot(path)
+            await snapshot.save(cg)
+
+            # Nothing changed, nothing written.
+            written = os.stat(path).st_mtime_ns
+            await snapshot.save(cg)
+            assert os.stat(path).st_mtime_ns == written
+
+        restored = coingecko_helper.CoinGeckoAPI()
+        assert registry_snapshot.RegistrySnapshot(path).load(restored)
+        assert restored.coins.keys() == cg.coins.keys()
+        assert restored.coins_digest == cg.coins_digest
+        assert restored.lookup(coin['symbol'].upper()) == coin['id']
+        assert restored.search_ids(coin['id'])[0] == coin['id']
+
+        # The same coin list fetched after a restart isn't new.
+        async with fake_api() as (_, fresh):
+            fresh.load_registry(restored.export_registry())
+            assert await fresh.new_coins() == set()
+
+    asyncio.run(main())
+
+
+def test_unusable_snapshots_are_ignored(tmp_path):
+    cg = coingecko_helper.CoinGeckoAPI()
+    assert not registry_snapshot.RegistrySnapshot(str(tmp_path / 'missing')).load(cg)
+    path = tmp_path / 'corrupt'
+    path.write_bytes(b'not a snapshot')
+    assert not registry_snapshot.RegistrySnapshot(str(path)).load(cg)
+    assert not cg.coins
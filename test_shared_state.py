@@ -0,0 +1,182 @@
+import alert_engine
+import asyncio
+import contextlib
+import guild_settings
+import history_store
+import market_snapshot
+import numpy as np
+import paper_ledger
+import paper_trader_cog
+import pytest
+import registry_snapshot
+import shard_cluster
+import shared_state
+import time
+
+CHART = '/api/v3/coins/{id}/market_chart/range'
+
+
+@contextlib.asynccontextmanager
+async def cluster(fake_api, tmp_path, workers=2):
+    """Yields (fake, parent SharedState, [worker RemoteCoinGeckoAPI]) served over a unix socket."""
+    async with fake_api() as (fake, cg):
+        await cg.new_coins()
+        state = shared_state.SharedState(
+            cg,
+            registry=registry_snapshot.RegistrySnapshot(str(tmp_path / 'registry.snapshot')),
+            history=history_store.HistoryStore(cg),
+            settings=guild_settings.GuildSettings(str(tmp_path / 'settings.json')),
+            alerts=alert_engine.AlertEngine(max_per_user=2),
+            book=paper_trader_cog.PaperBook(cg, paper_ledger.PaperLedger()),
+            snapshot=market_snapshot.MarketSnapshot(cg, top_n=25))
+        server = shard_cluster.FetcherServer(cg, str(tmp_path / 'fetcher.sock'))
+        state.serve(server)
+        await server.start()
+        remotes = [shard_cluster.RemoteCoinGeckoAPI(server.path, api_base_url=cg.api_base_url) for _ in range(workers)]
+        try:
+            yield fake, state, remotes
+        finally:
+            for remote in remotes:
+                await remote.close()
+            state.close()
+            server.server.close()
+            await server.server.wait_closed()
+
+
+async def settle():
+    # Lets published messages reach the workers.
+    for _ in range(10):
+        await asyncio.sleep(0.01)
+
+
+def test_preferences_and_currencies_reach_every_worker(fake_api, tmp_path):
+    async def main():
+        async with cluster(fake_api, tmp_path) as (fake, state, (first, second)):
+            coin = fake.coins[0]
+            settings = [shared_state.RemoteGuildSettings(remote) for remote in (first, second)]
+            await second.start()
+
+            await first.prefer(coin['symbol'].upper(), coin['id'])
+            await settings[0].set_currency(123, 'eur')
+            await settle()
+
+            assert second.preferred_ids[coin['symbol'].upper()] == coin['id']
+            assert [s.currency(123) for s in settings] == ['eur', 'eur']
+            assert guild_settings.GuildSettings(str(tmp_path / 'settings.json')).currency(123) == 'eur'
+
+            # A worker started later, say after resharding, gets them on connecting.
+            late = shard_cluster.RemoteCoinGeckoAPI(first.socket_path, api_base_url=first.api_base_url)
+            late_settings = shared_state.RemoteGuildSettings(late)
+            await late.start()
+            assert late.preferred_ids[coin['symbol'].upper()] == coin['id']
+            assert late_settings.currency(123) == 'eur'
+            await late.close()
+
+    asyncio.run(main())
+
+
+def test_alerts_are_checked_once_for_every_worker(fake_api, tmp_path):
+    async def main():
+        async with cluster(fake_api, tmp_path) as (fake, state, (first, second)):
+            coin_id = fake.coins[0]['id']
+            engines = [shared_state.RemoteAlertEngine(remote) for remote in (first, second)]
+            received = []
+
+            async def notify(fired):
+                received.append(fired)
+            engines[1].listen(notify)
+            await second.start()
+
+            alert = await engines[0].add(1, 10, coin_id, alert_engine.ABOVE, 0.0)
+            await engines[0].add(1, 10, coin_id, alert_engine.BELOW, 0.0)
+            with pytest.raises(alert_engine.AlertLimitReached):
+                await engines[1].add(1, 10, coin_id, alert_engine.ABOVE, 1.0)
+            assert [a.id for a in await engines[1].for_user(1)] == [alert.id, alert.id + 1]
+
+            await state.check_alerts()
+            await settle()
+            assert fake.requests['/api/v3/simple/price'] == 1
+            assert [[(a, price > 0) for a, price in fired] for fired in received] == [[(alert, True)]]
+            assert await engines[1].remove(1, alert.id + 1)
+            assert await engines[0].for_user(1) == []
+
+    asyncio.run(main())
+
+
+def test_history_is_fetched_once_for_every_worker(fake_api, tmp_path):
+    async def main():
+        async with cluster(fake_api, tmp_path) as (fake, state, remotes):
+            id = fake.coins[0]['id']
+            stores = [shared_state.RemoteHistoryStore(remote) for remote in remotes]
+            end = int(time.time())
+            times, prices = await stores[0].prices(id, end - 30 * history_store.DAY, end)
+            fetched = fake.requests[CHART]
+
+            start, stop = end - 20 * history_store.DAY, end - 10 * history_store.DAY
+            (again, again_prices), = await stores[1].prices_many([id], start, stop)
+            assert fake.requests[CHART] == fetched
+            inside = (times >= start * 1000) & (times <= stop * 1000)
+            assert np.array_equal(again, times[inside]) and np.array_equal(again_prices, prices[inside])
+
+    asyncio.run(main())
+
+
+def test_paper_trades_and_stats_come_from_the_parent(fake_api, tmp_path):
+    async def main():
+        async with cluster(fake_api, tmp_path) as (fake, state, (first, second)):
+            coin_id = fake.coins[0]['id']
+            books = [shared_state.RemotePaperBook(remote) for remote in (first, second)]
+            amount, price = await books[0].buy((1, 2), coin_id, 100.0)
+            assert amount * price == pytest.approx(100.0)
+            with pytest.raises(paper_ledger.TradeError):
+                await books[1].buy((1, 2), coin_id, 1e9)
+
+            cash, positions, starting_cash = await books[1].portfolio((1, 2))
+            assert cash == starting_cash - 100.0
+            assert [(p.coin_id, p.amount) for p in positions] == [(coin_id, amount)]
+
+            await state.book.tick()
+            assert await books[1].leaderboard(1) == [(pytest.approx(starting_cash), 2)]
+
+            await state.publish_stats()
+            await settle()
+            assert second.cache_stats() == state.cg.cache_stats()
+
+    asyncio.run(main())
+
+
+def test_coin_list_snapshot_and_rates_are_fetched_once_for_every_worker(fake_api, tmp_path):
+    async def main():
+        async with cluster(fake_api, tmp_path) as (fake, state, remotes):
+            snapshots = [market_snapshot.MarketSnapshot(remote, top_n=25) for remote in remotes]
+            tables = [shared_state.RemoteFxTable(remote) for remote in remotes]
+            updates = []
+            for remote, snapshot in zip(remotes, snapshots):
+                remote.subscribe('snapshot', snapshot.update)
+                remote.subscribe('coins', lambda _, remote=remote: updates.append(asyncio.ensure_future(remote.new_coins())))
+                await remote.start()
+                # The parent's list is still cached.
+                await remote.new_coins()
+            assert fake.requests['/api/v3/coins/list'] == 1
+
+            await state.refresh_snapshot()
+            await state.refresh_rates()
+            # An hour later the list has expired from the parent's cache.
+            fake.churn()
+            state.cg.cache.clear()
+            await state.update_coins()
+            await settle()
+            await asyncio.gather(*updates)
+            assert fake.requests['/api/v3/coins/list'] == 2
+            assert fake.requests['/api/v3/coins/markets'] == 1
+            assert fake.requests['/api/v3/exchange_rates'] == 1
+
+            top = state.snapshot.rankings.page(market_snapshot.ranking_index.MARKET_CAP, 0, 1)[0][1]
+            for remote, snapshot, table in zip(remotes, snapshots, tables):
+                assert set(remote.coins) == set(state.cg.coins)
+                assert snapshot.get(top) == state.snapshot.get(top)
+                assert len(snapshot.rankings) == len(state.snapshot.rankings)
+                assert await table.rate('eur') == state.fx.rates['eur']
+            assert fake.requests['/api/v3/exchange_rates'] == 1
+
+    asyncio.run(main())
@@ -0,0 +1,73 @@
+import asyncio
+import coingecko_cog
+import coingecko_helper
+import hot_cache
+import stats_cog
+
+from metrics import METRICS
+
+
+class StubCoinGeckoCog:
+    def __init__(self):
+        self.hot_prices = hot_cache.HotCache(capacity=4)
+
+
+class StubClient:
+    def __init__(self, latency):
+        self.latency = latency
+        self.cog = StubCoinGeckoCog()
+
+    def get_cog(self, name):
+        return self.cog if name == 'CoinGeckoCog' else None
+
+
+class StubContext:
+    def __init__(self):
+        self.responses = []
+
+    async def respond(self, embed=None, ephemeral=False):
+        self.responses.append((embed, ephemeral))
+
+
+def test_collector_reports_caches_queue_and_latency():
+    client = StubClient(latency=0.05)
+    cog = stats_cog.StatsCog(client, coingecko_helper.CoinGeckoAPI())
+    try:
+        client.cog.hot_prices.put('bitcoin', 1)
+        gauges = cog.collect()
+        assert gauges[('coingecko_queued_requests', ())] == 0
+        assert gauges[('coingecko_cache_size', ())] == 0
+        assert gauges[('hot_price_cache_size', ())] == 1
+        assert gauges[('discord_gateway_latency_seconds', ())] == 0.05
+        assert ('description_cache_hits', ()) in gauges
+
+        # Before connecting the latency is infinite, and left out.
+        client.latency = float('inf')
+        assert ('discord_gateway_latency_seconds', ()) not in cog.collect()
+        assert METRICS.gauges()[('hot_price_cache_size', ())] == 1
+    finally:
+        cog.cog_unload()
+    assert cog.collect not in METRICS.collectors
+
+
+def test_stats_shows_histograms_and_gauges():
+    async def main():
+        client = StubClient(latency=0.05)
+        cog = stats_cog.StatsCog(client, coingecko_helper.CoinGeckoAPI())
+        try:
+            for seconds in (0.004, 0.004, 2.0):
+                METRICS.observe('test_stats_seconds', seconds, command='price')
+            ctx = StubContext()
+            await cog.stats.callback(cog, ctx)
+            (embed, ephemeral), = ctx.responses
+            assert ephemeral
+            lines = embed.description.splitlines()
+            assert lines[0] == '```' and lines[-1] == '```'
+            row = lines[lines.index('test_stats_seconds') + 1].split()
+            assert row == ['price', 'n=3', 'p50=5ms', 'p99=2.5s']
+            assert any(line.split() == ['discord_gateway_latency_seconds', '0.05'] for line in lines)
+            assert len(embed.description) <= coingecko_cog.MAX_DESCRIPTION
+        finally:
+            cog.cog_unload()
+
+    asyncio.run(main())